@@ -0,0 +1,86 @@
+import math
+import re
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r'[A-Za-z0-9]+')
+CAMELCASE_PATTERN = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+')
+# Common English words ignored in the documents and the queries
+STOPWORDS = {'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'for', 'from', 'get', 'give', 'has', 'have', 'how', 'i',
+             'in', 'is', 'it', 'its', 'me', 'my', 'of', 'on', 'or', 'please', 'show', 'that', 'the', 'their', 'them', 'there', 'these',
+             'this', 'those', 'to', 'was', 'were', 'what', 'when', 'where', 'which', 'who', 'will', 'with', 'you', 'your'}
+
+def tokenize(text):
+    """
+    Split a text in lowercase terms. CamelCase identifiers (ie. SigninLogs) produce the full identifier and its parts.
+    Stopwords are ignored.
+
+    :param text: Text to tokenize
+    :return: List of terms
+    """
+    terms = []
+    for word in TOKEN_PATTERN.findall(str(text)):
+        terms.append(word.lower())
+        parts = CAMELCASE_PATTERN.findall(word)
+        if len(parts) > 1:
+            terms.extend(part.lower() for part in parts)
+    return [term for term in terms if term not in STOPWORDS]
+
+class BM25Index:
+    """
+    Minimal in-memory BM25 index used to rank documents (tables, text chunks) locally before sending them to the LLM.
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        """
+        Build the index.
+
+        :param documents: Dictionary with the document id and the document text
+        :param k1: BM25 term frequency saturation parameter
+        :param b: BM25 document length normalization parameter
+        """
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = list(documents.keys())
+        self.term_frequencies = {}
+        self.doc_lengths = {}
+        document_frequencies = Counter()
+        for doc_id, text in documents.items():
+            terms = tokenize(text)
+            frequencies = Counter(terms)
+            self.term_frequencies[doc_id] = frequencies
+            self.doc_lengths[doc_id] = len(terms)
+            document_frequencies.update(frequencies.keys())
+        self.avg_doc_length = (sum(self.doc_lengths.values()) / len(self.doc_ids)) if self.doc_ids else 0
+        doc_count = len(self.doc_ids)
+        self.idf = {term: math.log(1 + (doc_count - freq + 0.5) / (freq + 0.5)) for term, freq in document_frequencies.items()}
+
+    def score(self, query):
+        """
+        Score all the documents against a query.
+
+        :param query: Query text
+        :return: Dictionary with the score of each document
+        """
+        query_terms = set(tokenize(query))
+        scores = {}
+        for doc_id in self.doc_ids:
+            frequencies = self.term_frequencies[doc_id]
+            length_norm = 1 - self.b + self.b * (self.doc_lengths[doc_id] / self.avg_doc_length if self.avg_doc_length else 0)
+            score = 0.0
+            for term in query_terms:
+                frequency = frequencies.get(term)
+                if frequency:
+                    score += self.idf[term] * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+            scores[doc_id] = score
+        return scores
+
+    def search(self, query, top_k=None):
+        """
+        Rank the documents for a query.
+
+        :param query: Query text
+        :param top_k: Maximum number of results (all documents if not provided)
+        :return: List of (document id, score) tuples sorted by descending score
+        """
+        ranking = sorted(self.score(query).items(), key=lambda item: item[1], reverse=True)
+        return ranking[:top_k] if top_k else ranking
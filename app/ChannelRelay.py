@@ -0,0 +1,50 @@
+import queue
+import threading
+
+class ChannelRelay:
+    """
+    Relay the channel messages sent from worker threads to the thread that owns the channel.
+    Some channels (ie. Flask-SocketIO emit) can only be used from the thread that received the request.
+    """
+
+    def __init__(self, channel):
+        """
+        Initialize the relay.
+
+        :param channel: Channel callback (message type, message object). Can be None
+        """
+        self.channel = channel
+        self.owner = threading.current_thread()
+        self.messages = queue.Queue()
+
+    def send(self, message_type, message_object):
+        """
+        Channel callback to be used by the worker threads.
+
+        :param message_type: Type of message (systemmessage, debugmessage, resultmessage)
+        :param message_object: Message object
+        """
+        if self.channel is None:
+            return
+        if threading.current_thread() is self.owner:
+            self.channel(message_type, message_object)
+        else:
+            self.messages.put((message_type, message_object))
+
+    def flush(self, timeout=None):
+        """
+        Forward the pending messages to the channel. Must be called from the owner thread.
+
+        :param timeout: Seconds to wait for a message when there are no pending messages
+        """
+        try:
+            message_type, message_object = self.messages.get(timeout=timeout) if timeout else self.messages.get_nowait()
+        except queue.Empty:
+            return
+        self.channel(message_type, message_object)
+        while True:
+            try:
+                message_type, message_object = self.messages.get_nowait()
+            except queue.Empty:
+                return
+            self.channel(message_type, message_object)
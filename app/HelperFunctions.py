@@ -1,5 +1,11 @@
 from colorama import Fore
 import json
+import os
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+_token_encoder = None
 def print_info(text):
     print(f"{Fore.GREEN}[Info] {Fore.WHITE}"+text)
 def print_debug(text):
@@ -21,4 +27,31 @@ def saveToFile(content):
                 json.dump(content, f, ensure_ascii=False, indent=4)
                 f.close()
             response='File Saved:'+user_input
-        return response
\ No newline at end of file
+        return response
+def count_tokens(text):
+    """
+    Count the tokens of a text using the local tokenizer (tiktoken). Falls back to an estimation (4 characters per token)
+    when tiktoken or its encoding files are not available.
+    """
+    global _token_encoder
+    text = str(text)
+    if _token_encoder is None and tiktoken is not None:
+        try:
+            _token_encoder = tiktoken.get_encoding(os.getenv('ASSISTANT_TOKENIZER_ENCODING', 'o200k_base'))
+        except Exception:
+            _token_encoder = False
+    if _token_encoder:
+        return len(_token_encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+def count_message_tokens(messages):
+    """
+    Count the tokens of a list of chat messages (string or multi-part content).
+    """
+    tokens = 0
+    for message in messages:
+        content = message.get('content', '')
+        if isinstance(content, list):
+            content = ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+        # Each message has a small fixed overhead (role and separators)
+        tokens += count_tokens(content) + 4
+    return tokens
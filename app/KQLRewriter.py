@@ -0,0 +1,222 @@
+import re
+from datetime import timedelta
+from app.KQLValidator import KQLValidator, STRING_PATTERN, ASSIGNMENT_PATTERN
+
+# Time windows stated in the prompts (ie. "last 7 days", "past hour", "yesterday")
+LOOKBACK_PATTERN = re.compile(r'\b(?:last|past|previous|recent)\s+(\d+)?\s*(minute|min|hour|day|week|month)s?\b', re.IGNORECASE)
+LOOKBACK_KEYWORDS = [(re.compile(r'\btoday\b', re.IGNORECASE), timedelta(days=1)), (re.compile(r'\byesterday\b', re.IGNORECASE), timedelta(days=2)),
+                     (re.compile(r'\bthis week\b', re.IGNORECASE), timedelta(days=7)), (re.compile(r'\bthis month\b', re.IGNORECASE), timedelta(days=31))]
+LOOKBACK_UNITS = {'minute': timedelta(minutes=1), 'min': timedelta(minutes=1), 'hour': timedelta(hours=1), 'day': timedelta(days=1),
+                  'week': timedelta(days=7), 'month': timedelta(days=31)}
+# TimeGenerated filters with a relative time (ie. TimeGenerated > ago(7d))
+TIME_FILTER_PATTERN = re.compile(r'\bTimeGenerated\s*(>=?)\s*ago\s*\(\s*(\d+(?:\.\d+)?)\s*(d|h|m|s|ms)?\s*\)')
+TIMESPAN_UNITS = {'d': timedelta(days=1), 'h': timedelta(hours=1), 'm': timedelta(minutes=1), 's': timedelta(seconds=1), 'ms': timedelta(milliseconds=1), None: timedelta(days=1)}
+ABSOLUTE_TIME_PATTERN = re.compile(r'\b(datetime|between|startofday|startofweek|startofmonth|startofyear)\s*\(', re.IGNORECASE)
+# Operators a where clause can be moved before without changing the result (if it doesn't use the columns they create)
+PUSHDOWN_OPERATORS = {'extend', 'project', 'project-away', 'project-keep', 'project-reorder'}
+# Operators that keep or reduce the rows of a previous take/top
+ROW_PRESERVING_OPERATORS = {'project', 'project-away', 'project-keep', 'project-reorder', 'project-rename', 'extend', 'sort', 'order', 'where', 'filter', 'render'}
+# Server timeout (seconds) derived from the time window. The service doesn't accept more than 10 minutes
+MIN_SERVER_TIMEOUT = 30
+MAX_SERVER_TIMEOUT = 600
+SERVER_TIMEOUT_PER_DAY = 6
+
+class KQLRewriter:
+    """
+    Cost-aware rewrite of generated KQL queries before they are run. It adds (or tightens) a TimeGenerated filter right
+    after the table reference, moves where clauses before extend/project, caps the number of returned rows and derives
+    an explicit query timespan and server timeout from the time window of the prompt.
+    Queries that can't be safely parsed (let statements, unions, absolute time filters...) are only capped.
+    """
+
+    def __init__(self, default_lookback=timedelta(days=30), max_rows=1000):
+        """
+        Initialize the rewriter.
+
+        :param default_lookback: Time window used when neither the prompt nor the query define one
+        :param max_rows: Maximum number of rows returned by a query
+        """
+        self.default_lookback = default_lookback
+        self.max_rows = max_rows
+
+    @staticmethod
+    def get_prompt_lookback(prompt):
+        """
+        Get the time window stated in a prompt.
+
+        :return: timedelta or None if the prompt doesn't state a time window
+        """
+        lookbacks = [int(match.group(1) or 1) * LOOKBACK_UNITS[match.group(2).lower()] for match in LOOKBACK_PATTERN.finditer(prompt or '')]
+        lookbacks += [lookback for pattern, lookback in LOOKBACK_KEYWORDS if pattern.search(prompt or '')]
+        return max(lookbacks) if lookbacks else None
+
+    @staticmethod
+    def format_timespan(lookback):
+        """
+        Format a timedelta as a KQL timespan literal (ie. 7d, 12h, 30m).
+        """
+        seconds = int(lookback.total_seconds())
+        for unit, unit_seconds in (('d', 86400), ('h', 3600), ('m', 60)):
+            if seconds % unit_seconds == 0:
+                return f"{seconds // unit_seconds}{unit}"
+        return f"{seconds}s"
+
+    @staticmethod
+    def get_server_timeout(lookback):
+        """
+        Server timeout (seconds) for a time window: short windows fail fast, long windows get more time.
+        """
+        days = lookback.total_seconds() / 86400
+        return int(min(MAX_SERVER_TIMEOUT, max(MIN_SERVER_TIMEOUT, MIN_SERVER_TIMEOUT + SERVER_TIMEOUT_PER_DAY * days)))
+
+    @staticmethod
+    def split_segments(query):
+        """
+        Split a query in its top-level pipe segments, removing the comments and keeping the string literals.
+
+        :return: Tuple with the list of segments and the list of the same segments with the string literals blanked
+        """
+        masked = STRING_PATTERN.sub(lambda match: match.group(0)[0] + ' ' * (len(match.group(0)) - 1), query)
+        for comment in reversed(list(re.finditer(r'//[^\n]*', masked))):
+            query = query[:comment.start()] + query[comment.end():]
+            masked = masked[:comment.start()] + masked[comment.end():]
+        segments = []
+        masked_segments = []
+        start = 0
+        for index, part in enumerate(KQLValidator.split_top_level(masked, '|')):
+            segments.append(query[start:start + len(part)])
+            masked_segments.append(part)
+            start += len(part) + 1
+        return segments, masked_segments
+
+    @staticmethod
+    def find_time_filter(masked_segment):
+        """
+        Find the TimeGenerated filter of a segment of the main pipeline. Filters inside subqueries (ie. join or
+        union arguments in parentheses) are ignored.
+
+        :return: Match object or None
+        """
+        for match in TIME_FILTER_PATTERN.finditer(masked_segment):
+            prefix = masked_segment[:match.start()]
+            if prefix.count('(') - prefix.count(')') == 0:
+                return match
+        return None
+
+    @staticmethod
+    def get_operator(masked_segment):
+        match = re.match(r'\s*([A-Za-z][\w-]*)', masked_segment)
+        return match.group(1).lower() if match else ''
+
+    @staticmethod
+    def join_segments(segments, query):
+        """
+        Join the segments of a rewritten query, one operator per line if the original query was multiline.
+        """
+        separator = '\n| ' if '\n' in query else ' | '
+        return separator.join(segment.strip() for segment in segments if segment.strip())
+
+    def push_down_filters(self, segments, masked_segments, changes):
+        """
+        Move the where clauses before the extend/project operators that don't create the columns they use.
+        """
+        index = 2
+        while index < len(segments):
+            if self.get_operator(masked_segments[index]) in ('where', 'filter') and '*' not in masked_segments[index]:
+                arguments = re.sub(r'^\s*(where|filter)', '', masked_segments[index])
+                references = set(KQLValidator.get_references(arguments))
+                position = index
+                while position > 1 and self.get_operator(masked_segments[position - 1]) in PUSHDOWN_OPERATORS:
+                    previous = re.sub(r'^\s*[\w-]+', '', masked_segments[position - 1])
+                    created = {assignment.group(1) for assignment in (ASSIGNMENT_PATTERN.match(item) for item in KQLValidator.split_top_level(previous, ',')) if assignment}
+                    if references & created:
+                        break
+                    position -= 1
+                if position < index:
+                    changes.append(f"moved '{segments[index].strip()}' before '{self.get_operator(masked_segments[position])}'")
+                    segments.insert(position, segments.pop(index))
+                    masked_segments.insert(position, masked_segments.pop(index))
+            index += 1
+
+    def cap_rows(self, segments, masked_segments, changes):
+        """
+        Cap the rows returned: reduce the last take/limit/top above the cap or append a take (before a final render,
+        which must be the last operator).
+        """
+        position = len(segments)
+        while position > 1 and self.get_operator(masked_segments[position - 1]) == 'render':
+            position -= 1
+        for index in range(len(segments) - 1, 0, -1):
+            operator = self.get_operator(masked_segments[index])
+            if operator in ('take', 'limit', 'top'):
+                count = re.match(r'\s*[\w-]+\s+(\d+)', masked_segments[index])
+                if count and int(count.group(1)) > self.max_rows:
+                    segments[index] = segments[index].replace(count.group(1), str(self.max_rows), 1)
+                    changes.append(f"capped {operator} {count.group(1)} to {self.max_rows} rows")
+                return
+            if operator == 'count':
+                return
+            if operator not in ROW_PRESERVING_OPERATORS:
+                break
+        segments.insert(position, f"take {self.max_rows}")
+        masked_segments.insert(position, f"take {self.max_rows}")
+        changes.append(f"added take {self.max_rows}")
+
+    def rewrite(self, query, prompt=None, table_columns=None):
+        """
+        Rewrite a KQL query.
+
+        :param query: KQL query
+        :param prompt: Prompt the query was generated from (used to get the time window)
+        :param table_columns: Dictionary with the columns of each table (ie. KQLValidator.table_columns). The TimeGenerated
+                              filter is only added to tables known to have the column
+        :return: Dictionary with the rewritten query, timespan (timedelta or None), server timeout (seconds) and the list of changes
+        """
+        changes = []
+        query = query.strip().rstrip(';').strip()
+        segments, masked_segments = self.split_segments(query)
+        source = masked_segments[0].strip()
+        prompt_lookback = self.get_prompt_lookback(prompt)
+        if not re.fullmatch(r'[A-Za-z_]\w*', source) or ABSOLUTE_TIME_PATTERN.search(''.join(masked_segments)) or source.lower() in ('let', 'union', 'search', 'print', 'datatable', 'range'):
+            # The time window can't be inferred safely. Only the rows are capped
+            if len(segments) > 1 or re.fullmatch(r'[A-Za-z_]\w*', source):
+                self.cap_rows(segments, masked_segments, changes)
+            rewritten_query = self.join_segments(segments, query) if changes else query
+            return {"query": rewritten_query, "timespan": None, "server_timeout": self.get_server_timeout(prompt_lookback or self.default_lookback), "changes": changes}
+
+        table_name = source
+        time_filter = next((match for match in map(self.find_time_filter, masked_segments) if match), None)
+        if time_filter:
+            query_lookback = float(time_filter.group(2)) * TIMESPAN_UNITS[time_filter.group(3)]
+            lookback = min(query_lookback, prompt_lookback) if prompt_lookback else query_lookback
+            if lookback < query_lookback:
+                # Tighten the filter to the window of the prompt
+                for index, masked_segment in enumerate(masked_segments):
+                    match = self.find_time_filter(masked_segment)
+                    if match:
+                        segments[index] = segments[index][:match.start()] + f"TimeGenerated {match.group(1)} ago({self.format_timespan(lookback)})" + segments[index][match.end():]
+                        masked_segments[index] = masked_segments[index][:match.start()] + f"TimeGenerated {match.group(1)} ago({self.format_timespan(lookback)})" + masked_segments[index][match.end():]
+                        changes.append(f"tightened the TimeGenerated filter from {self.format_timespan(query_lookback)} to {self.format_timespan(lookback)}")
+                        break
+            if not self.find_time_filter(masked_segments[1] if len(masked_segments) > 1 else ''):
+                # Move the time filter right after the table reference
+                for index in range(2, len(segments)):
+                    if self.get_operator(masked_segments[index]) in ('where', 'filter') and TIME_FILTER_PATTERN.fullmatch(re.sub(r'^\s*(where|filter)\s*', '', masked_segments[index]).strip()):
+                        if all(self.get_operator(masked_segment) in PUSHDOWN_OPERATORS | {'where', 'filter'} for masked_segment in masked_segments[1:index]):
+                            segments.insert(1, segments.pop(index))
+                            masked_segments.insert(1, masked_segments.pop(index))
+                            changes.append("moved the TimeGenerated filter after the table reference")
+                        break
+        else:
+            lookback = prompt_lookback or self.default_lookback
+            if table_columns is not None and 'TimeGenerated' in table_columns.get(table_name, {}):
+                time_filter_segment = f"where TimeGenerated > ago({self.format_timespan(lookback)})"
+                segments.insert(1, time_filter_segment)
+                masked_segments.insert(1, time_filter_segment)
+                changes.append(f"added TimeGenerated filter ({self.format_timespan(lookback)})")
+        self.push_down_filters(segments, masked_segments, changes)
+        self.cap_rows(segments, masked_segments, changes)
+        rewritten_query = self.join_segments(segments, query) if changes else query
+        # The query timespan applies to every table of the query: it must also cover the time filters of the subqueries
+        timespan = max([lookback] + [float(match.group(2)) * TIMESPAN_UNITS[match.group(3)] for match in TIME_FILTER_PATTERN.finditer(''.join(masked_segments))])
+        return {"query": rewritten_query, "timespan": timespan, "server_timeout": self.get_server_timeout(timespan), "changes": changes}
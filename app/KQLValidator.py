@@ -0,0 +1,254 @@
+import re
+import difflib
+
+# Tabular operators accepted after the table reference
+KQL_OPERATORS = {
+    'where', 'filter', 'project', 'project-away', 'project-keep', 'project-rename', 'project-reorder', 'extend', 'summarize',
+    'take', 'limit', 'top', 'top-nested', 'top-hitters', 'sort', 'order', 'count', 'distinct', 'join', 'union', 'lookup',
+    'mv-expand', 'mv-apply', 'parse', 'parse-where', 'parse-kv', 'evaluate', 'render', 'as', 'getschema', 'serialize',
+    'sample', 'sample-distinct', 'search', 'make-series', 'invoke', 'partition', 'scan', 'fork', 'facet', 'find', 'consume',
+    'externaldata', 'reduce', 'range', 'print', 'datatable'
+}
+# Operators whose output columns can't be inferred. Field references are not validated after them
+OPAQUE_OPERATORS = {
+    'join', 'union', 'lookup', 'mv-expand', 'mv-apply', 'parse', 'parse-where', 'parse-kv', 'evaluate', 'make-series', 'invoke',
+    'partition', 'scan', 'fork', 'facet', 'find', 'search', 'reduce', 'top-nested', 'top-hitters', 'getschema', 'externaldata'
+}
+# Queries starting with these statements are not validated
+UNVALIDATED_STATEMENTS = {'let', 'union', 'search', 'print', 'datatable', 'range', 'find', 'set', 'declare', 'externaldata', 'materialize', 'evaluate'}
+# Words that are not column references (operators, keywords, literals and types)
+KQL_KEYWORDS = {
+    'and', 'or', 'not', 'in', 'has', 'contains', 'startswith', 'endswith', 'matches', 'regex', 'between', 'by', 'on', 'kind',
+    'with', 'asc', 'desc', 'nulls', 'first', 'last', 'true', 'false', 'null', 'bool', 'boolean', 'int', 'long', 'real', 'double',
+    'string', 'datetime', 'timespan', 'guid', 'decimal', 'dynamic', 'inner', 'innerunique', 'leftouter', 'rightouter', 'fullouter',
+    'leftanti', 'rightanti', 'leftsemi', 'rightsemi', 'anti', 'semi', 'isfuzzy', 'withsource', 'from', 'to', 'step', 'of', 'typeof',
+    'hasprefix', 'hassuffix', 'like', 'notlike', 'has_any', 'has_all', 'has_cs', 'contains_cs', 'startswith_cs', 'endswith_cs',
+    'in~', 'notcontains', 'notstartswith', 'notendswith', 'nothas', 'bin', 'hint', 'shufflekey', 'strategy', 'remote', 'local',
+    'broadcast', 'shuffle', 'output', 'withnull', 'bagexpansion', 'array', 'bag'
+}
+IDENTIFIER_PATTERN = re.compile(r'(?<![\w.$@\'"])([A-Za-z_][A-Za-z0-9_]*)(?![\w(])(?!\s*\()')
+STRING_PATTERN = re.compile(r'@?"(?:[^"\\\n]|\\.)*"|@?\'(?:[^\'\\\n]|\\.)*\'')
+ASSIGNMENT_PATTERN = re.compile(r'^\s*([A-Za-z_][A-Za-z0-9_]*)\s*=(?!=)')
+
+class KQLValidator:
+    """
+    Lightweight local validator of generated KQL queries. It checks the table reference, the operators and the column
+    references of where/project/extend/summarize/sort/top/distinct against the CSL schema of the tables.
+    The validation is conservative: parts of the query whose columns can't be inferred are not validated.
+    """
+
+    def __init__(self, table_schemas):
+        """
+        Initialize the validator.
+
+        :param table_schemas: Dictionary with the CSL schema of each table (ie. "TimeGenerated:datetime, Title:string")
+        """
+        self.table_columns = {table_name: self.parse_csl(table_schema) for table_name, table_schema in table_schemas.items()}
+
+    @staticmethod
+    def parse_csl(table_schema):
+        """
+        Parse a CSL schema.
+
+        :return: Dictionary with the type of each column
+        """
+        columns = {}
+        for field in table_schema.split(','):
+            if ':' in field:
+                name, column_type = field.rsplit(':', 1)
+                columns[name.strip().strip('[]\'"')] = column_type.strip()
+        return columns
+
+    @staticmethod
+    def strip_query(query):
+        """
+        Remove comments and replace string literals with empty strings so their content is not parsed.
+        """
+        return STRING_PATTERN.sub('""', re.sub(r'//[^\n]*', '', query))
+
+    @staticmethod
+    def split_top_level(text, separator):
+        """
+        Split a text by a separator ignoring the separators inside parentheses, brackets or braces.
+        """
+        parts = []
+        depth = 0
+        current = []
+        for character in text:
+            if character in '([{':
+                depth += 1
+            elif character in ')]}':
+                depth = max(0, depth - 1)
+            if character == separator and depth == 0:
+                parts.append(''.join(current))
+                current = []
+            else:
+                current.append(character)
+        parts.append(''.join(current))
+        return parts
+
+    @staticmethod
+    def get_references(expression):
+        """
+        Get the column references of an expression (identifiers that are not functions, keywords or properties).
+        """
+        return [identifier for identifier in IDENTIFIER_PATTERN.findall(expression) if identifier not in KQL_KEYWORDS and identifier.lower() not in KQL_KEYWORDS]
+
+    def check_references(self, expression, columns, table_name, operator, errors):
+        if columns is None:
+            return
+        for reference in self.get_references(expression):
+            if reference not in columns:
+                error = f"Column '{reference}' used in '{operator}' does not exist in table {table_name}"
+                suggestions = difflib.get_close_matches(reference, list(columns), n=3, cutoff=0.6)
+                if suggestions:
+                    error += f". Did you mean {', '.join(repr(suggestion) for suggestion in suggestions)}?"
+                if error not in errors:
+                    errors.append(error)
+
+    def apply_columns(self, operator, arguments, columns, table_name, errors):
+        """
+        Validate an operator and compute the columns available after it.
+
+        :return: Columns after the operator (None if they can't be inferred)
+        """
+        if operator in ('where', 'filter', 'take', 'limit', 'sample', 'serialize', 'render', 'as', 'sort', 'order', 'top'):
+            expression = re.sub(r'^\s*\d+\s+by\b', '', arguments) if operator == 'top' else arguments
+            if operator in ('sort', 'order'):
+                expression = re.sub(r'^\s*by\b', '', arguments)
+            if operator not in ('take', 'limit', 'sample', 'render', 'as'):
+                self.check_references(expression, columns, table_name, operator, errors)
+            return columns
+        if operator == 'count':
+            return {'Count': 'long'}
+        if operator in ('project', 'project-keep', 'project-reorder', 'distinct', 'sample-distinct'):
+            if columns is None:
+                return None
+            projected_columns = {}
+            for item in self.split_top_level(arguments, ','):
+                if not item.strip():
+                    continue
+                if re.fullmatch(r'\s*[\w*]*\*[\w*]*\s*', item) and operator != 'distinct':
+                    # Wildcards keep all the matching columns
+                    pattern = re.compile('^' + re.escape(item.strip()).replace('\\*', '.*') + '$')
+                    projected_columns.update({name: column_type for name, column_type in columns.items() if pattern.match(name)})
+                    continue
+                assignment = ASSIGNMENT_PATTERN.match(item)
+                if assignment:
+                    self.check_references(item[assignment.end():], columns, table_name, operator, errors)
+                    projected_columns[assignment.group(1)] = 'unknown'
+                elif operator == 'distinct' and item.strip() == '*':
+                    projected_columns.update(columns)
+                else:
+                    self.check_references(item, columns, table_name, operator, errors)
+                    references = self.get_references(item)
+                    if len(references) == 1 and item.strip() == references[0]:
+                        projected_columns[references[0]] = columns.get(references[0], 'unknown')
+                    else:
+                        # Expressions without alias get generated names
+                        return None
+            return projected_columns if operator not in ('project-keep', 'project-reorder') else columns
+        if operator == 'project-away':
+            if columns is None:
+                return None
+            removed = [item.strip() for item in self.split_top_level(arguments, ',') if item.strip()]
+            self.check_references(', '.join(item for item in removed if '*' not in item), columns, table_name, operator, errors)
+            return {name: column_type for name, column_type in columns.items() if name not in removed}
+        if operator == 'project-rename':
+            if columns is None:
+                return None
+            renamed_columns = dict(columns)
+            for item in self.split_top_level(arguments, ','):
+                assignment = ASSIGNMENT_PATTERN.match(item)
+                if assignment:
+                    source = item[assignment.end():].strip()
+                    self.check_references(source, columns, table_name, operator, errors)
+                    renamed_columns[assignment.group(1)] = renamed_columns.pop(source, 'unknown')
+            return renamed_columns
+        if operator == 'extend':
+            if columns is None:
+                return None
+            extended_columns = dict(columns)
+            for item in self.split_top_level(arguments, ','):
+                assignment = ASSIGNMENT_PATTERN.match(item)
+                self.check_references(item[assignment.end():] if assignment else item, columns, table_name, operator, errors)
+                if assignment:
+                    extended_columns[assignment.group(1)] = 'unknown'
+                else:
+                    return None
+            return extended_columns
+        if operator == 'summarize':
+            if columns is None:
+                return None
+            if re.search(r'\bby\b', arguments):
+                aggregations, keys = re.split(r'\bby\b', arguments, maxsplit=1)
+            else:
+                aggregations, keys = arguments, ''
+            summarized_columns = {}
+            keep_all_columns = False
+            for item in self.split_top_level(aggregations, ',') + self.split_top_level(keys, ','):
+                if not item.strip():
+                    continue
+                assignment = ASSIGNMENT_PATTERN.match(item)
+                expression = item[assignment.end():] if assignment else item
+                self.check_references(expression, columns, table_name, operator, errors)
+                if re.search(r'\barg_(max|min)\s*\([^)]*\*', expression):
+                    keep_all_columns = True
+                if assignment:
+                    summarized_columns[assignment.group(1)] = 'unknown'
+                else:
+                    references = self.get_references(expression)
+                    if len(references) == 1 and expression.strip() == references[0]:
+                        summarized_columns[references[0]] = columns.get(references[0], 'unknown')
+                    elif not keep_all_columns:
+                        # Aggregations without alias get generated names (count_, sum_Field...)
+                        return None
+            return dict(columns, **summarized_columns) if keep_all_columns else summarized_columns
+        return None
+
+    def validate(self, query, warnings=None):
+        """
+        Validate a KQL query. Sources that are not in the schema (workspace functions, ASIM parsers, tables without
+        recent ingestion) are reported as warnings and the rest of the query is not validated.
+
+        :param query: KQL query
+        :param warnings: List the warnings are appended to (optional)
+        :return: List of errors (empty if no error was found)
+        """
+        errors = []
+        segments = self.split_top_level(self.strip_query(query).strip().rstrip(';'), '|')
+        source = segments[0].strip()
+        first_word = re.match(r'[\w-]+', source)
+        if not first_word or first_word.group(0).lower() in UNVALIDATED_STATEMENTS or ';' in source:
+            return errors
+        table_name = first_word.group(0)
+        if source != table_name:
+            # Table functions, cluster()/workspace() references...
+            return errors
+        if table_name not in self.table_columns:
+            warning = f"Table '{table_name}' is not in the schema (function, parser or table without recent data). The query is not validated"
+            suggestions = difflib.get_close_matches(table_name, list(self.table_columns), n=3, cutoff=0.6)
+            if suggestions:
+                warning += f". Similar tables: {', '.join(repr(suggestion) for suggestion in suggestions)}"
+            if warnings is not None:
+                warnings.append(warning)
+            return errors
+        columns = dict(self.table_columns[table_name])
+        for segment in segments[1:]:
+            match = re.match(r'\s*([A-Za-z][\w-]*)', segment)
+            operator = match.group(1).lower() if match else segment.strip()
+            if operator not in KQL_OPERATORS:
+                errors.append(f"Unknown KQL operator '{operator}'")
+                columns = None
+                continue
+            arguments = segment[match.end():]
+            # Operator parameters (ie. kind=inner, hint.strategy=shuffle) are not column references
+            arguments = re.sub(r'\b(kind|hint\.\w+|withsource|isfuzzy)\s*=\s*\w+', '', arguments)
+            columns = None if operator in OPAQUE_OPERATORS else self.apply_columns(operator, arguments, columns, table_name, errors)
+        return errors
+
+    def get_columns(self, table_name):
+        """
+        Get the CSL schema of a table (used to give the LLM the exact columns when repairing a query).
+        """
+        return ', '.join(f"{name}:{column_type}" for name, column_type in self.table_columns.get(table_name, {}).items())
@@ -0,0 +1,31 @@
+import importlib
+import inspect
+import os
+import pkgutil
+from app.plugins.TeisecAgentPlugin import TeisecAgentPlugin
+from app.HelperFunctions import print_error
+
+def discover_plugins(package_name='app.plugins'):
+    """
+    Discover the plugin classes of a package. Every module of the package is imported and the TeisecAgentPlugin
+    subclasses that define a plugin_name are registered. Plugins are not built (clients are not created).
+
+    :param package_name: Package with the plugin modules
+    :return: Dictionary with the plugin name and the plugin class
+    """
+    package = importlib.import_module(package_name)
+    plugin_classes = {}
+    for module_info in sorted(pkgutil.iter_modules(package.__path__), key=lambda module_info: module_info.name):
+        try:
+            module = importlib.import_module(f"{package_name}.{module_info.name}")
+        except Exception as e:
+            print_error(f"Error loading plugin module {module_info.name}: {e}")
+            continue
+        for _, plugin_class in inspect.getmembers(module, inspect.isclass):
+            if issubclass(plugin_class, TeisecAgentPlugin) and plugin_class.plugin_name and plugin_class.__module__ == module.__name__:
+                plugin_classes[plugin_class.plugin_name] = plugin_class
+    enabled_plugins = os.getenv('ASSISTANT_PLUGINS')
+    if enabled_plugins:
+        enabled_plugins = [plugin_name.strip() for plugin_name in enabled_plugins.split(',')]
+        plugin_classes = {plugin_name: plugin_class for plugin_name, plugin_class in plugin_classes.items() if plugin_name in enabled_plugins or plugin_name == 'GPTPlugin'}
+    return plugin_classes
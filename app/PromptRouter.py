@@ -0,0 +1,90 @@
+import re
+import threading
+
+# Prompts with these markers usually require multiple tasks and are always decomposed by the LLM
+MULTI_TASK_PATTERN = re.compile(r'\b(and then|then|after that|afterwards|also|finally|followed by)\b|;|\band (use|create|generate|write|craft|optimi[sz]e|summari[sz]e|explain|analy[sz]e|compare|extract|show|get)\b', re.IGNORECASE)
+
+class PromptRouter:
+    """
+    Local router that sends obvious single-plugin prompts straight to a plugin, skipping the LLM decomposition.
+    Plugins declare weighted regular expressions (routes). The confidence of a plugin is the combination of the
+    weights of its matching routes. Ambiguous prompts (several candidate plugins, multi-step prompts) are not routed.
+    """
+
+    def __init__(self, plugin_classes, threshold=0.8, margin=0.3, max_prompt_length=400):
+        """
+        Initialize the router.
+
+        :param plugin_classes: Dictionary with the plugin name and the plugin class (routes are read from the class)
+        :param threshold: Minimum confidence to route a prompt locally
+        :param margin: Minimum confidence difference between the best and the second best plugin
+        :param max_prompt_length: Longer prompts are always decomposed by the LLM
+        """
+        self.threshold = threshold
+        self.margin = margin
+        self.max_prompt_length = max_prompt_length
+        self.routes = {}
+        for plugin_name, plugin_class in plugin_classes.items():
+            self.routes[plugin_name] = [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in getattr(plugin_class, 'routes', [])]
+        self.lock = threading.Lock()
+        self.stats = {"prompts": 0, "fast_path": 0, "decomposed": 0, "decomposition_time": 0.0}
+
+    def score(self, prompt):
+        """
+        Score the plugins for a prompt.
+
+        :return: Dictionary with the confidence (0-1) of each plugin with at least one matching route
+        """
+        scores = {}
+        for plugin_name, routes in self.routes.items():
+            miss_probability = 1.0
+            for pattern, weight in routes:
+                if pattern.search(prompt):
+                    miss_probability *= (1 - weight)
+            if miss_probability < 1.0:
+                scores[plugin_name] = 1 - miss_probability
+        return scores
+
+    def route(self, prompt):
+        """
+        Route a prompt to a single plugin if the confidence is high enough.
+
+        :param prompt: User prompt
+        :return: Tuple with the plugin name (None if the prompt must be decomposed by the LLM) and the confidence
+        """
+        with self.lock:
+            self.stats["prompts"] += 1
+        if len(prompt) > self.max_prompt_length or MULTI_TASK_PATTERN.search(prompt):
+            return None, 0.0
+        ranking = sorted(self.score(prompt).items(), key=lambda item: item[1], reverse=True)
+        if not ranking:
+            return None, 0.0
+        plugin_name, confidence = ranking[0]
+        second_confidence = ranking[1][1] if len(ranking) > 1 else 0.0
+        if confidence >= self.threshold and confidence - second_confidence >= self.margin:
+            with self.lock:
+                self.stats["fast_path"] += 1
+            return plugin_name, confidence
+        return None, confidence
+
+    def record_decomposition(self, duration):
+        """
+        Record the duration of an LLM decomposition (used to estimate the latency saved by the fast path).
+        """
+        with self.lock:
+            self.stats["decomposed"] += 1
+            self.stats["decomposition_time"] += duration
+
+    def get_stats(self):
+        """
+        Get the router statistics.
+
+        :return: Dictionary with the counters, fast path rate and estimated latency saved (seconds)
+        """
+        with self.lock:
+            stats = dict(self.stats)
+        average_decomposition_time = stats["decomposition_time"] / stats["decomposed"] if stats["decomposed"] else 0
+        stats["fast_path_rate"] = round(stats["fast_path"] / stats["prompts"], 2) if stats["prompts"] else 0
+        stats["latency_saved"] = round(stats["fast_path"] * average_decomposition_time, 1)
+        stats["decomposition_time"] = round(stats["decomposition_time"], 1)
+        return stats
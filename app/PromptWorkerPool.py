@@ -0,0 +1,117 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from app.HelperFunctions import print_error
+
+class PromptWorkerPool:
+    """
+    Run prompts of multiple independent sessions (ie. web socket connections) in a bounded pool of worker threads.
+    Each session has its own TeisecSession, a queue of pending prompts (executed in order) and a cancel event.
+    Clients, plugins and the Sentinel schema are shared through the agent.
+    """
+
+    def __init__(self, agent, max_workers=4):
+        """
+        Initialize the pool.
+
+        :param agent: TeisecAgent instance shared by all the sessions
+        :param max_workers: Maximum number of prompts executed at the same time
+        """
+        self.agent = agent
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='prompt-worker')
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def open_session(self, session_id):
+        """
+        Create the state of a new session.
+        """
+        with self.lock:
+            if session_id not in self.sessions:
+                self.sessions[session_id] = {
+                    "session": self.agent.create_session(),
+                    "queue": deque(),
+                    "running": False,
+                    "cancel_event": threading.Event()
+                }
+            return self.sessions[session_id]
+
+    def close_session(self, session_id):
+        """
+        Cancel the pending prompts of a session and remove its state and its stored results.
+        """
+        self.cancel(session_id)
+        with self.lock:
+            state = self.sessions.pop(session_id, None)
+        if state is not None:
+            # Results stored by the session are no longer readable
+            state["session"].release_results()
+
+    def submit(self, session_id, output_type, prompt, channel, on_complete=None):
+        """
+        Queue a prompt of a session. Prompts of the same session are executed one after the other.
+
+        :param session_id: Session id
+        :param output_type: Output type (terminal or html)
+        :param prompt: User prompt
+        :param channel: Channel callback of the session
+        :param on_complete: Callback executed after the prompt is processed. Receives the number of prompts still queued
+        :return: Number of prompts of the session ahead of this one
+        """
+        state = self.open_session(session_id)
+        with self.lock:
+            position = len(state["queue"]) + (1 if state["running"] else 0)
+            state["queue"].append((output_type, prompt, channel, on_complete))
+            if not state["running"]:
+                state["running"] = True
+                state["cancel_event"].clear()
+                self.executor.submit(self.process_queue, session_id, state)
+        return position
+
+    def process_queue(self, session_id, state):
+        """
+        Worker loop of a session: run the queued prompts until the queue is empty.
+        """
+        while True:
+            with self.lock:
+                if not state["queue"]:
+                    state["running"] = False
+                    return
+                output_type, prompt, channel, on_complete = state["queue"].popleft()
+            try:
+                self.agent.run_prompt(output_type, prompt, channel, state["session"], state["cancel_event"])
+            except Exception as e:
+                print_error(f"Error processing prompt ({session_id}): {e}")
+                channel('systemmessage', {"message": f"Error: {e}"})
+            with self.lock:
+                pending = len(state["queue"])
+                # Cancellation applies to the prompts submitted before it
+                state["cancel_event"].clear()
+            if on_complete is not None:
+                on_complete(pending)
+
+    def cancel(self, session_id):
+        """
+        Cancel the running prompt of a session (tasks not started yet) and drop its queued prompts.
+
+        :return: Number of queued prompts dropped
+        """
+        with self.lock:
+            state = self.sessions.get(session_id)
+            if state is None:
+                return 0
+            dropped = len(state["queue"])
+            state["queue"].clear()
+            if state["running"]:
+                state["cancel_event"].set()
+            return dropped
+
+    def clear_session(self, session_id):
+        """
+        Clear the context of a session.
+        """
+        state = self.open_session(session_id)
+        self.agent.clear_session(state["session"])
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,152 @@
+import re
+import html
+import json
+import shutil
+from datetime import datetime
+
+MAX_FIELD_LENGTH = 40
+MIN_COLUMN_WIDTH = 8
+# References removed from the terminal output (same rule as the terminal formatting prompt)
+TERMINAL_REDACTION_PATTERN = re.compile(r'(?i:\bBlueVoyant\b)|\bBV\b')
+TERMINAL_REDACTION_TEXT = 'SEN'
+
+def is_tabular(result):
+    """
+    Check if a plugin result is structured data that can be rendered as a table (list of records).
+
+    :param result: Plugin result
+    :return: True if the result is a list of dictionaries
+    """
+    if hasattr(result, 'to_records'):
+        return True
+    return isinstance(result, list) and all(isinstance(row, dict) for row in result)
+
+def get_records(result):
+    """
+    Get the records (list of dictionaries) of a structured result.
+    """
+    if hasattr(result, 'to_records'):
+        return result.to_records()
+    return result
+
+def format_value(value):
+    """
+    Convert a field value to its string representation.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return ' '.join(str(value).split())
+
+def truncate(text, width):
+    """
+    Truncate a text to the given width adding ... at the end.
+    """
+    if len(text) <= width:
+        return text
+    return text[:max(0, width - 3)] + '...'
+
+def get_columns(records):
+    """
+    Get the columns of a list of records, keeping the order in which they appear.
+    """
+    columns = []
+    for record in records:
+        for column in record.keys():
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+def render_text_table(result, max_width=None):
+    """
+    Render a structured result as a plain text table. Fields are truncated to 40 characters and the table is fitted to max_width.
+
+    :param result: Structured result (list of records)
+    :param max_width: Maximum width of the table. Columns are shrunk (and dropped if needed) to fit it
+    :return: Text table
+    """
+    records = get_records(result)
+    if not records:
+        return 'No results found.'
+    columns = get_columns(records)
+    rows = [[truncate(format_value(record.get(column)), MAX_FIELD_LENGTH) for column in columns] for record in records]
+    widths = [min(MAX_FIELD_LENGTH, max([len(str(column))] + [len(row[index]) for row in rows])) for index, column in enumerate(columns)]
+    hidden_columns = 0
+    if max_width:
+        # Shrink the widest column until the table fits. Drop the last columns if it doesn't fit with the minimum width
+        while sum(widths) + 3 * len(widths) + 1 > max_width:
+            widest = max(range(len(widths)), key=lambda index: widths[index])
+            if widths[widest] > MIN_COLUMN_WIDTH:
+                widths[widest] -= 1
+            elif len(widths) > 1:
+                widths.pop()
+                hidden_columns += 1
+            else:
+                break
+    visible_columns = columns[:len(widths)]
+    separator = '+' + '+'.join('-' * (width + 2) for width in widths) + '+'
+    def format_row(values):
+        return '| ' + ' | '.join(truncate(str(value), width).ljust(width) for value, width in zip(values, widths)) + ' |'
+    lines = [separator, format_row(visible_columns), separator]
+    lines.extend(format_row(row) for row in rows)
+    lines.append(separator)
+    footer = f'{len(records)} rows'
+    if hidden_columns:
+        footer += f' ({hidden_columns} columns hidden to fit the screen: {", ".join(str(column) for column in columns[len(widths):])})'
+    lines.append(footer)
+    return '\n'.join(lines)
+
+def redact_terminal(text):
+    """
+    Replace the references to BlueVoyant (or BV) with SEN.
+    """
+    return TERMINAL_REDACTION_PATTERN.sub(TERMINAL_REDACTION_TEXT, text)
+
+def render_terminal(result):
+    """
+    Render a structured result as a table that fits the terminal. References to BlueVoyant (or BV) are replaced with SEN.
+    """
+    records = [{redact_terminal(str(column)): redact_terminal(format_value(value)) for column, value in record.items()} for record in get_records(result)]
+    return render_text_table(records, shutil.get_terminal_size((120, 40)).columns)
+
+def render_html(result):
+    """
+    Render a structured result as a responsive HTML table (div element) to be embedded in the chat session.
+    Fields longer than 40 characters are truncated and the full value is available in the title attribute.
+    """
+    records = get_records(result)
+    if not records:
+        return '<div>No results found.</div>'
+    columns = get_columns(records)
+    header = ''.join(f'<th class="px-2 py-1 text-left">{html.escape(str(column))}</th>' for column in columns)
+    body = []
+    for record in records:
+        cells = []
+        for column in columns:
+            value = format_value(record.get(column))
+            truncated_value = truncate(value, MAX_FIELD_LENGTH)
+            title = f' title="{html.escape(value)}"' if truncated_value != value else ''
+            cells.append(f'<td class="px-2 py-1"{title}>{html.escape(truncated_value)}</td>')
+        body.append('<tr>' + ''.join(cells) + '</tr>')
+    return (
+        '<div class="overflow-x-auto max-w-full">'
+        '<table class="min-w-full table-auto text-xs">'
+        f'<thead><tr>{header}</tr></thead>'
+        f'<tbody>{"".join(body)}</tbody>'
+        '</table>'
+        f'<div class="text-xs">{len(records)} rows</div>'
+        '</div>'
+    )
+
+def render(output_type, result):
+    """
+    Render a structured result for an output type (terminal, html or other).
+    """
+    if output_type == 'html':
+        return render_html(result)
+    if output_type == 'terminal':
+        return render_terminal(result)
+    return render_text_table(result)
@@ -1,31 +1,73 @@
 import os  
-from azure.identity import InteractiveBrowserCredential, ClientSecretCredential, DefaultAzureCredential  
-from app.clients.SentinelClient import SentinelClient  
-from app.clients.AzureOpenAIClient import AzureOpenAIClient  
-from app.plugins.SentinelKQLPlugin import SentinelKQLPlugin  
-from app.plugins.GPTPlugin import GPTPlugin  
-from app.plugins.FetchURLPlugin import FetchURLPlugin  
 from colorama import Fore  
 from app.HelperFunctions import *  
+from app.ChannelRelay import ChannelRelay  
+from app.TeisecSession import TeisecSession  
+from app.PluginRegistry import discover_plugins
+from app.PromptRouter import PromptRouter
+from app import ResultRenderer
+from app.Telemetry import telemetry
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import json 
 import time  
+import uuid
+import re
 class TeisecAgent:  
-    def __init__(self, auth_type):  
-        self.client_list = {}  
+    def __init__(self, auth_type, clients=None):  
+        """  
+        Initialize the agent.  
+  
+        :param auth_type: Azure authentication method (interactive, client_secret or default)  
+        :param clients: Dictionary with client instances to use instead of creating them (ie. benchmark stand-ins)  
+        """  
+        startup_time = time.time()
+        self.startup_timings = {}
+        self.auth_type = auth_type
+        self.credential = None
+        self.client_list = dict(clients or {})  
+        self.client_factories = {}
+        self.plugin_classes = {}
         self.plugin_list = {} 
         self.plugin_capabilities={}
-        self.session = []  
+        # Clients and plugins are created on first use. RLock because plugins create the clients they need
+        self.build_lock = threading.RLock()
         self.context_window_size = int(os.getenv('ASSISTANT_CONTEXT_WINDOW_SIZE', 5))  
+        self.result_store_enabled = (os.getenv('ASSISTANT_RESULT_STORE', 'True') == 'True')
+        self.streaming = (os.getenv('ASSISTANT_STREAMING', 'True') == 'True')
+        self.task_parallelism = int(os.getenv('ASSISTANT_TASK_PARALLELISM', 4))
+        self.local_renderer = (os.getenv('ASSISTANT_LOCAL_RENDERER', 'True') == 'True')
+        # Prompts asking for a custom presentation of the results are always formatted by the LLM
+        # Whole words (or word stems) so table names and plain words (ie. "information", "MicrosoftGraphActivityLogs", "reported") don't match
+        self.custom_presentation_pattern = re.compile(r'\b(summar\w*|explain\w*|describe|description|analy[sz]\w*|insights?|reports?|charts?|graphs?|format|formatted|json|markdown|'
+                                                      r'translate|highlight\w*|recommend\w*|why|narrative|bullets?|list of)\b', re.IGNORECASE)
         self.print_intro_message()  
-        self.auth(auth_type)  
-        self.create_clients()  
-        self.load_plugins()  
+        self.timed('clients', self.create_clients)  
+        self.session = self.create_session()  
+        self.timed('plugins', self.load_plugins)  
         self.load_plugin_capabilities()
+        self.prompt_router = None
+        if os.getenv('ASSISTANT_ROUTER', 'True') == 'True':
+            self.prompt_router = PromptRouter(self.plugin_classes, float(os.getenv('ASSISTANT_ROUTER_THRESHOLD', 0.8)))
+        if os.getenv('ASSISTANT_WARMUP', 'True') == 'True':
+            self.timed('warmup', self.start_warmup)
+        self.startup_timings['total'] = time.time() - startup_time
+        print_debug("Startup time: " + ", ".join(f"{stage} {round(seconds * 1000)} ms" for stage, seconds in self.startup_timings.items()))
+  
+    def timed(self, stage, function):  
+        """  
+        Run a startup stage and record its duration.  
+        """  
+        stage_start_time = time.time()
+        function()
+        self.startup_timings[stage] = time.time() - stage_start_time
   
     def auth(self, auth_type):  
         """  
         Authenticate with Azure using different credential types based on the provided auth_type.  
         """  
+        # Imported on first use to keep the startup fast  
+        from azure.identity import InteractiveBrowserCredential, ClientSecretCredential, DefaultAzureCredential  
         # Use different types of Azure Credentials based on the argument  
         if auth_type == "interactive":  
             self.credential = InteractiveBrowserCredential()  
@@ -48,65 +90,162 @@ class TeisecAgent:
             print_error(f"Authentication failed: {e}")  
             print_error("Only unauthenticated plugins can be used")  
   
+    def get_credential(self):  
+        """  
+        Get the Azure credential. Authentication happens the first time a client needs it.  
+        """  
+        with self.build_lock:
+            if self.credential is None:
+                self.auth(self.auth_type)
+            return self.credential
+  
     def create_clients(self):  
         """  
-        Create clients to external platforms using environment variables.  
+        Register the factories of the clients to external platforms. Clients are created on first use (get_client).  
+        """  
+        self.client_factories = {
+            "sentinel_client": self.create_sentinel_client,
+            "azure_openai_client": self.create_azure_openai_client,
+            "http_fetch_client": self.create_http_fetch_client,
+            "result_store": self.create_result_store
+        }
+  
+    def get_client(self, client_name):  
+        """  
+        Get a client by its name, creating it on first use.  
+        """  
+        with self.build_lock:
+            if client_name not in self.client_list:
+                client_start_time = time.time()
+                self.client_list[client_name] = self.client_factories[client_name]()
+                print_debug(f"Client {client_name} created in {round((time.time() - client_start_time) * 1000)} ms")
+            return self.client_list[client_name]
+  
+    def create_sentinel_client(self):  
+        """  
+        Create the Sentinel client using environment variables.  
         """  
+        from app.clients.SentinelClient import SentinelClient  
+        from app.clients.KQLResultCache import KQLResultCache  
         subscription_id = os.getenv('AZURE_SUBSCRIPTION_ID')  
         resource_group_name = os.getenv('AZURE_RESOURCEGROUP_NAME')  
         workspace_name = os.getenv('AZURE_WORKSPACE_NAME')  
         workspace_id = os.getenv('AZURE_WORKSPACE_ID')  
           
-        self.client_list["sentinel_client"] = SentinelClient(  
-            self.credential, subscription_id, resource_group_name, workspace_name, workspace_id  
+        query_cache = None
+        if os.getenv('SENTINEL_QUERY_CACHE', 'True') == 'True':
+            query_cache = KQLResultCache(
+                int(os.getenv('SENTINEL_QUERY_CACHE_RELATIVE_TTL', 120)),
+                int(os.getenv('SENTINEL_QUERY_CACHE_ABSOLUTE_TTL', 3600)),
+                int(os.getenv('SENTINEL_QUERY_CACHE_MAX_CELLS', 2000000))
+            )
+        return SentinelClient(  
+            self.get_credential(), subscription_id, resource_group_name, workspace_name, workspace_id, query_cache,  
+            slice_workers=int(os.getenv('SENTINEL_QUERY_SLICE_WORKERS', 4)),  
+            slice_retries=int(os.getenv('SENTINEL_QUERY_SLICE_RETRIES', 2))  
         )  
   
+    def create_azure_openai_client(self):  
+        """  
+        Create the Azure OpenAI client using environment variables.  
+        """  
+        from app.clients.LLMResponseCache import LLMResponseCache  
         azure_endpoint = os.getenv('AZURE_OPENAI_ENDPOINT')  
         api_key = os.getenv('AZURE_OPENAI_APIKEY')  
         model_name = os.getenv('AZURE_OPENAI_MODELNAME')  
+        api_version = os.getenv('AZURE_OPENAI_API_VERSION')  
           
-        self.client_list["azure_openai_client"] = AzureOpenAIClient(api_key, azure_endpoint, model_name)  
+        llm_cache = None
+        if os.getenv('AZURE_OPENAI_CACHE', 'False') == 'True':
+            llm_cache = LLMResponseCache(
+                os.getenv('AZURE_OPENAI_CACHE_FILE', 'llm_cache.db'),
+                int(os.getenv('AZURE_OPENAI_CACHE_MEMORY_ENTRIES', 256)),
+                int(os.getenv('AZURE_OPENAI_CACHE_TTL', 86400)),
+                int(os.getenv('AZURE_OPENAI_CACHE_MAX_ENTRIES', 5000))
+            )
+        audit_log = None
+        if os.getenv('AZURE_OPENAI_AUDIT', 'True') == 'True':
+            from app.clients.PromptAuditLog import PromptAuditLog  
+            audit_log = PromptAuditLog(
+                os.getenv('AZURE_OPENAI_AUDIT_FILE', 'promptaudit.jsonl'),
+                int(os.getenv('AZURE_OPENAI_AUDIT_MAX_BYTES', 10485760)),
+                int(os.getenv('AZURE_OPENAI_AUDIT_ROTATE_SECONDS', 86400)),
+                int(os.getenv('AZURE_OPENAI_AUDIT_BACKUPS', 10)),
+                int(os.getenv('AZURE_OPENAI_AUDIT_QUEUE_SIZE', 10000)),
+                os.getenv('AZURE_OPENAI_AUDIT_QUEUE_POLICY', 'drop')
+            )
+        max_concurrency = int(os.getenv('AZURE_OPENAI_MAX_CONCURRENCY', 8))
+        if os.getenv('AZURE_OPENAI_ASYNC', 'False') == 'True':
+            # Async client with a shared connection pool. Its sync shim keeps the same runPrompt contract for the plugins
+            from app.clients.AsyncAzureOpenAIClient import AsyncAzureOpenAIClient  
+            return AsyncAzureOpenAIClient(api_key, azure_endpoint, model_name, llm_cache, max_concurrency, api_version, audit_log=audit_log)  
+        from app.clients.AzureOpenAIClient import AzureOpenAIClient  
+        return AzureOpenAIClient(api_key, azure_endpoint, model_name, llm_cache, max_concurrency, api_version, audit_log)  
+  
+    def create_http_fetch_client(self):  
+        """  
+        Create the HTTP Fetch client (FetchURL disk cache) using environment variables.  
+        """  
+        from app.clients.HttpFetchClient import HttpFetchClient  
+        return HttpFetchClient(
+            os.getenv('FETCHURL_CACHE_DIR', 'fetch_cache') if os.getenv('FETCHURL_CACHE', 'True') == 'True' else None,
+            int(os.getenv('FETCHURL_CACHE_FRESHNESS', 3600)),
+            float(os.getenv('FETCHURL_CONNECT_TIMEOUT', 5)),
+            float(os.getenv('FETCHURL_READ_TIMEOUT', 30)),
+            int(os.getenv('FETCHURL_MAX_BYTES', 5242880))
+        )
+  
+    def create_result_store(self):  
+        """  
+        Create the local store of the task results (SQLite) using environment variables.  
+        """  
+        from app.clients.LocalResultStore import LocalResultStore  
+        return LocalResultStore(
+            os.getenv('ASSISTANT_RESULT_STORE_PATH', ':memory:'),
+            int(os.getenv('ASSISTANT_RESULT_STORE_MAX_RESULTS', 100)),
+            int(os.getenv('ASSISTANT_RESULT_STORE_MAX_ROWS', 100000))
+        )
   
     def load_plugins(self):  
         """  
-        Load plugins for the assistant. Currently hardcoded, but can be extended to auto-load from the plugins folder.  
-        """  
-        # TODO: Auto-load from all plugins available inside the plugins subfolder  
-        loadSchema=(os.getenv('SENTINELKQL_LOADSCHEMA', 'True')=='True' )
-        self.plugin_list = {  
-            "SentinelKQLPlugin": SentinelKQLPlugin(  
-                "SentinelKQLPlugin", "Plugin to generate and run KQL queries in Sentinel", "API",   
-                self.client_list["azure_openai_client"], self.client_list["sentinel_client"],loadSchema
-            ),  
-            "FetchURLPlugin": FetchURLPlugin(  
-                "FetchURLPlugin", "Plugin to fetch HTML sites", "API",   
-                self.client_list["azure_openai_client"]  
-            ),  
-            "GPTPlugin": GPTPlugin(  
-                "GPTPlugin", "Plugin to run prompts in Azure OpenAI GPT models", "GPT",   
-                self.client_list["azure_openai_client"]  
-            )  
-        }  
+        Discover the plugins available inside the plugins folder. Plugins are built on first use (get_plugin).  
+        """  
+        self.plugin_classes = discover_plugins()
+        print_debug(f"Plugins discovered: {', '.join(self.plugin_classes.keys())}")
     def load_plugin_capabilities(self):
         self.plugin_capabilities={}
-        for plugin_name in self.plugin_list.keys():
-            plugincapability=self.plugin_list[plugin_name].plugincapabilities()
-            self.plugin_capabilities[plugin_name]= plugincapability
-    def decompose_in_tasks(self, prompt, channel):  
+        for plugin_name, plugin_class in self.plugin_classes.items():
+            self.plugin_capabilities[plugin_name]= plugin_class.capabilities
+    def start_warmup(self):  
+        """  
+        Build the plugins that require a warm-up (ie. Sentinel Schema loading) in a background thread.  
+        """  
+        def warmup():
+            for plugin_name, plugin_class in self.plugin_classes.items():
+                if plugin_class.warmup:
+                    try:
+                        self.get_plugin(plugin_name)
+                    except Exception as e:
+                        print_error(f"Error loading plugin {plugin_name}: {e}")
+        threading.Thread(target=warmup, name='plugin-warmup', daemon=True).start()
+    def decompose_in_tasks(self, prompt, channel, session=None):  
         """  
         Select the appropriate plugin based on the input prompt.  
         """  
+        if session is None:
+            session = self.session
         # System message to guide the AI assistant on how to decompose the prompt into tasks
         system_message = (  
                 'You are an AI assistant that is part of a system that takes a user prompt and process it with one or more of the capabilities from the available plugins.\n '
                 'You will receive the user prompt and the list of available plugins and its capabilities in JSON format.\n'  
                 'Each plugin might have one or more capabilities.\n'
                 'Your task is to select the most appropiate plugins and capabilities to fulfill the user prompt.\n'  
-                'Evaluate if the prompt of the user can be answered by only one of the capabilities or you need to decompose the prompt in multiple sub-prompts(tasks) that will be executed sequentially.\n'
-                'When decomposing the user prompt in multiple tasks take into account that each task will have access to the results of the previous ones as context but the content original prompt is not available.\n'
+                'Evaluate if the prompt of the user can be answered by only one of the capabilities or you need to decompose the prompt in multiple sub-prompts(tasks).\n'
+                'When decomposing the user prompt in multiple tasks take into account that each task will only have access to the results of the tasks it depends on as context but the content original prompt is not available.\n'
+                'Tasks without dependencies between them will be executed in parallel. Use depends_on to list the task_id of the previous tasks whose results are needed by a task. Use an empty list if the task is independent.\n'
                 'Make sure you always return an array even if it contains only one task.\n'
                 'Include all the necessary details in the description of each task to achieve the expected results.\n'
-                'I will parse the output inside a python script so It must be returned using only JSON format and will follow this schema [{"plugin_name":"<selected_plugin_name>","capability_name":"<selected_capability_name>","task":"<Task detailed description>"}]'  
+                'I will parse the output inside a python script so It must be returned using only JSON format and will follow this schema [{"task_id":1,"plugin_name":"<selected_plugin_name>","capability_name":"<selected_capability_name>","task":"<Task detailed description>","depends_on":[<task_id of the required previous tasks>]}]'  
                 'This is the list of available plugins and its capabilities (in JSON format) you have use to perform the decomposition in tasks of the user prompt:\n'
                 f'{self.plugin_capabilities}'
                 )
@@ -121,10 +260,13 @@ class TeisecAgent:
         system_object = {"role": "system", "content": system_message}
         new_session = []
         new_session.append(system_object)
-        new_session = new_session + self.session
+        new_session = new_session + session
         
         # Run the prompt through the GPTPlugin to get the task list
-        task_list_object = self.plugin_list["GPTPlugin"].runprompt(extended_user_prompt, new_session, channel)
+        with telemetry.span('decomposition', channel) as span:
+            task_list_object = self.get_plugin("GPTPlugin").runprompt(extended_user_prompt, new_session, channel, use_cache=True)
+            span.set_usage(task_list_object)
+        channel('debugmessage', {"message": f"Context Tokens (plugin selection): {count_message_tokens(new_session) + count_tokens(extended_user_prompt)} (session: {session.token_count()})"})  
         channel('debugmessage', {"message": f"Session Tokens (plugin selection): {task_list_object['session_tokens'] }"})  
         
         # Handle errors in the task list generation
@@ -145,17 +287,19 @@ class TeisecAgent:
                 return obj
     def get_plugin(self, plugin_id):  
         """  
-        Get the plugin instance by its ID.  
+        Get the plugin instance by its ID, building it on first use.  
         """  
-        return self.plugin_list[plugin_id]  
+        with self.build_lock:
+            if plugin_id not in self.plugin_list:
+                self.plugin_list[plugin_id] = self.plugin_classes[plugin_id].build(self)
+            return self.plugin_list[plugin_id]  
     def get_plugin_help(self):  
         """  
         Get the plugin help information.  
         """
         plugin_help_list=[]  
-        for plugin_name in self.plugin_list.keys():  
-            plugin = self.plugin_list[plugin_name]  
-            plugin_help = plugin.pluginhelp()
+        for plugin_name in self.plugin_classes.keys():  
+            plugin_help = self.plugin_classes[plugin_name].help
             plugin_help_list.append(plugin_help) 
         return plugin_help_list 
     def print_intro_message(self):  
@@ -172,10 +316,19 @@ class TeisecAgent:
         print(f"{Fore.GREEN}{message}{Fore.WHITE}")  
         print_info("Welcome to Teisec Agent")  
   
-    def process_response(self, output_type, user_input, response,channel):  
+    def process_response(self, output_type, user_input, response,channel,stream_id=None):  
         """  
         Process the response to format it for specific output types (Terminal, HTML, etc.).  
+        When a stream_id is provided the formatted response is streamed over the channel as incremental resultmessage chunks.  
+        Structured (tabular) responses are rendered locally unless the prompt asks for a custom presentation.  
         """  
+        if self.local_renderer and ResultRenderer.is_tabular(response) and not self.requires_custom_presentation(user_input):
+            self.send_debug(channel,{"message":"Response rendered locally (formatting prompt skipped)"})
+            with telemetry.span('formatting', channel, renderer='local', rows=len(response)) as span:
+                rendered_response = ResultRenderer.render(output_type, response)
+                span.set(bytes=len(rendered_response))
+            return rendered_response
+        response = str(response)
         if output_type == 'terminal':  
             extended_prompt = (  
                 'Below you have a prompt and the response associated with it. '  
@@ -206,7 +359,15 @@ class TeisecAgent:
                 f'This is the original prompt response (this is the data you have to format): \n{response}'  
             )  
   
-        prompt_result_object = self.plugin_list["GPTPlugin"].runprompt(extended_prompt, [],channel)  
+        with telemetry.span('formatting', channel, renderer='llm', bytes=len(response)) as span:
+            if stream_id is not None:
+                on_delta = lambda delta: self.send_response(channel,{"message":delta,"stream_id":stream_id,"partial":True})
+                prompt_result_object = self.get_plugin("GPTPlugin").runpromptstream(extended_prompt, [],channel, on_delta, use_cache=True)  
+            else:
+                prompt_result_object = self.get_plugin("GPTPlugin").runprompt(extended_prompt, [],channel, use_cache=True)  
+            span.set_usage(prompt_result_object)
+        self.send_debug(channel,{"message":f"Context Tokens (response formatting): {count_tokens(extended_prompt)}"})
+        self.send_debug(channel,{"message":f"Session Tokens (response formatting): {prompt_result_object['session_tokens']}"})
         if prompt_result_object['status']=='error':
             channel('systemmessage',{"message":f"Error: {prompt_result_object['result'] }"})
             return  ''   
@@ -214,6 +375,11 @@ class TeisecAgent:
             # Clean tags from result  
             prompt_result_clean = prompt_result_object['result'].replace("```plaintext", "").replace("```kusto", "").replace("```html", "").replace("```", "")  
             return prompt_result_clean  
+    def requires_custom_presentation(self, user_input):  
+        """  
+        Check if the prompt asks for a presentation of the results that requires the LLM (summaries, explanations, custom formats...).  
+        """  
+        return self.custom_presentation_pattern.search(user_input) is not None
     def send_system (self,channel,system_object):
         if channel is not None:
             channel('systemmessage',system_object)
@@ -223,50 +389,178 @@ class TeisecAgent:
     def send_response (self,channel,response_object):
         if channel is not None:
             channel('resultmessage',response_object)   
-    def run_prompt(self, output_type, prompt,channel=None):  
+    def normalize_tasks(self, decomposed_tasks):  
+        """  
+        Assign task ids and dependencies to the decomposed tasks.  
+        Tasks without depends_on depend on all the previous tasks (sequential execution). Dependencies can only point to previous tasks.  
+        """  
+        tasks = []
+        task_ids = []
+        for index, task in enumerate(decomposed_tasks):
+            task = dict(task)
+            task_id = task.get('task_id', index + 1)
+            if task_id in task_ids:
+                task_id = index + 1
+            depends_on = task.get('depends_on')
+            if not isinstance(depends_on, list):
+                depends_on = list(task_ids)
+            task['task_id'] = task_id
+            task['depends_on'] = [dependency for dependency in depends_on if dependency in task_ids]
+            task_ids.append(task_id)
+            tasks.append(task)
+        return tasks
+
+    def run_task(self, output_type, prompt, task, session, channel):  
+        """  
+        Run a single task with its plugin and format the response.  
+        """  
+        start_time = time.time()
+        self.send_system(channel,{"message":'('+task['plugin_name']+') '+task['task']})
+        self.send_debug(channel,{"message":f"Context Tokens ({task['plugin_name']}): {count_message_tokens(session) + count_tokens(task['task'])}"})
+        # Task spans report the tokens of the plugin without counting them: they are recorded by the spans of its own stages
+        with telemetry.span('task:' + task['plugin_name'], channel) as span:
+            plugin_response_object = self.get_plugin(task['plugin_name']).runprompt(task['task'], session,channel)  
+            span.set_usage(plugin_response_object, counted=False)
+        self.send_debug(channel,{"message":f"Session Tokens ({task['plugin_name']}): {plugin_response_object['session_tokens']}"})
+        if plugin_response_object['status']=='error':
+            self.send_system(channel,{"message":f"Error: {plugin_response_object['result'] }"})
+            return {"status": "error", "duration": time.time() - start_time}
+        stream_id = str(uuid.uuid4()) if (self.streaming and channel is not None) else None
+        processed_response = self.process_response(output_type, prompt, plugin_response_object['result'],channel,stream_id)
+        if stream_id is not None:
+            # Final chunk replaces the streamed deltas with the cleaned response
+            self.send_response(channel,{"message":processed_response,"stream_id":stream_id,"final":True})     
+        else:
+            self.send_response(channel,{"message":processed_response})     
+        return {"status": "success", "result": plugin_response_object['result'], "processed_response": processed_response, "duration": time.time() - start_time}
+
+    def run_tasks(self, output_type, prompt, tasks, channel, session, cancel_event=None):  
+        """  
+        Run the tasks concurrently respecting their dependencies (up to task_parallelism tasks at the same time).  
+        Each task receives the current session plus the results of the tasks it depends on.  
+        When the cancel event is set no new tasks are started (running tasks are completed).  
+  
+        :return: Dictionary with the task result of each task id  
         """  
-        Run the provided prompt using task decomposition.  
+        relay = ChannelRelay(channel)
+        task_outcomes = {}
+        pending_tasks = list(tasks)
+        running_tasks = {}
+        with ThreadPoolExecutor(max_workers=max(1, self.task_parallelism)) as executor:
+            while pending_tasks or running_tasks:
+                for task in list(pending_tasks):
+                    dependencies = task['depends_on']
+                    if cancel_event is not None and cancel_event.is_set():
+                        pending_tasks.remove(task)
+                        task_outcomes[task['task_id']] = {"status": "cancelled", "duration": 0}
+                    elif any(task_outcomes.get(dependency, {}).get('status') in ('error', 'skipped', 'cancelled') for dependency in dependencies):
+                        pending_tasks.remove(task)
+                        task_outcomes[task['task_id']] = {"status": "skipped", "duration": 0}
+                        relay.send('systemmessage',{"message":'Task skipped because a required task failed: '+task['task']})
+                    elif len(running_tasks) < max(1, self.task_parallelism) and all(dependency in task_outcomes for dependency in dependencies):
+                        pending_tasks.remove(task)
+                        dependency_messages = []
+                        for dependency in [t['task_id'] for t in tasks if t['task_id'] in dependencies]:
+                            dependency_messages += task_outcomes[dependency]['session_entry'][0]
+                        task_session = session.task_context(dependency_messages)
+                        future = executor.submit(self.run_task, output_type, prompt, task, task_session, relay.send)
+                        running_tasks[future] = task
+                relay.flush(timeout=0.05)
+                for future in [future for future in running_tasks if future.done()]:
+                    task = running_tasks.pop(future)
+                    try:
+                        task_outcomes[task['task_id']] = future.result()
+                        if task_outcomes[task['task_id']]['status'] == 'success':
+                            # Compacted session entry used as context by the dependent tasks and merged in the session
+                            task_outcomes[task['task_id']]['session_entry'] = session.build_entry(prompt, task_outcomes[task['task_id']]['result'], task['plugin_name'])
+                    except Exception as err:
+                        relay.send('systemmessage',{"message":f"Error: {err}"})
+                        task_outcomes[task['task_id']] = {"status": "error", "duration": 0}
+        relay.flush()
+        return task_outcomes
+
+    def route_prompt(self, prompt, channel, session):  
         """  
+        Get the tasks of a prompt. Obvious single-plugin prompts are routed locally, the rest are decomposed by the LLM.  
+        """  
+        if self.prompt_router is not None:
+            plugin_name, confidence = self.prompt_router.route(prompt)
+            if plugin_name is not None:
+                capability_name = next(iter(self.plugin_capabilities[plugin_name]), '')
+                self.send_debug(channel,{"message":f"Prompt routed locally to {plugin_name} (confidence {confidence:.2f}). Router stats: {self.prompt_router.get_stats()}"})
+                return [{"task_id": 1, "plugin_name": plugin_name, "capability_name": capability_name, "task": prompt, "depends_on": []}]
+        decomposition_start_time = time.time()
+        tasks = self.decompose_in_tasks(prompt, channel, session)
+        if self.prompt_router is not None:
+            self.prompt_router.record_decomposition(time.time() - decomposition_start_time)
+            self.send_debug(channel,{"message":f"Router stats: {self.prompt_router.get_stats()}"})
+        return tasks
+    def run_prompt(self, output_type, prompt,channel=None,session=None,cancel_event=None):  
+        """  
+        Run the provided prompt using task decomposition. Independent tasks are executed concurrently.  
+  
+        :param output_type: Output type (terminal or html)  
+        :param prompt: User prompt  
+        :param channel: Channel callback used to send the messages  
+        :param session: Session used as context and updated with the results. Agent session if not provided  
+        :param cancel_event: threading.Event to cancel the prompt. Tasks not started yet are cancelled  
+        """  
+        if session is None:
+            session = self.session
         start_time = time.time()  
         task_results=[]
-        decomposed_tasks=self.decompose_in_tasks(prompt,channel)
+        decomposed_tasks=self.normalize_tasks(self.route_prompt(prompt,channel,session))
+        if cancel_event is not None and cancel_event.is_set():
+            self.send_system(channel,{"message":'Prompt cancelled'})
+            return task_results
         self.send_system(channel,{"message":'Prompt decomposed in '+ str(len(decomposed_tasks))+' tasks'})
+        tasks_start_time = time.time()
+        task_outcomes = self.run_tasks(output_type, prompt, decomposed_tasks, channel, session, cancel_event)
+        tasks_elapsed_time = time.time() - tasks_start_time
+        # Results are merged in the session following the decomposition order, regardless of completion order
         for task in decomposed_tasks:
-            self.send_system(channel,{"message":'('+task['plugin_name']+') '+task['task']})
-            plugin_response_object = self.get_plugin(task['plugin_name']).runprompt(task['task'], self.session,channel)  
-            if plugin_response_object['status']=='error':
-                channel('systemmessage',{"message":f"Error: {plugin_response_object['result'] }"})
-                break   
-            else:
-                self.update_session(prompt, plugin_response_object['result'])
-                processed_response = self.process_response(output_type, prompt, str(plugin_response_object['result']),channel)
-                task_results.append(processed_response)  
-                self.send_response(channel,{"message":processed_response})     
-                self.send_debug(channel,{"message":f"Session Lenght: {len(self.session)}"})  
+            task_outcome = task_outcomes[task['task_id']]
+            if task_outcome['status'] == 'success':
+                session.append_entry(*task_outcome['session_entry'])
+                task_results.append(task_outcome['processed_response'])  
+        cancelled_tasks = sum(1 for task_outcome in task_outcomes.values() if task_outcome['status'] == 'cancelled')
+        if cancelled_tasks:
+            self.send_system(channel,{"message":f"Prompt cancelled ({cancelled_tasks} tasks not executed)"})
+        self.send_debug(channel,{"message":f"Session Lenght: {len(session)} ({session.token_count()} tokens of {session.token_budget})"})  
+        if len(decomposed_tasks) > 1:
+            sequential_time = sum(task_outcome['duration'] for task_outcome in task_outcomes.values())
+            self.send_debug(channel,{"message":f"Tasks Time: {round(tasks_elapsed_time, 1)} seconds (sequential: {round(sequential_time, 1)} seconds, saved: {round(max(0, sequential_time - tasks_elapsed_time), 1)} seconds)"})
         # Stop the timer  
         end_time = time.time()  
         # Calculate the elapsed time  
         elapsed_time = round(end_time - start_time )
         self.send_system(channel,{"message":f"Processing Time: {elapsed_time} seconds"}) 
+        cache_stats = self.get_client("azure_openai_client").get_cache_stats()
+        if cache_stats is not None:
+            self.send_debug(channel,{"message":f"LLM Cache: {cache_stats}"})
         return task_results
   
     def update_session(self, prompt, plugin_response):  
         """  
         Update the session with the latest prompt and response.  
         """  
-        user_object = {"role": "user", "content": [{"type": "text", "text": prompt}]}  
-        assistant_object = {"role": "assistant", "content": [{"type": "text", "text": str(plugin_response)}]}  
-  
-        if len(self.session) >= self.context_window_size * 2:  
-            self.session.pop(0)  # Remove the oldest element twice (Assistant and User)  
-            self.session.pop(0)  
+        self.session.add(prompt, plugin_response)  
   
-        self.session.append(user_object)  
-        self.session.append(assistant_object)  
+    def create_session(self):  
+        """  
+        Create a new session managed against the context token budget.  
+        """  
+        return TeisecSession(  
+            self.context_window_size,  
+            int(os.getenv('ASSISTANT_CONTEXT_TOKEN_BUDGET', 8000)),  
+            int(os.getenv('ASSISTANT_CONTEXT_ENTRY_TOKENS', 2000)),  
+            int(os.getenv('ASSISTANT_CONTEXT_PREVIEW_ROWS', 10)),  
+            self.get_client("result_store") if self.result_store_enabled else None  
+        )  
   
-    def clear_session(self):  
+    def clear_session(self, session=None):  
         """  
-        Clear the current session.  
+        Clear a session (agent session if not provided).  
         """  
         print_info("Session Cleared")  
-        self.session.clear()  
+        (self.session if session is None else session).clear()  
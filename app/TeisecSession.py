@@ -0,0 +1,209 @@
+import uuid
+import sqlite3
+from app.HelperFunctions import count_tokens, count_message_tokens
+from app import ResultRenderer
+
+class SessionContext(list):
+    """
+    Copy of the session messages used as the context of a task. It keeps the ids of the results stored by the session
+    so plugins can only read the results of their own session.
+    """
+
+    def __init__(self, messages=(), result_ids=()):
+        super().__init__(messages)
+        self.result_ids = frozenset(result_ids)
+
+class TeisecSession(list):
+    """
+    Session context (list of user/assistant messages) managed against a token budget.
+    Oversized responses are compacted (truncated to representative rows or text) when they are added and the full
+    results are kept in the session, so the entry can be compacted again from the full result.
+    Older entries are compacted first and dropped only if the session still exceeds the budget.
+    With a result store, tabular results are always stored in it and the session only keeps a preview and the result id.
+    The results of the store are owned by the session: they are removed when their entry is dropped or the session is cleared.
+    """
+
+    def __init__(self, context_window_size=5, token_budget=8000, entry_token_limit=2000, preview_rows=10, result_store=None):
+        """
+        Initialize the session.
+
+        :param context_window_size: Maximum number of prompt/response pairs
+        :param token_budget: Maximum number of tokens of the whole session
+        :param entry_token_limit: Maximum number of tokens of a single response in the session
+        :param preview_rows: Number of rows kept when a tabular result is compacted
+        :param result_store: LocalResultStore where the tabular results are stored (optional)
+        """
+        super().__init__()
+        self.context_window_size = context_window_size
+        self.token_budget = token_budget
+        self.entry_token_limit = entry_token_limit
+        self.preview_rows = preview_rows
+        # Metadata of each prompt/response pair: full result id and compaction level
+        self.entries = []
+        self.results = {}
+        self.result_counter = 0
+        self.result_store = result_store
+        # Ids of the results stored by this session in the result store (the only results its prompts can read)
+        self.result_ids = []
+        # Owner of the results in the result store (the store eviction limit is applied per session)
+        self.session_id = uuid.uuid4().hex
+
+    def store_result(self, result):
+        """
+        Store the full result of a response.
+
+        :return: Result id
+        """
+        self.result_counter += 1
+        result_id = f"res-{self.result_counter}"
+        self.results[result_id] = result
+        return result_id
+
+    def get_result(self, result_id):
+        """
+        Get the full result referenced by a compacted session entry.
+
+        :return: Full result or None if it is not available (ie. removed from the result store)
+        """
+        if result_id not in self.results and self.result_store is not None and result_id in self.result_ids:
+            try:
+                return self.result_store.get_result(result_id)
+            except sqlite3.Error:
+                return None
+        return self.results.get(result_id)
+
+    def compact_response(self, response, token_limit, result_id=None):
+        """
+        Compact a response to fit a token limit. Tabular results keep the first rows, text keeps its beginning.
+
+        :param response: Plugin response (structured result or text)
+        :param token_limit: Maximum number of tokens of the compacted response
+        :param result_id: Id of the full result in the result store (referenced in the compacted text)
+        :return: Compacted response text
+        """
+        text = str(response)
+        if count_tokens(text) <= token_limit:
+            return text
+        pointer = f" Full result stored as {result_id}." if result_id else ''
+        if ResultRenderer.is_tabular(response):
+            records = ResultRenderer.get_records(response)
+            columns = ResultRenderer.get_columns(records)
+            rows = min(self.preview_rows, len(records))
+            while rows > 1 and count_tokens(str(records[:rows])) > token_limit:
+                rows = rows // 2
+            return f"{records[:rows]}\n[Result truncated: showing {rows} of {len(records)} rows. Columns: {', '.join(str(column) for column in columns)}.{pointer}]"
+        # Approximate 4 characters per token
+        return f"{text[:token_limit * 4]}\n[... Response truncated.{pointer}]"
+
+    def preview_result(self, response, result_id):
+        """
+        Preview of a tabular result stored in the result store: the first rows, the columns and the result id.
+        """
+        records = ResultRenderer.get_records(response)
+        columns = ResultRenderer.get_columns(records)
+        rows = min(self.preview_rows, len(records))
+        while rows > 1 and count_tokens(str(records[:rows])) > self.entry_token_limit:
+            rows = rows // 2
+        return (f"{records[:rows]}\n[Showing {rows} of {len(records)} rows. Columns: {', '.join(str(column) for column in columns)}. "
+                f"Full result stored as {result_id} (it can be filtered, joined or aggregated locally)]")
+
+    def build_entry(self, prompt, plugin_response, source=None):
+        """
+        Build a session entry (user and assistant messages) compacting the response if needed.
+
+        :param prompt: User prompt
+        :param plugin_response: Plugin response (structured result or text)
+        :param source: Plugin of the response (stored with the result)
+        :return: Tuple with the messages and the entry metadata
+        """
+        result_id = None
+        if self.result_store is not None and ResultRenderer.is_tabular(plugin_response):
+            result_id = self.result_store.store(plugin_response, source, prompt, self.session_id)
+            self.result_ids.append(result_id)
+            response_text = self.preview_result(plugin_response, result_id)
+        else:
+            if count_tokens(str(plugin_response)) > self.entry_token_limit:
+                result_id = self.store_result(plugin_response)
+            response_text = self.compact_response(plugin_response, self.entry_token_limit)
+        user_object = {"role": "user", "content": [{"type": "text", "text": prompt}]}
+        assistant_object = {"role": "assistant", "content": [{"type": "text", "text": response_text}]}
+        return [user_object, assistant_object], {"result_id": result_id, "compacted": False}
+
+    def task_context(self, messages=()):
+        """
+        Context of a task: the session messages plus the given messages (ie. the results of the tasks it depends on).
+
+        :return: SessionContext with the messages and the result ids of the session
+        """
+        return SessionContext(list(self) + list(messages), self.result_ids)
+
+    def release_results(self, result_ids=None):
+        """
+        Remove results stored by the session from the result store.
+
+        :param result_ids: Result ids to remove (all the results of the session if not provided)
+        """
+        result_ids = [result_id for result_id in self.result_ids if result_ids is None or result_id in result_ids]
+        if self.result_store is not None:
+            for result_id in result_ids:
+                self.result_store.delete(result_id)
+        self.result_ids = [result_id for result_id in self.result_ids if result_id not in result_ids]
+
+    def append_entry(self, messages, metadata):
+        """
+        Append an entry to the session enforcing the context window size and the token budget.
+        """
+        if len(self.entries) >= self.context_window_size:
+            self.drop_oldest()
+        self.extend(messages)
+        self.entries.append(metadata)
+        self.enforce_budget()
+
+    def add(self, prompt, plugin_response):
+        """
+        Add a prompt and its response to the session.
+        """
+        messages, metadata = self.build_entry(prompt, plugin_response)
+        self.append_entry(messages, metadata)
+
+    def drop_oldest(self):
+        # Remove the oldest element twice (Assistant and User)
+        self.pop(0)
+        self.pop(0)
+        metadata = self.entries.pop(0)
+        if metadata["result_id"]:
+            self.results.pop(metadata["result_id"], None)
+            self.release_results([metadata["result_id"]])
+
+    def enforce_budget(self):
+        """
+        Compact the oldest entries (latest entry is kept) and then drop them until the session fits the token budget.
+        """
+        for index in range(len(self.entries) - 1):
+            if self.token_count() <= self.token_budget:
+                return
+            metadata = self.entries[index]
+            if metadata["compacted"]:
+                continue
+            assistant_object = self[index * 2 + 1]
+            text = assistant_object["content"][0]["text"]
+            # Results of the result store are not loaded again: their preview in the session is compacted
+            full_result = self.results.get(metadata["result_id"], text)
+            # Only the results of the result store can be read back (LocalResultsPlugin), so only they are referenced
+            store_result_id = metadata["result_id"] if metadata["result_id"] in self.result_ids else None
+            assistant_object["content"][0]["text"] = self.compact_response(full_result, self.entry_token_limit // 4, store_result_id)
+            metadata["compacted"] = True
+        while self.token_count() > self.token_budget and len(self.entries) > 1:
+            self.drop_oldest()
+
+    def token_count(self):
+        """
+        Count the tokens of the session messages.
+        """
+        return count_message_tokens(self)
+
+    def clear(self):
+        super().clear()
+        self.entries.clear()
+        self.results.clear()
+        self.release_results()
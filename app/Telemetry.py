@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+# Span attributes aggregated as counters
+SPAN_COUNTERS = ['prompt_tokens', 'completion_tokens', 'cached_tokens', 'bytes', 'rows']
+
+class Span:
+    """
+    Timed stage of a prompt. Attributes (tokens, bytes, rows...) are set while the stage runs and recorded when it ends.
+    """
+
+    def __init__(self, telemetry, stage, channel=None, **attributes):
+        self.telemetry = telemetry
+        self.stage = stage
+        self.channel = channel
+        self.attributes = dict(attributes)
+        self.status = 'success'
+        self.start_time = None
+        self.duration = 0.0
+
+    def set(self, **attributes):
+        """
+        Set span attributes. Counter attributes (prompt_tokens, completion_tokens, bytes, rows) are accumulated.
+        """
+        for name, value in attributes.items():
+            if name in SPAN_COUNTERS:
+                self.attributes[name] = self.attributes.get(name, 0) + int(value or 0)
+            else:
+                self.attributes[name] = value
+        return self
+
+    def set_usage(self, result_object, counted=True):
+        """
+        Set the token usage of an LLM result object (runPrompt contract). Responses served from the cache don't use
+        tokens: their stored usage is recorded as cached tokens.
+
+        :param result_object: Result object
+        :param counted: Record the tokens in the token counters. Spans wrapping other spans (ie. tasks) only report the
+                        usage as attributes so the tokens are not counted twice
+        """
+        if isinstance(result_object, dict):
+            prompt_tokens = int(result_object.get('prompt_tokens', 0) or 0)
+            completion_tokens = int(result_object.get('completion_tokens', 0) or 0)
+            if not counted:
+                self.attributes.update(reported_prompt_tokens=prompt_tokens, reported_completion_tokens=completion_tokens)
+            elif result_object.get('cached'):
+                self.set(cached_tokens=prompt_tokens + completion_tokens)
+            else:
+                self.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            if result_object.get('status') == 'error':
+                self.status = 'error'
+            if result_object.get('cached'):
+                self.attributes['cached'] = True
+        return self
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self.start_time
+        if exc_type is not None:
+            self.status = 'error'
+        self.telemetry.record(self)
+        return False
+
+    def to_dict(self):
+        return dict({"stage": self.stage, "status": self.status, "duration_ms": round(self.duration * 1000, 1)}, **self.attributes)
+
+class Telemetry:
+    """
+    Aggregates the spans of the prompt stages (decomposition, table selection, KQL generation, query execution, URL fetch,
+    HTML cleaning, response formatting...) in duration histograms and counters, exposed in Prometheus text format.
+    """
+
+    def __init__(self, buckets=None, emit_spans=True):
+        """
+        Initialize the telemetry.
+
+        :param buckets: Upper bounds (seconds) of the duration histogram buckets
+        :param emit_spans: Send each span over the channel as a debug message
+        """
+        self.buckets = sorted(buckets or DEFAULT_BUCKETS)
+        self.emit_spans = emit_spans
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def span(self, stage, channel=None, **attributes):
+        """
+        Create a span to be used as a context manager around a stage.
+
+        :param stage: Stage name
+        :param channel: Channel callback. The span is sent as a debug message when it ends
+        :param attributes: Initial span attributes
+        :return: Span
+        """
+        return Span(self, stage, channel, **attributes)
+
+    def record(self, span):
+        """
+        Aggregate a finished span and send it over its channel.
+        """
+        with self.lock:
+            stage = self.stages.setdefault(span.stage, {
+                "bucket_counts": [0] * len(self.buckets),
+                "count": 0,
+                "sum": 0.0,
+                "status": {},
+                "counters": {name: 0 for name in SPAN_COUNTERS}
+            })
+            for index, upper_bound in enumerate(self.buckets):
+                if span.duration <= upper_bound:
+                    stage["bucket_counts"][index] += 1
+            stage["count"] += 1
+            stage["sum"] += span.duration
+            stage["status"][span.status] = stage["status"].get(span.status, 0) + 1
+            for name in SPAN_COUNTERS:
+                stage["counters"][name] += int(span.attributes.get(name, 0) or 0)
+        if self.emit_spans and span.channel is not None:
+            span_object = span.to_dict()
+            details = ', '.join(f"{name}: {value}" for name, value in span_object.items() if name not in ('stage', 'duration_ms'))
+            span.channel('debugmessage', {"message": f"Span {span.stage}: {span_object['duration_ms']} ms ({details})", "span": span_object})
+
+    def get_stats(self):
+        """
+        Get the aggregated statistics of each stage.
+
+        :return: Dictionary with the count, average duration (ms), status counts and counters of each stage
+        """
+        with self.lock:
+            return {stage_name: dict({"count": stage["count"], "avg_ms": round(stage["sum"] / stage["count"] * 1000, 1) if stage["count"] else 0,
+                                      "status": dict(stage["status"])}, **stage["counters"])
+                    for stage_name, stage in self.stages.items()}
+
+    def render_prometheus(self):
+        """
+        Render the metrics in Prometheus text exposition format.
+        """
+        lines = [
+            "# HELP teisec_stage_duration_seconds Duration of the prompt stages",
+            "# TYPE teisec_stage_duration_seconds histogram"
+        ]
+        with self.lock:
+            stages = {stage_name: {"bucket_counts": list(stage["bucket_counts"]), "count": stage["count"], "sum": stage["sum"],
+                                   "status": dict(stage["status"]), "counters": dict(stage["counters"])}
+                      for stage_name, stage in sorted(self.stages.items())}
+        for stage_name, stage in stages.items():
+            for upper_bound, bucket_count in zip(self.buckets, stage["bucket_counts"]):
+                lines.append(f'teisec_stage_duration_seconds_bucket{{stage="{stage_name}",le="{upper_bound}"}} {bucket_count}')
+            lines.append(f'teisec_stage_duration_seconds_bucket{{stage="{stage_name}",le="+Inf"}} {stage["count"]}')
+            lines.append(f'teisec_stage_duration_seconds_sum{{stage="{stage_name}"}} {stage["sum"]:.6f}')
+            lines.append(f'teisec_stage_duration_seconds_count{{stage="{stage_name}"}} {stage["count"]}')
+        lines += ["# HELP teisec_stage_spans_total Number of spans of the prompt stages by status", "# TYPE teisec_stage_spans_total counter"]
+        for stage_name, stage in stages.items():
+            for status, count in sorted(stage["status"].items()):
+                lines.append(f'teisec_stage_spans_total{{stage="{stage_name}",status="{status}"}} {count}')
+        lines += ["# HELP teisec_stage_tokens_total LLM tokens used by the prompt stages", "# TYPE teisec_stage_tokens_total counter"]
+        for stage_name, stage in stages.items():
+            lines.append(f'teisec_stage_tokens_total{{stage="{stage_name}",type="prompt"}} {stage["counters"]["prompt_tokens"]}')
+            lines.append(f'teisec_stage_tokens_total{{stage="{stage_name}",type="completion"}} {stage["counters"]["completion_tokens"]}')
+        for name, description in (("cached_tokens", "LLM tokens of the responses served from the cache (not used)"), ("bytes", "Bytes processed by the prompt stages"),
+                                  ("rows", "Rows returned by the prompt stages")):
+            lines += [f"# HELP teisec_stage_{name}_total {description}", f"# TYPE teisec_stage_{name}_total counter"]
+            for stage_name, stage in stages.items():
+                lines.append(f'teisec_stage_{name}_total{{stage="{stage_name}"}} {stage["counters"][name]}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+
+# Process-wide telemetry shared by the agent and the plugins
+telemetry = Telemetry(emit_spans=(os.getenv('ASSISTANT_TELEMETRY_SPANS', 'True') == 'True'))
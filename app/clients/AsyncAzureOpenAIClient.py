@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import queue
+import time
+import httpx
+from openai import AsyncAzureOpenAI,BadRequestError,APIConnectionError
+from app.clients.AzureOpenAIClient import AzureOpenAIClient
+class AsyncAzureOpenAIClient(AzureOpenAIClient):
+    """
+    Asyncio version of AzureOpenAIClient. All the requests share one HTTP connection pool and a semaphore caps the requests in flight.
+    The coroutines (arunPrompt, arunPromptBatch) run in a dedicated event loop thread, so the sync shims (runPrompt, runPromptBatch)
+    can be used from any thread as a drop-in replacement of AzureOpenAIClient.
+    """
+    def __init__(self,api_key,azure_endpoint,model_name,cache=None,max_concurrency=8,api_version=None,max_connections=20,audit_log=None):
+        self.max_connections=max_connections
+        self.loop=asyncio.new_event_loop()
+        self.loop_thread=threading.Thread(target=self.loop.run_forever,name='AsyncAzureOpenAIClient',daemon=True)
+        self.loop_thread.start()
+        super().__init__(api_key,azure_endpoint,model_name,cache,max_concurrency,api_version,audit_log)
+        self.semaphore=asyncio.Semaphore(max(1,max_concurrency))
+    def createClient(self,api_key,azure_endpoint):
+        self.http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_connections,max_keepalive_connections=self.max_connections),
+            timeout=httpx.Timeout(120.0,connect=10.0)
+        )
+        return AsyncAzureOpenAI(
+        azure_endpoint = azure_endpoint,
+        api_key=api_key,
+        api_version=self.api_version,
+        http_client=self.http_client
+        )
+
+    async def arunPrompt(self,prompt,session=[],use_cache=False,call_site=None):
+        start_time=time.perf_counter()
+        #The sync shims pass the call site because the coroutine runs in the event loop thread
+        call_site=call_site or self.getCallSite()
+        message_object=self.buildMessages(prompt,session)
+        cache_key,cached_result_object=self.getCachedResult(message_object,use_cache)
+        if cached_result_object is not None:
+            self.writeAudit(call_site,prompt,cached_result_object,start_time)
+            return cached_result_object
+        try:
+            async with self.semaphore:
+                completion = await self.client.chat.completions.create(
+                model=self.model_name,#Deployment Name
+                messages = message_object,
+                **self.completion_parameters
+                )
+            result_object=self.buildResultObject(completion)
+        except (BadRequestError,APIConnectionError) as e:
+            result_object=self.buildErrorObject(e)
+        self.writeAudit(call_site,prompt,result_object,start_time)
+        return self.storeResult(cache_key,result_object)
+    async def arunPromptBatch(self,prompts,use_cache=False,call_site=None):
+        """
+        Run a batch of prompts concurrently. Each element of prompts is a prompt string or a (prompt, session) tuple.
+        Results are returned in the same order. A failed prompt returns an error result object, so the results of the other prompts are always returned.
+        """
+        requests=[(prompt,[]) if isinstance(prompt,str) else prompt for prompt in prompts]
+        call_site=call_site or self.getCallSite()
+        results=await asyncio.gather(*(self.arunPrompt(prompt,list(session),use_cache,call_site) for prompt,session in requests),return_exceptions=True)
+        for result in results:
+            if isinstance(result,BaseException) and not isinstance(result,Exception):
+                raise result
+        return [self.buildErrorObject(result) if isinstance(result,Exception) else result for result in results]
+
+    async def astreamPrompt(self,prompt,session=[],use_cache=False,on_delta=None,call_site=None):
+        """
+        Run a prompt in streaming mode calling on_delta with each text delta. Returns the same result object as arunPrompt.
+        """
+        start_time=time.perf_counter()
+        call_site=call_site or self.getCallSite()
+        message_object=self.buildMessages(prompt,session)
+        cache_key,cached_result_object=self.getCachedResult(message_object,use_cache)
+        if cached_result_object is not None:
+            self.writeAudit(call_site,prompt,cached_result_object,start_time)
+            if on_delta is not None:
+                on_delta(cached_result_object['result'])
+            return cached_result_object
+        deltas=[]
+        usage=None
+        try:
+            async with self.semaphore:
+                stream = await self.client.chat.completions.create(
+                model=self.model_name,#Deployment Name
+                messages = message_object,
+                stream=True,
+                stream_options={"include_usage":True},
+                **self.completion_parameters
+                )
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        usage=chunk.usage
+                    #Azure sends chunks without choices (content filter results and usage)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        deltas.append(chunk.choices[0].delta.content)
+                        if on_delta is not None:
+                            on_delta(chunk.choices[0].delta.content)
+            result_object=dict({"status":'success',"result":''.join(deltas)},**self.buildUsage(usage))
+        except (BadRequestError,APIConnectionError) as e:
+            result_object=self.buildErrorObject(e)
+        self.writeAudit(call_site,prompt,result_object,start_time)
+        return self.storeResult(cache_key,result_object)
+
+    def runCoroutine(self,coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine,self.loop).result()
+    def runPrompt(self,prompt,session=[],use_cache=False):
+        return self.runCoroutine(self.arunPrompt(prompt,session,use_cache,self.getCallSite()))
+    def runPromptBatch(self,prompts,use_cache=False):
+        return self.runCoroutine(self.arunPromptBatch(prompts,use_cache,self.getCallSite()))
+    def streamPrompt(self,prompt,session=[],use_cache=False):
+        #The deltas generated in the event loop thread are handed over to the calling thread through a queue
+        deltas=queue.Queue()
+        end_of_stream=object()
+        call_site=self.getCallSite()
+        async def produce():
+            try:
+                return await self.astreamPrompt(prompt,session,use_cache,deltas.put,call_site)
+            finally:
+                deltas.put(end_of_stream)
+        future=asyncio.run_coroutine_threadsafe(produce(),self.loop)
+        while True:
+            delta=deltas.get()
+            if delta is end_of_stream:
+                break
+            yield delta
+        return future.result()
+    def close(self):
+        """
+        Close the connection pool and stop the event loop thread.
+        """
+        self.runCoroutine(self.http_client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -1,15 +1,37 @@
 from openai import AzureOpenAI,BadRequestError,APIConnectionError
+from concurrent.futures import ThreadPoolExecutor
 from colorama import Fore
+import sys
+import time
 class AzureOpenAIClient():
-    def __init__(self,api_key,azure_endpoint,model_name):
+    #Streaming token usage (stream_options) requires API version 2024-09-01-preview or later
+    api_version="2024-10-21"
+    def __init__(self,api_key,azure_endpoint,model_name,cache=None,max_concurrency=8,api_version=None,audit_log=None):
         self.model_name=model_name
-        self.client=AzureOpenAI(
-        azure_endpoint = azure_endpoint, 
-        api_key=api_key,  
-        api_version="2024-02-15-preview"
+        #Optional PromptAuditLog. Records are written by a background thread
+        self.audit_log=audit_log
+        if api_version:
+            self.api_version=api_version
+        #Maximum number of requests sent in parallel by runPromptBatch
+        self.max_concurrency=max_concurrency
+        self.client=self.createClient(api_key,azure_endpoint)
+        #Optional LLMResponseCache. Identical requests (messages, model and sampling parameters) are answered from the cache
+        self.cache=cache
+        self.completion_parameters={
+            "temperature":0.7,
+            "max_tokens":4000,
+            "top_p":0.95,
+            "frequency_penalty":0,
+            "presence_penalty":0,
+            "stop":None
+        }
+    def createClient(self,api_key,azure_endpoint):
+        return AzureOpenAI(
+        azure_endpoint = azure_endpoint,
+        api_key=api_key,
+        api_version=self.api_version
         )
-    
-    def runPrompt(self,prompt,session=[]):
+    def buildMessages(self,prompt,session):
         if (len(session)>0 and session[0]['role']=='system'):
             #session already contains System message
             message_object=session
@@ -18,38 +40,155 @@ class AzureOpenAIClient():
             message_object = [{"role":"system","content":"As an AI specializing in security analytics, your task is to retrieve and analyze security data from various platforms."}]
             message_object.extend(session)
         message_object.append({"role":"user","content":prompt})
-        result=''
-        status='success'
-        session_tokens=''
-        #print(prompt)
-        with open('promptaudit.log', 'a', encoding='utf-8') as f:  
-            f.write(''.join(prompt))
-            f.close()
-            #json.dump(table_schemas, f, ensure_ascii=False, indent=4)
+        return message_object
+    def getCallSite(self):
+        """
+        Identify the code that sent the prompt: the first frames outside the clients package (innermost first).
+        """
+        frame=sys._getframe(1)
+        while frame is not None and frame.f_globals.get('__name__','').startswith('app.clients'):
+            frame=frame.f_back
+        call_site=[]
+        while frame is not None and len(call_site)<3:
+            call_site.append(frame.f_globals.get('__name__','').rsplit('.',1)[-1]+'.'+frame.f_code.co_name)
+            frame=frame.f_back
+        return ' < '.join(call_site)
+    def writeAudit(self,call_site,prompt,result_object,start_time):
+        """
+        Queue the audit record of a prompt (non-blocking unless the audit log uses the block policy).
+        """
+        if self.audit_log is None:
+            return
+        self.audit_log.write({
+            "call_site":call_site,
+            "model":self.model_name,
+            "status":result_object.get('status'),
+            "cached":bool(result_object.get('cached')),
+            "prompt_tokens":result_object.get('prompt_tokens',0),
+            "completion_tokens":result_object.get('completion_tokens',0),
+            "latency_ms":round((time.perf_counter()-start_time)*1000,1),
+            "prompt":''.join(prompt),
+            "result":result_object.get('result')
+        })
+    def getCachedResult(self,message_object,use_cache):
+        """
+        Look up the request in the response cache.
+        Returns the cache key (None if the cache is not used) and the cached result object (None on miss).
+        """
+        if self.cache is None or not use_cache:
+            return None,None
+        cache_key=self.cache.build_key(message_object,self.model_name,self.completion_parameters)
+        cached_result_object=self.cache.get(cache_key)
+        if cached_result_object is not None:
+            cached_result_object['cached']=True
+        return cache_key,cached_result_object
+    def buildUsage(self,usage):
+        """
+        Token usage fields of the result objects (session_tokens is the total, kept as a string for compatibility).
+        """
+        if usage is None:
+            return {"session_tokens":'',"prompt_tokens":0,"completion_tokens":0}
+        return {"session_tokens":str(usage.total_tokens),"prompt_tokens":usage.prompt_tokens,"completion_tokens":usage.completion_tokens}
+    def buildResultObject(self,completion):
+        result=completion.choices[0].message.content
+        return dict({"status":'success',"result":result},**self.buildUsage(completion.usage))
+    def buildErrorObject(self,error):
+        if isinstance(error,BadRequestError):
+            result=error.code+' - '+error.message
+        else:
+            #Errors of the batch prompts can be any exception (ie. RateLimitError)
+            result=getattr(error,'message',None) or str(error)
+            print (error)
+        return dict({"status":'error',"result":result},**self.buildUsage(None))
+    def storeResult(self,cache_key,result_object):
+        if cache_key is not None and result_object['status']=='success':
+            self.cache.put(cache_key,result_object,int(result_object['session_tokens'] or 0))
+        return result_object
+
+    def runPrompt(self,prompt,session=[],use_cache=False):
+        start_time=time.perf_counter()
+        call_site=self.getCallSite()
+        message_object=self.buildMessages(prompt,session)
+        cache_key,cached_result_object=self.getCachedResult(message_object,use_cache)
+        if cached_result_object is not None:
+            self.writeAudit(call_site,prompt,cached_result_object,start_time)
+            return cached_result_object
         try:
             completion = self.client.chat.completions.create(
             model=self.model_name,#Deployment Name
             messages = message_object,
-            temperature=0.7,
-            max_tokens=4000,
-            top_p=0.95,
-            frequency_penalty=0,
-            presence_penalty=0,
-            stop=None
+            **self.completion_parameters
             )
-            result=completion.choices[0].message.content
-            session_tokens=str(completion.usage.total_tokens)
-
-        except BadRequestError as e:  
-            status='error'
-            result=e.code+' - '+e.message
-        except APIConnectionError as e:
-            status='error'
-            result=e.message
-            print (e)
-        result_object={"status":status,"result":result,"session_tokens":session_tokens}
-        #print(result)
-        with open('promptaudit.log', 'a', encoding='utf-8') as f:  
-            f.write(result)
-            f.close()
-        return result_object
\ No newline at end of file
+            result_object=self.buildResultObject(completion)
+        except (BadRequestError,APIConnectionError) as e:
+            result_object=self.buildErrorObject(e)
+        self.writeAudit(call_site,prompt,result_object,start_time)
+        return self.storeResult(cache_key,result_object)
+    def streamPrompt(self,prompt,session=[],use_cache=False):
+        """
+        Generator that yields the response text deltas as they are generated by the model.
+        When exhausted it returns (StopIteration value) the result object with the same contract as runPrompt, including the token usage.
+        """
+        start_time=time.perf_counter()
+        call_site=self.getCallSite()
+        message_object=self.buildMessages(prompt,session)
+        cache_key,cached_result_object=self.getCachedResult(message_object,use_cache)
+        if cached_result_object is not None:
+            self.writeAudit(call_site,prompt,cached_result_object,start_time)
+            yield cached_result_object['result']
+            return cached_result_object
+        deltas=[]
+        usage=None
+        try:
+            stream = self.client.chat.completions.create(
+            model=self.model_name,#Deployment Name
+            messages = message_object,
+            stream=True,
+            stream_options={"include_usage":True},
+            **self.completion_parameters
+            )
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage=chunk.usage
+                #Azure sends chunks without choices (content filter results and usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    deltas.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+            result_object=dict({"status":'success',"result":''.join(deltas)},**self.buildUsage(usage))
+        except (BadRequestError,APIConnectionError) as e:
+            result_object=self.buildErrorObject(e)
+        self.writeAudit(call_site,prompt,result_object,start_time)
+        return self.storeResult(cache_key,result_object)
+    def runPromptStream(self,prompt,session=[],on_delta=None,use_cache=False):
+        """
+        Run a prompt in streaming mode calling on_delta with each text delta. Returns the same result object as runPrompt.
+        """
+        stream=self.streamPrompt(prompt,session,use_cache)
+        while True:
+            try:
+                delta=next(stream)
+            except StopIteration as stop:
+                return stop.value
+            if on_delta is not None:
+                on_delta(delta)
+    def runPromptBatch(self,prompts,use_cache=False):
+        """
+        Run a batch of prompts concurrently (up to max_concurrency requests in flight).
+        Each element of prompts is a prompt string or a (prompt, session) tuple. Results are returned in the same order.
+        A failed prompt returns an error result object, so the results of the other prompts are always returned.
+        """
+        requests=[(prompt,[]) if isinstance(prompt,str) else prompt for prompt in prompts]
+        with ThreadPoolExecutor(max_workers=max(1,self.max_concurrency)) as executor:
+            return list(executor.map(lambda request: self.runBatchPrompt(request[0],list(request[1]),use_cache),requests))
+    def runBatchPrompt(self,prompt,session,use_cache):
+        try:
+            return self.runPrompt(prompt,session,use_cache)
+        except Exception as e:
+            return self.buildErrorObject(e)
+    def get_cache_stats(self):
+        """
+        Get the response cache statistics (hits, misses and tokens saved).
+        """
+        if self.cache is None:
+            return None
+        return self.cache.get_stats()
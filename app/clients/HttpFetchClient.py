@@ -0,0 +1,198 @@
+import requests
+from requests.adapters import HTTPAdapter
+import hashlib
+import json
+import os
+import threading
+import time
+
+class HttpFetchClient():
+    """
+    HTTP client to download public URLs with a persistent on-disk cache.
+    The raw content and the transformed content (ie. cleaned text) are cached. Stale entries are revalidated with
+    conditional requests (ETag / Last-Modified) so unchanged pages are not downloaded again.
+    """
+
+    def __init__(self, cache_dir='fetch_cache', freshness=3600, connect_timeout=5, read_timeout=30, max_bytes=5242880, pool_size=10):
+        """
+        Initialize the client.
+
+        :param cache_dir: Folder of the disk cache. Use None to disable the cache
+        :param freshness: Seconds a cached response is used without revalidating it
+        :param connect_timeout: Connection timeout in seconds
+        :param read_timeout: Read timeout in seconds
+        :param max_bytes: Maximum number of bytes downloaded per URL. Longer content is truncated
+        :param pool_size: Size of the HTTP connection pool
+        """
+        self.cache_dir = cache_dir
+        self.freshness = freshness
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_bytes = max_bytes
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.metrics = {}
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def cache_path(self, url, suffix):
+        url_hash = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{url_hash}.{suffix}")
+
+    def write_file(self, path, content):
+        # Write to a temporary file and replace to avoid partially written cache entries
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        mode = 'wb' if isinstance(content, bytes) else 'w'
+        with open(temp_path, mode, **({} if isinstance(content, bytes) else {"encoding": "utf-8"})) as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+    def load_entry(self, url):
+        """
+        Load the metadata of a cached URL.
+
+        :return: Metadata dictionary or None if the URL is not cached
+        """
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self.cache_path(url, 'json'), encoding='utf-8') as f:
+                entry = json.load(f)
+            if os.path.exists(self.cache_path(url, 'raw')):
+                return entry
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def load_raw(self, url):
+        with open(self.cache_path(url, 'raw'), 'rb') as f:
+            return f.read()
+
+    def save_entry(self, url, entry, raw_content=None):
+        if not self.cache_dir:
+            return
+        if raw_content is not None:
+            self.write_file(self.cache_path(url, 'raw'), raw_content)
+            # Raw content changed. Remove the transformed content
+            for transform_name in entry.pop('transforms', []):
+                try:
+                    os.remove(self.cache_path(url, f"{transform_name}.txt"))
+                except OSError:
+                    pass
+            entry['transforms'] = []
+        self.write_file(self.cache_path(url, 'json'), json.dumps(entry))
+
+    def update_metrics(self, url, outcome, latency, downloaded_bytes=0):
+        with self.lock:
+            url_metrics = self.metrics.setdefault(url, {"hits": 0, "revalidated": 0, "misses": 0, "errors": 0, "bytes_downloaded": 0, "last_latency_ms": 0})
+            url_metrics[outcome] += 1
+            url_metrics["bytes_downloaded"] += downloaded_bytes
+            url_metrics["last_latency_ms"] = round(latency * 1000, 2)
+
+    def download(self, url, headers):
+        """
+        Download a URL streaming the content up to the byte limit.
+
+        :return: Tuple with the response and the downloaded content (None if the status code is not 200)
+        """
+        with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+            if response.status_code != 200:
+                return response, None
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(chunk_size=65536):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= self.max_bytes:
+                    break
+            return response, b''.join(chunks)[:self.max_bytes]
+
+    def fetch(self, url, transform=None, transform_name='raw'):
+        """
+        Fetch a URL using the cache.
+
+        :param url: URL to fetch
+        :param transform: Function applied to the raw content (ie. HTML cleaning). Its result is cached too
+        :param transform_name: Name of the transformation. Change it when the transformation logic changes
+        :return: Dictionary with the status code, content (transformed if a transform is provided), cache outcome (hit, revalidated, miss) and truncated flag
+        """
+        start_time = time.time()
+        entry = self.load_entry(url)
+        outcome = 'hits'
+        raw_content = None
+        downloaded_bytes = 0
+        if entry is None or time.time() - entry['fetched'] > self.freshness:
+            headers = {}
+            if entry is not None and entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry is not None and entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+            try:
+                response, raw_content = self.download(url, headers)
+            except requests.RequestException:
+                self.update_metrics(url, 'errors', time.time() - start_time)
+                if entry is None:
+                    raise
+                # Serve the stale entry when the site can't be reached
+                response = None
+            if response is not None and response.status_code == 304 and entry is not None:
+                outcome = 'revalidated'
+                entry['fetched'] = time.time()
+                self.save_entry(url, entry)
+            elif response is not None and raw_content is not None:
+                outcome = 'misses'
+                downloaded_bytes = len(raw_content)
+                entry = {
+                    "url": url,
+                    "fetched": time.time(),
+                    "etag": response.headers.get('ETag'),
+                    "last_modified": response.headers.get('Last-Modified'),
+                    "content_type": response.headers.get('Content-Type'),
+                    "truncated": downloaded_bytes >= self.max_bytes,
+                    "transforms": (entry or {}).get('transforms', [])
+                }
+                self.save_entry(url, entry, raw_content)
+            elif response is not None:
+                self.update_metrics(url, 'errors', time.time() - start_time)
+                return {"status_code": response.status_code, "content": None, "cache": 'miss', "truncated": False}
+        content = self.get_content(url, entry, raw_content, transform, transform_name)
+        self.update_metrics(url, outcome, time.time() - start_time, downloaded_bytes)
+        return {"status_code": 200, "content": content, "cache": {'hits': 'hit', 'revalidated': 'revalidated', 'misses': 'miss'}[outcome], "truncated": entry.get('truncated', False)}
+
+    def get_content(self, url, entry, raw_content, transform, transform_name):
+        """
+        Get the (transformed) content of a URL from the cache or computing the transformation.
+        """
+        if transform is None:
+            return raw_content if raw_content is not None else self.load_raw(url)
+        if self.cache_dir and transform_name in entry.get('transforms', []):
+            try:
+                with open(self.cache_path(url, f"{transform_name}.txt"), encoding='utf-8') as f:
+                    return f.read()
+            except OSError:
+                pass
+        content = transform(raw_content if raw_content is not None else self.load_raw(url))
+        if self.cache_dir:
+            self.write_file(self.cache_path(url, f"{transform_name}.txt"), content)
+            entry.setdefault('transforms', [])
+            if transform_name not in entry['transforms']:
+                entry['transforms'].append(transform_name)
+            self.save_entry(url, entry)
+        return content
+
+    def get_stats(self, url=None):
+        """
+        Get the fetch metrics.
+
+        :param url: URL to get the metrics of. All the URLs if not provided
+        :return: Dictionary with the hits, revalidated, misses, errors, bytes downloaded and last latency
+        """
+        with self.lock:
+            if url is not None:
+                return dict(self.metrics.get(url, {}))
+            return {url: dict(url_metrics) for url, url_metrics in self.metrics.items()}
+
+    def close(self):
+        self.session.close()
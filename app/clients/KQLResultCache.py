@@ -0,0 +1,174 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+RELATIVE_TIME_PATTERN = re.compile(r'\b(ago|now|startofday|startofweek|startofmonth|startofyear)\s*\(', re.IGNORECASE)
+ABSOLUTE_TIME_PATTERN = re.compile(r'\bdatetime\s*\(', re.IGNORECASE)
+STRING_LITERAL_PATTERN = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")")
+
+class KQLResultCache():
+    """
+    In-memory cache of KQL query results keyed by the normalized query, workspace and timespan.
+    Queries with relative time (ago(), now()...) expire sooner than queries that only use absolute time.
+    Concurrent identical queries are combined in a single in-flight request (single-flight).
+    """
+
+    def __init__(self, relative_ttl=120, absolute_ttl=3600, max_cells=2000000):
+        """
+        Initialize the cache.
+
+        :param relative_ttl: Time to live (seconds) of results of queries using relative time or no time filter
+        :param absolute_ttl: Time to live (seconds) of results of queries using only absolute time
+        :param max_cells: Maximum number of cells (rows x columns) kept in memory. Least recently used results are evicted
+        """
+        self.relative_ttl = relative_ttl
+        self.absolute_ttl = absolute_ttl
+        self.max_cells = max_cells
+        self.results = OrderedDict()
+        self.in_flight = {}
+        self.cells = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "deduplicated": 0, "evictions": 0}
+
+    @staticmethod
+    def normalize_query(query):
+        """
+        Normalize a KQL query: remove comments, collapse whitespace (outside string literals) and the trailing semicolon.
+        """
+        parts = STRING_LITERAL_PATTERN.split(query)
+        normalized = []
+        for index, part in enumerate(parts):
+            if index % 2:
+                # String literal. Kept as is
+                normalized.append(part)
+            else:
+                part = re.sub(r'//[^\n]*', ' ', part)
+                normalized.append(re.sub(r'\s+', ' ', part))
+        return ''.join(normalized).strip().rstrip(';').strip()
+
+    @classmethod
+    def build_key(cls, query, workspace_id, timespan=None):
+        """
+        Build the cache key of a query.
+
+        :return: SHA-256 hex digest of the normalized query, workspace and timespan
+        """
+        request = f"{workspace_id}\n{timespan}\n{cls.normalize_query(query)}"
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get_ttl(self, query, timespan=None):
+        """
+        Get the time to live of the results of a query. Only queries with absolute time (datetime()) and no relative
+        time functions or relative timespan get the long TTL.
+        """
+        query = STRING_LITERAL_PATTERN.sub("''", query)
+        if RELATIVE_TIME_PATTERN.search(query):
+            return self.relative_ttl
+        if timespan is not None and not isinstance(timespan, tuple):
+            # timedelta or duration: relative to the current time
+            return self.relative_ttl
+        if ABSOLUTE_TIME_PATTERN.search(query) or isinstance(timespan, tuple):
+            return self.absolute_ttl
+        return self.relative_ttl
+
+    @staticmethod
+    def count_cells(result):
+        return sum(len(table.rows) * max(1, len(table.columns)) for table in result.tables)
+
+    def get(self, key):
+        """
+        Get a cached result.
+
+        :return: Cached result or None if it is not cached or expired
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.results.get(key)
+            if entry is not None and now <= entry[1]:
+                self.results.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[0]
+            if entry is not None:
+                self._remove(key)
+            return None
+
+    def put(self, key, result, ttl):
+        """
+        Store a successful result. Results larger than the memory cap are not cached.
+        """
+        cells = self.count_cells(result)
+        if cells > self.max_cells:
+            return
+        with self.lock:
+            if key in self.results:
+                self._remove(key)
+            self.results[key] = (result, time.time() + ttl, cells)
+            self.cells += cells
+            while self.cells > self.max_cells:
+                self._remove(next(iter(self.results)))
+                self.stats["evictions"] += 1
+
+    def _remove(self, key):
+        entry = self.results.pop(key)
+        self.cells -= entry[2]
+
+    def get_or_run(self, query, workspace_id, timespan, run_function):
+        """
+        Get the result of a query from the cache or run it. Concurrent identical queries wait for the first one.
+        Errors and partial results are returned but not cached.
+
+        :param query: KQL query
+        :param workspace_id: Log Analytics workspace id
+        :param timespan: Timespan of the query
+        :param run_function: Function without arguments that runs the query
+        :return: Query result
+        """
+        key = self.build_key(query, workspace_id, timespan)
+        result = self.get(key)
+        if result is not None:
+            return result
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+                self.stats["misses"] += 1
+            else:
+                self.stats["deduplicated"] += 1
+        if not leader:
+            return future.result()
+        try:
+            result = run_function()
+            if getattr(result, 'status', None) == 'Success':
+                self.put(key, result, self.get_ttl(query, timespan))
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.cells = 0
+
+    def get_stats(self):
+        """
+        Get the cache statistics.
+
+        :return: Dictionary with the hit/miss/deduplicated counters, hit ratio, cached results and cells
+        """
+        with self.lock:
+            stats = dict(self.stats)
+            stats["results"] = len(self.results)
+            stats["cells"] = self.cells
+        requests = stats["hits"] + stats["misses"] + stats["deduplicated"]
+        stats["hit_ratio"] = round((stats["hits"] + stats["deduplicated"]) / requests, 2) if requests else 0
+        return stats
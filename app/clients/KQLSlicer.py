@@ -0,0 +1,308 @@
+import re
+import time
+import functools
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+from app.KQLValidator import KQLValidator, ASSIGNMENT_PATTERN
+from app.KQLRewriter import KQLRewriter
+from app.clients.QueryResult import QueryResult, QueryResultTable
+
+# Operators that work row by row: running them per time slice and concatenating the slices gives the same rows
+ROW_LOCAL_OPERATORS = {'where', 'filter', 'project', 'project-away', 'project-keep', 'project-rename', 'project-reorder', 'extend', 'parse', 'parse-where', 'mv-expand'}
+# Operators applied again to the merged rows
+TAIL_OPERATORS = {'sort', 'order', 'take', 'limit', 'top'}
+# Aggregations that can be recombined from the partial aggregations of the slices: default output column prefix and combine function
+RECOMBINABLE_AGGREGATIONS = {'count': ('count_', 'sum'), 'countif': ('countif_', 'sum'), 'sum': ('sum_', 'sum'), 'sumif': ('sumif_', 'sum'),
+                             'min': ('min_', 'min'), 'max': ('max_', 'max')}
+# HTTP status codes of the slice errors that are retried (timeouts, throttling and server errors)
+TRANSIENT_STATUS_CODES = {408, 429}
+
+class KQLSlicer:
+    """
+    Time-sliced execution of a KQL query. The time range is split in slices that are run concurrently (bounded worker
+    pool) with the slice as the query timespan, and the slice results are merged in time order. Row queries are
+    concatenated, simple aggregations (count, countif, sum, sumif, min, max, arg_max/arg_min, distinct) are recombined
+    and the final sort/take/top operators are applied again to the merged rows. Failed slices are retried individually.
+    """
+
+    def __init__(self, max_workers=4, retries=2, retry_delay=1.0):
+        """
+        Initialize the slicer.
+
+        :param max_workers: Maximum number of slices run at the same time
+        :param retries: Number of times a failed slice is retried
+        :param retry_delay: Seconds before the first retry (doubled on each retry)
+        """
+        self.max_workers = max_workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+    @staticmethod
+    def plan(query):
+        """
+        Check if a query can be run in time slices and how the slice results are merged.
+
+        :return: Dictionary with the merge kind (rows, summarize, arg_max, arg_min, count, distinct), the aggregated
+                 columns and their combine functions, the tail operators and the query run in each slice, or None if
+                 the query can't be sliced
+        """
+        query = query.strip().rstrip(';')
+        segments, masked_segments = KQLRewriter.split_segments(query)
+        if not re.fullmatch(r'\s*[A-Za-z_]\w*\s*', masked_segments[0]) or masked_segments[0].strip().lower() in ('let', 'union', 'search', 'print', 'datatable', 'range'):
+            return None
+        plan = {"kind": "rows", "aggregations": {}, "arg_column": None, "tail": [], "slice_query": query}
+        operators = [(KQLRewriter.get_operator(masked_segment), re.sub(r'^\s*[\w-]+', '', masked_segment, count=1)) for masked_segment in masked_segments[1:]]
+        index = 0
+        while index < len(operators) and operators[index][0] in ROW_LOCAL_OPERATORS:
+            index += 1
+        if index < len(operators) and operators[index][0] in ('summarize', 'count', 'distinct'):
+            operator, arguments = operators[index]
+            if operator == 'count':
+                plan.update(kind="count", aggregations={"Count": "sum"})
+            elif operator == 'distinct':
+                plan["kind"] = "distinct"
+            else:
+                summarize_plan = KQLSlicer.plan_summarize(arguments)
+                if summarize_plan is None:
+                    return None
+                plan.update(summarize_plan)
+            index += 1
+        for operator, arguments in operators[index:]:
+            if operator not in TAIL_OPERATORS:
+                return None
+            plan["tail"].append((operator, arguments))
+        if plan["kind"] != "rows" and plan["tail"]:
+            # take/top of partial aggregations would drop groups: the slices run without them
+            plan["slice_query"] = KQLRewriter.join_segments(segments[:index + 1], query)
+        return plan
+
+    @staticmethod
+    def plan_summarize(arguments):
+        """
+        Get the recombination of the aggregations of a summarize operator.
+        """
+        arguments = re.sub(r'\bhint\.\w+\s*=\s*\w+', '', arguments)
+        aggregations = re.split(r'\bby\b', arguments, maxsplit=1)[0]
+        plan = {"kind": "summarize", "aggregations": {}, "arg_column": None}
+        items = [item for item in KQLValidator.split_top_level(aggregations, ',') if item.strip()]
+        for item in items:
+            assignment = ASSIGNMENT_PATTERN.match(item)
+            expression = item[assignment.end():].strip() if assignment else item.strip()
+            function = re.fullmatch(r'([a-z_]+)\s*\((.*)\)', expression, re.DOTALL)
+            if not function:
+                return None
+            name, function_arguments = function.group(1), function.group(2).strip()
+            if name in ('arg_max', 'arg_min'):
+                # Only arg_max/arg_min over a column as the single aggregation (ie. arg_max(TimeGenerated, *))
+                arg_column = KQLValidator.split_top_level(function_arguments, ',')[0].strip()
+                if len(items) > 1 or assignment or not re.fullmatch(r'[A-Za-z_]\w*', arg_column):
+                    return None
+                plan.update(kind=name, arg_column=arg_column)
+                continue
+            if name not in RECOMBINABLE_AGGREGATIONS:
+                return None
+            prefix, combine = RECOMBINABLE_AGGREGATIONS[name]
+            if assignment:
+                column = assignment.group(1)
+            elif name in ('count', 'countif'):
+                column = prefix
+            else:
+                aggregated_column = KQLValidator.split_top_level(function_arguments, ',')[0].strip()
+                if not re.fullmatch(r'[A-Za-z_]\w*', aggregated_column):
+                    return None
+                column = prefix + aggregated_column
+            plan["aggregations"][column] = combine
+        return plan
+
+    @staticmethod
+    def split_timespan(timespan, slice_duration, now=None):
+        """
+        Split a timespan in consecutive slices.
+
+        :param timespan: timedelta (until now) or (start, end) / (start, timedelta) tuple
+        :param slice_duration: Duration of each slice (timedelta)
+        :return: List of (start, end) tuples in time order
+        """
+        if isinstance(timespan, tuple):
+            start, end = timespan
+            if isinstance(end, timedelta):
+                end = start + end
+        else:
+            end = now or datetime.now(timezone.utc)
+            start = end - timespan
+        slices = []
+        slice_start = start
+        while slice_start < end:
+            slice_end = min(end, slice_start + slice_duration)
+            slices.append((slice_start, slice_end))
+            slice_start = slice_end
+        return slices
+
+    def run(self, query, timespan, slice_duration, execute, plan=None):
+        """
+        Run a query in time slices and merge the results.
+
+        :param query: KQL query
+        :param timespan: Time range of the query (timedelta until now or (start, end) tuple)
+        :param slice_duration: Duration of each slice (timedelta)
+        :param execute: Function running the query for a slice: execute(query, slice_timespan) returning a QueryResult or an error
+        :param plan: Merge plan (see plan). Computed if not provided
+        :return: Merged QueryResult (status PartialError if some slices failed after the retries), the error of the first
+                 slice if no slice returned results, or None if the query can't be sliced or the slice results can't be
+                 recombined (the query must be run as a whole)
+        """
+        plan = plan or self.plan(query)
+        if plan is None:
+            return None
+        slices = self.split_timespan(timespan, slice_duration)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(slices)))) as executor:
+            slice_results = list(executor.map(lambda slice_timespan: self.run_slice(plan["slice_query"], slice_timespan, execute), slices))
+        results = [result for result in slice_results if isinstance(result, QueryResult) and result.tables]
+        if not results:
+            # No slice returned data: the error of the first slice is returned as the error of the query
+            return slice_results[0] if slice_results else None
+        merged_result = self.merge(results, plan)
+        if merged_result is None:
+            return None
+        failed_slices = [(slice_timespan, result) for slice_timespan, result in zip(slices, slice_results) if not isinstance(result, QueryResult) or result.status != 'Success']
+        if failed_slices:
+            merged_result.status = 'PartialError'
+            merged_result.partial_error = f"{len(failed_slices)} of {len(slices)} time slices failed: " + '; '.join(
+                f"{start.isoformat()} - {end.isoformat()}: {self.get_error_message(result)}" for (start, end), result in failed_slices)
+        return merged_result
+
+    def run_slice(self, query, slice_timespan, execute):
+        """
+        Run the query of a slice, retrying the transient errors (timeouts, throttling, server errors and partial results).
+        """
+        result = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            try:
+                result = execute(query, slice_timespan)
+            except Exception as e:
+                result = e
+            if (isinstance(result, QueryResult) and result.status == 'Success') or not self.is_transient(result):
+                break
+        return result
+
+    @staticmethod
+    def is_transient(result):
+        """
+        Check if a slice error may succeed when retried. Semantic errors (ie. 400 for an unknown column) are not retried.
+        """
+        if isinstance(result, QueryResult):
+            return True
+        if isinstance(result, (ServiceRequestError, ServiceResponseError, TimeoutError, ConnectionError)):
+            return True
+        status_code = getattr(result, 'status_code', None)
+        if isinstance(result, HttpResponseError) and status_code is None and result.response is not None:
+            status_code = result.response.status_code
+        return status_code is not None and (status_code in TRANSIENT_STATUS_CODES or status_code >= 500)
+
+    @staticmethod
+    def get_error_message(result):
+        if isinstance(result, QueryResult):
+            return getattr(result.partial_error, 'message', None) or str(result.partial_error or result.status)
+        return getattr(result, 'message', None) or str(result)
+
+    def merge(self, results, plan):
+        """
+        Merge the slice results (in time order) following the merge plan.
+        """
+        tables = [result.primary_table for result in results if result.tables]
+        columns = next((table.columns for table in tables if table.columns), [])
+        columns_types = next((table.columns_types for table in tables if table.columns), [])
+        rows = [list(row) for table in tables if table.columns == columns for row in table.rows]
+        kind = plan["kind"]
+        if columns and (any(column not in columns for column in plan["aggregations"]) or (plan["arg_column"] and plan["arg_column"] not in columns)):
+            # Output columns don't match the expected aggregation names
+            return None
+        if not columns:
+            # No slice returned a table with columns: nothing to recombine
+            return QueryResult([QueryResultTable('PrimaryResult', [], [])])
+        if kind in ('summarize', 'count'):
+            rows = self.recombine(rows, columns, plan["aggregations"])
+        elif kind in ('arg_max', 'arg_min'):
+            rows = self.recombine_arg(rows, columns, plan["arg_column"], kind == 'arg_max')
+        elif kind == 'distinct':
+            rows = list({tuple(map(self.hashable, row)): row for row in rows}.values())
+        rows = self.apply_tail(rows, columns, plan["tail"])
+        return QueryResult([QueryResultTable('PrimaryResult', columns, rows, columns_types)])
+
+    @staticmethod
+    def hashable(value):
+        return repr(value) if isinstance(value, (dict, list)) else value
+
+    def recombine(self, rows, columns, aggregations):
+        aggregated_indexes = {columns.index(column): combine for column, combine in aggregations.items()}
+        key_indexes = [index for index in range(len(columns)) if index not in aggregated_indexes]
+        groups = {}
+        for row in rows:
+            key = tuple(self.hashable(row[index]) for index in key_indexes)
+            if key not in groups:
+                groups[key] = list(row)
+                continue
+            group = groups[key]
+            for index, combine in aggregated_indexes.items():
+                values = [value for value in (group[index], row[index]) if value is not None]
+                group[index] = (sum(values) if combine == 'sum' else min(values) if combine == 'min' else max(values)) if values else None
+        return list(groups.values())
+
+    def recombine_arg(self, rows, columns, arg_column, maximum):
+        arg_index = columns.index(arg_column)
+        # Group keys (by clause) are the columns before the arg_max column
+        key_indexes = list(range(arg_index))
+        groups = {}
+        for row in rows:
+            key = tuple(self.hashable(row[index]) for index in key_indexes)
+            current = groups.get(key)
+            if current is None or (row[arg_index] is not None and (current[arg_index] is None or (row[arg_index] > current[arg_index] if maximum else row[arg_index] < current[arg_index]))):
+                groups[key] = row
+        return list(groups.values())
+
+    @staticmethod
+    def sort_rows(rows, columns, sort_keys):
+        """
+        Sort rows by (column, descending) keys. Null values are placed last.
+        """
+        sort_keys = [(columns.index(column), descending) for column, descending in sort_keys if column in columns]
+        def compare(row_a, row_b):
+            for index, descending in sort_keys:
+                value_a, value_b = row_a[index], row_b[index]
+                if value_a == value_b:
+                    continue
+                if value_a is None or value_b is None:
+                    return 1 if value_a is None else -1
+                result = -1 if value_a < value_b else 1
+                return -result if descending else result
+            return 0
+        return sorted(rows, key=functools.cmp_to_key(compare))
+
+    @staticmethod
+    def parse_sort_keys(arguments):
+        sort_keys = []
+        for item in KQLValidator.split_top_level(arguments, ','):
+            match = re.match(r'\s*([A-Za-z_]\w*)\s*(asc|desc)?', item)
+            if match:
+                # KQL sorts in descending order by default
+                sort_keys.append((match.group(1), match.group(2) != 'asc'))
+        return sort_keys
+
+    def apply_tail(self, rows, columns, tail):
+        """
+        Apply the final sort/take/top operators to the merged rows.
+        """
+        for operator, arguments in tail:
+            if operator in ('sort', 'order'):
+                rows = self.sort_rows(rows, columns, self.parse_sort_keys(re.sub(r'^\s*by\b', '', arguments)))
+            elif operator in ('take', 'limit'):
+                count = re.match(r'\s*(\d+)', arguments)
+                rows = rows[:int(count.group(1))] if count else rows
+            elif operator == 'top':
+                top = re.match(r'\s*(\d+)\s+by\b(.*)', arguments, re.DOTALL)
+                if top:
+                    rows = self.sort_rows(rows, columns, self.parse_sort_keys(top.group(2)))[:int(top.group(1))]
+        return rows
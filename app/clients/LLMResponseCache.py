@@ -0,0 +1,113 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class LLMResponseCache():
+    """
+    Two tier (in-memory LRU + SQLite) cache of LLM responses keyed by a hash of the full request.
+    """
+
+    def __init__(self, db_file='llm_cache.db', memory_entries=256, ttl=86400, max_entries=5000):
+        """
+        Initialize the cache.
+
+        :param db_file: SQLite file used by the persistent tier. Use None to keep only the in-memory tier
+        :param memory_entries: Maximum number of entries of the in-memory LRU tier
+        :param ttl: Time to live of the entries in seconds
+        :param max_entries: Maximum number of entries of the persistent tier. Least recently used entries are evicted
+        """
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "tokens_saved": 0}
+        self.db = None
+        if db_file:
+            self.db = sqlite3.connect(db_file, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, tokens INTEGER, created REAL, last_access REAL)")
+            self.db.commit()
+
+    @staticmethod
+    def build_key(messages, model_name, parameters):
+        """
+        Build the cache key of a request.
+
+        :param messages: Full list of messages sent to the model
+        :param model_name: Model (deployment) name
+        :param parameters: Sampling parameters of the request
+        :return: SHA-256 hex digest of the request
+        """
+        request = json.dumps({"messages": messages, "model": model_name, "parameters": parameters}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Get a cached response.
+
+        :param key: Cache key
+        :return: Cached result object or None if the key is not cached or expired
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.memory_cache.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self.memory_cache.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                self.stats["tokens_saved"] += entry[2]
+                return dict(entry[0])
+            self.memory_cache.pop(key, None)
+            if self.db is not None:
+                row = self.db.execute("SELECT response, tokens, created FROM responses WHERE key=?", (key,)).fetchone()
+                if row is not None and now - row[2] <= self.ttl:
+                    self.db.execute("UPDATE responses SET last_access=? WHERE key=?", (now, key))
+                    self.db.commit()
+                    result_object = json.loads(row[0])
+                    self._put_memory(key, result_object, row[1], row[2])
+                    self.stats["disk_hits"] += 1
+                    self.stats["tokens_saved"] += row[1]
+                    return dict(result_object)
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, result_object, tokens=0):
+        """
+        Store a response in both tiers.
+
+        :param key: Cache key
+        :param result_object: Result object returned by the client
+        :param tokens: Tokens consumed to generate the response
+        """
+        now = time.time()
+        with self.lock:
+            self._put_memory(key, result_object, tokens, now)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?)", (key, json.dumps(result_object, ensure_ascii=False), tokens, now, now))
+                self._evict(now)
+                self.db.commit()
+
+    def _put_memory(self, key, result_object, tokens, created):
+        self.memory_cache[key] = (dict(result_object), created, tokens)
+        self.memory_cache.move_to_end(key)
+        while len(self.memory_cache) > self.memory_entries:
+            self.memory_cache.popitem(last=False)
+
+    def _evict(self, now):
+        # Remove expired entries and keep the persistent tier under the size limit
+        self.db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self.db.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def get_stats(self):
+        """
+        Get the cache statistics.
+
+        :return: Dictionary with the hit/miss counters, hit ratio and tokens saved
+        """
+        with self.lock:
+            stats = dict(self.stats)
+        requests = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["memory_hits"] + stats["disk_hits"]) / requests, 2) if requests else 0
+        return stats
@@ -0,0 +1,182 @@
+import re
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from datetime import datetime
+from app.clients.QueryResult import QueryResult, QueryResultTable
+
+# SQLite column affinity of the Log Analytics column types
+COLUMN_AFFINITIES = {'int': 'INTEGER', 'long': 'INTEGER', 'bool': 'INTEGER', 'boolean': 'INTEGER', 'real': 'REAL', 'double': 'REAL', 'decimal': 'REAL'}
+RESULT_ID_PATTERN = re.compile(r'\bres_[0-9a-f]{8}\b')
+# Statements allowed in the local queries (read only)
+ALLOWED_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+class LocalResultStore:
+    """
+    Embedded (SQLite) store of the full structured results of the tasks. Each result is stored as a table named after
+    its result id (ie. res_1a2b3c4d), so follow-up prompts can filter, project, join and aggregate previous results
+    locally with SQL instead of querying the workspace again. Each owner (session) keeps at most max_results results:
+    its oldest results are evicted first, so a session never evicts the results of another session.
+    """
+
+    def __init__(self, path=':memory:', max_results=100, max_rows=100000):
+        """
+        Initialize the store.
+
+        :param path: SQLite database file (':memory:' to keep the results in memory)
+        :param max_results: Maximum number of results stored per owner. Oldest results are removed first
+        :param max_rows: Maximum number of rows stored per result
+        """
+        self.max_results = max_results
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS results (result_id TEXT PRIMARY KEY, source TEXT, description TEXT, columns TEXT, row_count INTEGER, truncated INTEGER, created REAL, owner TEXT)")
+        if 'owner' not in [column[1] for column in self.connection.execute("PRAGMA table_info(results)")]:
+            # Store file created before the results had an owner
+            self.connection.execute("ALTER TABLE results ADD COLUMN owner TEXT")
+        self.connection.commit()
+        self.stats = {"stored": 0, "queries": 0, "errors": 0, "evictions": 0}
+
+    @staticmethod
+    def get_column_types(result, columns, records):
+        """
+        Get the SQLite affinity of each column from the result column types or, if not available, from the first value.
+        """
+        table = result.primary_table if isinstance(result, QueryResult) else result if isinstance(result, QueryResultTable) else None
+        if table is not None and len(table.columns_types) == len(table.columns):
+            return [COLUMN_AFFINITIES.get(str(column_type).lower(), 'TEXT') for column_type in table.columns_types]
+        column_types = []
+        for column in columns:
+            value = next((record.get(column) for record in records if record.get(column) is not None), None)
+            if isinstance(value, (bool, int)):
+                column_types.append('INTEGER')
+            elif isinstance(value, float):
+                column_types.append('REAL')
+            else:
+                column_types.append('TEXT')
+        return column_types
+
+    @staticmethod
+    def to_sql_value(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False, default=str)
+        if value is None or isinstance(value, (int, float, str, bytes)):
+            return value
+        return str(value)
+
+    @staticmethod
+    def quote(identifier):
+        return '"' + str(identifier).replace('"', '""') + '"'
+
+    def store(self, result, source=None, description=None, owner=None):
+        """
+        Store a structured result (QueryResult or list of records).
+
+        :param result: Structured result
+        :param source: Plugin that produced the result
+        :param description: Prompt or task of the result
+        :param owner: Session that stored the result (the eviction limit is applied per owner)
+        :return: Result id (also the name of its SQL table)
+        """
+        records = result.to_records() if hasattr(result, 'to_records') else list(result)
+        columns = list(result.columns) if isinstance(result, (QueryResult, QueryResultTable)) else []
+        for record in records:
+            for column in record.keys():
+                if column not in columns:
+                    columns.append(column)
+        column_types = self.get_column_types(result, columns, records)
+        result_id = f"res_{uuid.uuid4().hex[:8]}"
+        truncated = len(records) > self.max_rows
+        rows = [[self.to_sql_value(record.get(column)) for column in columns] for record in records[:self.max_rows]]
+        with self.lock:
+            column_definitions = ', '.join(f"{self.quote(column)} {column_type}" for column, column_type in zip(columns, column_types)) or '"_empty" TEXT'
+            self.connection.execute(f"CREATE TABLE {result_id} ({column_definitions})")
+            if rows and columns:
+                self.connection.executemany(f"INSERT INTO {result_id} VALUES ({', '.join('?' * len(columns))})", rows)
+            self.connection.execute("INSERT INTO results (result_id, source, description, columns, row_count, truncated, created, owner) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (result_id, source, description, json.dumps(list(zip(columns, column_types))), len(rows), int(truncated), time.time(), owner))
+            self.connection.commit()
+            self.stats["stored"] += 1
+            self.evict(owner)
+        return result_id
+
+    def evict(self, owner=None):
+        expired = self.connection.execute("SELECT result_id FROM results WHERE owner IS ? ORDER BY created DESC LIMIT -1 OFFSET ?", (owner, max(0, self.max_results))).fetchall()
+        for (result_id,) in expired:
+            self.remove(result_id)
+            self.stats["evictions"] += 1
+
+    def remove(self, result_id):
+        self.connection.execute(f"DROP TABLE IF EXISTS {self.quote(result_id)}")
+        self.connection.execute("DELETE FROM results WHERE result_id = ?", (result_id,))
+        self.connection.commit()
+
+    def delete(self, result_id):
+        """
+        Delete a stored result.
+        """
+        with self.lock:
+            self.remove(result_id)
+
+    def describe(self, result_ids=None):
+        """
+        Describe the stored results.
+
+        :param result_ids: Result ids to describe (all the results if not provided)
+        :return: List of dictionaries with the result id, source, description, columns (name and type), rows and truncated flag
+        """
+        with self.lock:
+            results = self.connection.execute("SELECT result_id, source, description, columns, row_count, truncated FROM results ORDER BY created").fetchall()
+        return [{"result_id": result_id, "source": source, "description": description, "columns": json.loads(columns), "rows": row_count, "truncated": bool(truncated)}
+                for result_id, source, description, columns, row_count, truncated in results if result_ids is None or result_id in result_ids]
+
+    def query(self, sql, max_rows=None, result_ids=None):
+        """
+        Run a read-only SQL query over the stored results.
+
+        :param sql: SQLite SELECT statement. Results are referenced by their result id (table name)
+        :param max_rows: Maximum number of rows returned
+        :param result_ids: Results the query is allowed to read (ie. the results of a session). All the results if not provided
+        :return: QueryResult with the rows of the query
+        :raises sqlite3.Error: If the query is not valid, tries to modify the store or reads other results
+        """
+        def authorize(action, table_name, *args):
+            if action not in ALLOWED_ACTIONS:
+                return sqlite3.SQLITE_DENY
+            if action == sqlite3.SQLITE_READ and result_ids is not None and table_name not in result_ids:
+                return sqlite3.SQLITE_DENY
+            return sqlite3.SQLITE_OK
+        with self.lock:
+            self.stats["queries"] += 1
+            self.connection.set_authorizer(authorize)
+            try:
+                cursor = self.connection.execute(sql.strip().rstrip(';'))
+                columns = [description[0] for description in cursor.description or []]
+                rows = cursor.fetchmany(max_rows) if max_rows else cursor.fetchall()
+            except sqlite3.Error:
+                self.stats["errors"] += 1
+                raise
+            finally:
+                self.connection.set_authorizer(None)
+        return QueryResult([QueryResultTable("LocalResult", columns, [list(row) for row in rows])])
+
+    def get_result(self, result_id):
+        """
+        Get all the rows of a stored result.
+        """
+        return self.query(f"SELECT * FROM {self.quote(result_id)}")
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["results"] = self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return stats
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,192 @@
+import os
+import glob
+import gzip
+import json
+import queue
+import shutil
+import atexit
+import threading
+import time
+from datetime import datetime, timezone
+
+class PromptAuditLog:
+    """
+    Asynchronous prompt audit sink. Records are queued by the request threads and written as JSON lines by a background
+    writer thread in batches, so auditing adds no file I/O to the request path. The file is rotated by size and age and
+    the rotated files are compressed (gzip). The queue is bounded: when it is full records are dropped or the caller
+    blocks until there is room, depending on the policy.
+    """
+
+    def __init__(self, path='promptaudit.jsonl', max_bytes=10485760, rotate_interval=86400, backup_count=10, queue_size=10000, policy='drop', flush_interval=1.0, batch_size=500):
+        """
+        Initialize the audit log and start the writer thread.
+
+        :param path: Audit file (JSON lines)
+        :param max_bytes: Rotate the file when it reaches this size (0 to disable)
+        :param rotate_interval: Rotate the file after this number of seconds (0 to disable)
+        :param backup_count: Number of rotated (compressed) files kept
+        :param queue_size: Maximum number of records waiting to be written
+        :param policy: What to do when the queue is full: 'drop' the record or 'block' the caller
+        :param flush_interval: Maximum seconds a record waits before being written
+        :param batch_size: Maximum number of records written at once
+        """
+        if policy not in ('drop', 'block'):
+            raise ValueError(f"Invalid audit queue policy: {policy}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.policy = policy
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.records = queue.Queue(maxsize=max(1, queue_size))
+        self.lock = threading.Lock()
+        self.stats = {"written": 0, "dropped": 0, "batches": 0, "rotations": 0, "errors": 0}
+        self.file = None
+        self.file_opened = 0
+        self.closed = False
+        self.stop_marker = object()
+        self.writer_thread = threading.Thread(target=self.run_writer, name='prompt-audit-writer', daemon=True)
+        self.writer_thread.start()
+        # Pending records are written when the process exits
+        atexit.register(self.close)
+
+    def write(self, record):
+        """
+        Queue an audit record. The timestamp is added if the record doesn't have one.
+
+        :param record: Dictionary with the record fields
+        :return: True if the record was queued, False if it was dropped
+        """
+        if self.closed:
+            return False
+        record.setdefault('timestamp', datetime.now(timezone.utc).isoformat())
+        try:
+            if self.policy == 'block':
+                self.records.put(record)
+            else:
+                self.records.put_nowait(record)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.stats["dropped"] += 1
+            return False
+
+    def run_writer(self):
+        """
+        Writer thread loop: wait for records and write them in batches.
+        """
+        while True:
+            try:
+                record = self.records.get(timeout=self.flush_interval)
+            except queue.Empty:
+                try:
+                    self.rotate_if_needed()
+                except OSError:
+                    # ie. the file was removed or rotated externally. The writer thread must keep running
+                    with self.lock:
+                        self.stats["errors"] += 1
+                continue
+            batch = [record]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(item is self.stop_marker for item in batch)
+            self.write_batch([item for item in batch if item is not self.stop_marker])
+            if stop:
+                self.close_file()
+                return
+
+    def write_batch(self, batch):
+        if not batch:
+            return
+        try:
+            self.rotate_if_needed()
+            if self.file is None:
+                self.open_file()
+            self.file.write(''.join(json.dumps(record, ensure_ascii=False, default=str) + '\n' for record in batch))
+            self.file.flush()
+            with self.lock:
+                self.stats["written"] += len(batch)
+                self.stats["batches"] += 1
+        except (OSError, ValueError, TypeError):
+            with self.lock:
+                self.stats["errors"] += 1
+
+    def open_file(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.file_opened = time.time()
+
+    def close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def rotate_if_needed(self):
+        """
+        Rotate the audit file if it exceeded the size or age limits.
+        """
+        if self.file is not None and not os.path.isfile(self.path):
+            # File removed or rotated externally: a new file is opened on the next write
+            self.close_file()
+            self.file_opened = 0
+        if self.file is None:
+            if not os.path.isfile(self.path):
+                return
+            # File left by a previous run. Its age is counted from its last modification
+            self.file_opened = self.file_opened or os.path.getmtime(self.path)
+        size_exceeded = self.max_bytes and os.path.getsize(self.path) >= self.max_bytes
+        age_exceeded = self.rotate_interval and time.time() - self.file_opened >= self.rotate_interval
+        if size_exceeded or (age_exceeded and os.path.getsize(self.path) > 0):
+            self.rotate()
+
+    def rotate(self):
+        """
+        Compress the current audit file into a timestamped backup and remove the oldest backups.
+        """
+        try:
+            self.close_file()
+            base, extension = os.path.splitext(self.path)
+            rotated_path = f"{base}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{extension}.gz"
+            with open(self.path, 'rb') as source, gzip.open(rotated_path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.remove(self.path)
+            self.file_opened = 0
+            with self.lock:
+                self.stats["rotations"] += 1
+            backups = sorted(glob.glob(f"{glob.escape(base)}.*{extension}.gz"))
+            for backup in backups[:max(0, len(backups) - self.backup_count)]:
+                os.remove(backup)
+        except OSError:
+            with self.lock:
+                self.stats["errors"] += 1
+
+    def get_stats(self):
+        """
+        Get the audit log statistics.
+
+        :return: Dictionary with the records written, dropped, queued, batches, rotations and errors
+        """
+        with self.lock:
+            stats = dict(self.stats)
+        stats["queued"] = self.records.qsize()
+        return stats
+
+    def close(self, timeout=10):
+        """
+        Write the pending records and stop the writer thread.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.records.put(self.stop_marker, timeout=timeout)
+        except queue.Full:
+            # Writer thread stuck or dead: the pending records are lost but the process can exit
+            return
+        self.writer_thread.join(timeout)
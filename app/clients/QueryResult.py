@@ -0,0 +1,186 @@
+import csv
+import io
+
+class QueryResultTable:
+    """
+    Columnar table returned by a Log Analytics query. Rows are kept as returned by the service and only converted
+    to records (dictionaries) when they are iterated or explicitly requested.
+    """
+
+    def __init__(self, name, columns, rows, columns_types=None):
+        """
+        Initialize the table.
+
+        :param name: Name of the table
+        :param columns: List of column names
+        :param rows: List of rows. Each row is a sequence of values in the column order
+        :param columns_types: List of column types (optional)
+        """
+        self.name = name
+        self.columns = list(columns)
+        self.columns_types = list(columns_types or [])
+        self.rows = rows
+
+    @classmethod
+    def from_logs_table(cls, table):
+        """
+        Build the table from an azure.monitor.query LogsTable.
+        """
+        return cls(table.name, table.columns, table.rows, getattr(table, 'columns_types', None))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        # Lazy iteration. Records are built one at a time
+        for row in self.rows:
+            yield dict(zip(self.columns, row))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [dict(zip(self.columns, row)) for row in self.rows[index]]
+        return dict(zip(self.columns, self.rows[index]))
+
+    def column(self, column_name):
+        """
+        Get all the values of a column.
+        """
+        column_index = self.columns.index(column_name)
+        return [row[column_index] for row in self.rows]
+
+    def to_records(self):
+        """
+        Convert the table to a list of records (dictionaries).
+        """
+        return list(self)
+
+    def to_csv(self, path=None):
+        """
+        Convert the table to CSV.
+
+        :param path: File to write the CSV to. If not provided the CSV is returned as a string
+        """
+        if path:
+            with open(path, 'w', encoding='utf-8', newline='') as output:
+                self.write_csv(output)
+            return path
+        output = io.StringIO()
+        self.write_csv(output)
+        return output.getvalue()
+
+    def write_csv(self, output):
+        """
+        Write the table as CSV to a file object.
+        """
+        writer = csv.writer(output)
+        writer.writerow(self.columns)
+        for row in self.rows:
+            writer.writerow(list(row))
+
+    def to_arrow(self):
+        """
+        Convert the table to a pyarrow Table. Requires the optional pyarrow package.
+        """
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("pyarrow is required to convert query results to Arrow. Install it with 'pip install pyarrow'")
+        columns = list(zip(*[list(row) for row in self.rows])) if self.rows else [[] for _ in self.columns]
+        return pyarrow.table({column_name: list(values) for column_name, values in zip(self.columns, columns)})
+
+    def __str__(self):
+        return str(self.to_records())
+
+    def __repr__(self):
+        return f"QueryResultTable(name={self.name!r}, columns={len(self.columns)}, rows={len(self.rows)})"
+
+class QueryResult:
+    """
+    Result of a Log Analytics query with all the returned tables.
+    It behaves as the primary (first) table so it can be iterated and indexed as a list of records.
+    """
+
+    def __init__(self, tables, status='Success', partial_error=None, statistics=None):
+        """
+        Initialize the result.
+
+        :param tables: List of QueryResultTable
+        :param status: Query status (Success or PartialError)
+        :param partial_error: Error returned with partial results
+        :param statistics: Query statistics returned by the service (optional)
+        """
+        self.tables = tables
+        self.status = status
+        self.partial_error = partial_error
+        self.statistics = statistics
+
+    @classmethod
+    def from_response_tables(cls, tables, status='Success', partial_error=None, statistics=None):
+        """
+        Build the result from the azure.monitor.query LogsTable list.
+        """
+        return cls([QueryResultTable.from_logs_table(table) for table in (tables or [])], status, partial_error, statistics)
+
+    @property
+    def primary_table(self):
+        return self.tables[0] if self.tables else QueryResultTable('PrimaryResult', [], [])
+
+    @property
+    def columns(self):
+        return self.primary_table.columns
+
+    def __len__(self):
+        return len(self.primary_table)
+
+    def __iter__(self):
+        return iter(self.primary_table)
+
+    def __getitem__(self, index):
+        return self.primary_table[index]
+
+    def to_records(self, table_index=0):
+        """
+        Convert a table of the result to a list of records (dictionaries).
+        """
+        return self.tables[table_index].to_records() if self.tables else []
+
+    def get_statistics_summary(self):
+        """
+        Summarize the query statistics returned by the service (requested with include_statistics).
+
+        :return: Dictionary with the execution time (ms), scanned and total rows and extents, peak memory and result
+                 size, or None if the result has no statistics
+        """
+        if not self.statistics:
+            return None
+        query_statistics = self.statistics.get('query', {})
+        input_statistics = query_statistics.get('inputDatasetStatistics', {})
+        dataset_statistics = query_statistics.get('datasetStatistics', [])
+        return {
+            "execution_ms": round(float(query_statistics.get('executionTime', 0) or 0) * 1000, 1),
+            "scanned_rows": input_statistics.get('rows', {}).get('scanned'),
+            "total_rows": input_statistics.get('rows', {}).get('total'),
+            "scanned_extents": input_statistics.get('extents', {}).get('scanned'),
+            "total_extents": input_statistics.get('extents', {}).get('total'),
+            "peak_memory_bytes": query_statistics.get('resourceUsage', {}).get('memory', {}).get('peakPerNode'),
+            "result_rows": sum(dataset.get('tableRowCount', 0) for dataset in dataset_statistics),
+            "result_bytes": sum(dataset.get('tableSize', 0) for dataset in dataset_statistics)
+        }
+
+    def to_csv(self, path=None, table_index=0):
+        """
+        Convert a table of the result to CSV.
+        """
+        return self.tables[table_index].to_csv(path) if self.tables else ''
+
+    def to_arrow(self, table_index=0):
+        """
+        Convert a table of the result to a pyarrow Table.
+        """
+        return self.tables[table_index].to_arrow() if self.tables else self.primary_table.to_arrow()
+
+    def __str__(self):
+        return str(self.to_records())
+
+    def __repr__(self):
+        return f"QueryResult(status={self.status!r}, tables={len(self.tables)}, rows={len(self)})"
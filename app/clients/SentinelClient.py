@@ -1,9 +1,10 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import threading
 import uuid
 import os
 from datetime import datetime, timezone, timedelta
-import pandas as pd
 from azure.identity import ClientSecretCredential,UsernamePasswordCredential 
 from azure.monitor.query import LogsQueryClient,LogsQueryStatus
 from azure.core.exceptions import (
@@ -13,6 +14,8 @@ from azure.core.exceptions import (
     ResourceNotFoundError,
     AzureError
 )
+from app.clients.QueryResult import QueryResult
+from app.clients.KQLSlicer import KQLSlicer
 class SentinelClient:
     login_url="https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
     API_url="https://management.azure.com/subscriptions/{subscriptionId}/resourceGroups/{resourceGroupName}/providers/Microsoft.OperationalInsights/workspaces/{workspaceName}/providers/Microsoft.SecurityInsights/"
@@ -24,39 +27,107 @@ class SentinelClient:
     API_version_logs="2018-08-01-preview"
     API_version_templates="2023-02-01"
     scope="https://management.azure.com/.default"
+    # Seconds before expires_on when a cached access token is renewed
+    token_refresh_margin=300
 
-    def __init__(self,credential,subscriptionId,resourceGroupName,workspaceName,workspace_id):
+    def __init__(self,credential,subscriptionId,resourceGroupName,workspaceName,workspace_id,query_cache=None,http_pool_size=10,http_timeout=60,slice_workers=4,slice_retries=2):
 
         self.subscriptionId = subscriptionId
         self.resourceGroupName = resourceGroupName
         self.workspaceName = workspaceName
         self.workspace_id=workspace_id
+        self.access_token=None
         self.access_token_timestamp=0
+        self.access_token_expires_on=0
+        self.token_lock=threading.Lock()
         self.credential=credential
+        # Pooled HTTP session (keep-alive) shared by all the REST API calls
+        self.http_timeout=http_timeout
+        self.http_session=requests.Session()
+        self.http_session.mount("https://",HTTPAdapter(pool_connections=http_pool_size,pool_maxsize=http_pool_size))
         self.logs_client=LogsQueryClient(self.credential)
+        # Optional KQLResultCache shared by all the queries of the workspace
+        self.query_cache=query_cache
+        # Time-sliced execution of long-range queries (bounded worker pool, failed slices retried individually)
+        self.slicer=KQLSlicer(slice_workers,slice_retries)
 
-    def run_query(self,query,printresults=False):
+    def run_query(self,query,printresults=False,timespan=None,use_cache=True,server_timeout=None,include_statistics=False):
+        """
+        Run a KQL query in the Log Analytics workspace.
+
+        :param query: KQL query
+        :param printresults: Print the primary table of the results (CSV)
+        :param timespan: Timespan of the query (timedelta, tuple or ISO 8601 duration). None to use only the query filters
+        :param use_cache: Use the query result cache (if configured)
+        :param server_timeout: Seconds the service runs the query before cancelling it (service default if None)
+        :param include_statistics: Return the query statistics (execution time, scanned data...) in the result
+        :return: QueryResult with all the returned tables (empty if the query failed) or the HttpResponseError
+        """
+        execute = lambda: self._execute_query(query, timespan, server_timeout, include_statistics)
+        if self.query_cache is not None and use_cache:
+            result = self.query_cache.get_or_run(query, self.workspace_id, timespan, execute)
+        else:
+            result = execute()
+        if printresults and isinstance(result, QueryResult):
+            print(result.to_csv())
+        return result
+
+    def _execute_query(self,query,timespan=None,server_timeout=None,include_statistics=False):
         try:
+            options = {"server_timeout": server_timeout} if server_timeout else {}
             response = self.logs_client.query_workspace(
                 workspace_id=self.workspace_id,
                 query=query,
-                #timespan=timedelta(days=1)
-                timespan=None
+                timespan=timespan,
+                include_statistics=include_statistics,
+                **options
                 )
+            statistics = getattr(response, 'statistics', None)
             if response.status == LogsQueryStatus.PARTIAL:
                 error = response.partial_error
-                data = response.partial_data
                 print(error.message)
+                return QueryResult.from_response_tables(response.partial_data, status='PartialError', partial_error=error, statistics=statistics)
             elif response.status == LogsQueryStatus.SUCCESS:
-                data = response.tables
-            for table in data:
-                df = pd.DataFrame(data=table.rows, columns=table.columns)
-                if printresults:
-                    print(df)
-                #return df.to_json(orient = 'split')
-                return df.to_dict(orient="records")
+                return QueryResult.from_response_tables(response.tables, statistics=statistics)
+            return QueryResult([], status=str(response.status))
         except HttpResponseError as err:
             return (err)
+
+    def run_query_sliced(self,query,timespan,slice_duration,printresults=False,use_cache=True,server_timeout=None):
+        """
+        Run a KQL query splitting its time range in slices that are run concurrently and merged in time order.
+        Simple aggregations (count, sum, min, max, arg_max...) are recombined. Queries that can't be sliced are run as a whole.
+
+        :param query: KQL query
+        :param timespan: Time range of the query (timedelta until now or (start, end) tuple)
+        :param slice_duration: Duration of each slice (timedelta)
+        :param printresults: Print the primary table of the merged results (CSV)
+        :param use_cache: Use the query result cache (if configured) for the merged results
+        :param server_timeout: Server timeout (seconds) of each slice
+        :return: QueryResult (status PartialError if some slices failed after the retries) or the HttpResponseError
+        """
+        plan=self.slicer.plan(query)
+        if plan is None:
+            return self.run_query(query,printresults,timespan,use_cache,server_timeout)
+        def execute():
+            result=self.slicer.run(query,timespan,slice_duration,lambda slice_query,slice_timespan: self._execute_query(slice_query,slice_timespan,server_timeout),plan)
+            # None if the slice results can't be recombined: the query is run as a whole
+            return result if result is not None else self._execute_query(query,timespan,server_timeout)
+        if self.query_cache is not None and use_cache:
+            result = self.query_cache.get_or_run(query, self.workspace_id, f"sliced:{timespan}:{slice_duration}", execute)
+        else:
+            result = execute()
+        if printresults and isinstance(result, QueryResult):
+            print(result.to_csv())
+        return result
+
+    def get_query_cache_stats(self):
+        """
+        Get the statistics of the query result cache.
+
+        :return: Dictionary with the cache statistics or None if the cache is disabled
+        """
+        return self.query_cache.get_stats() if self.query_cache is not None else None
     def _get_incident_api_url (self,incident_name):
         url = self.API_url.replace("{subscriptionId}",self.subscriptionId).replace("{resourceGroupName}",self.resourceGroupName).replace("{workspaceName}",self.workspaceName)
         url=url+"incidents/"+incident_name+"?api-version="+self.API_version_incidents
@@ -74,48 +145,85 @@ class SentinelClient:
         url=url+"alertRules/"+ruleName+"?api-version="+self.API_version_rules
         return url
     def _get_access_token (self):
-        now_ts=datetime.now().timestamp()
-        self.access_token=self.credential.get_token("https://management.azure.com/.default").token
-        self.access_token_timestamp=now_ts
-        return self.access_token
-        
-    def get_alerts (self):
-        print ("Invoking Alerts API - Get Alert Rule")
-        access_token=self._get_access_token()
-        url = self._get_rules_api_url()
+        """
+        Get an access token for the management API. The token is reused until shortly before it expires.
+        """
+        with self.token_lock:
+            now_ts=datetime.now().timestamp()
+            if self.access_token is None or now_ts>=self.access_token_expires_on-self.token_refresh_margin:
+                token=self.credential.get_token(self.scope)
+                self.access_token=token.token
+                self.access_token_expires_on=token.expires_on
+                self.access_token_timestamp=now_ts
+            return self.access_token
+    def _request (self,method,url,data=None):
+        """
+        Send a request to the management API using the pooled session.
+
+        :return: Response object
+        """
         headers = {
-           'authorization': 'Bearer ' + access_token
+           'authorization': 'Bearer ' + self._get_access_token()
         }
-        response = requests.request("GET", url, headers=headers)
-        return response.json()
-    def get_alerttemplates (self):
+        if data is not None:
+            headers['Content-Type']='application/json'
+        return self.http_session.request(method, url, headers=headers, data=data, timeout=self.http_timeout)
+    def _iter_pages (self,url):
+        """
+        Iterate the items of a list endpoint following the nextLink of each page. Pages are requested lazily.
+
+        :raises requests.HTTPError: If a page request fails (ie. 401/403 or a wrong workspace URL)
+        """
+        while url:
+            response=self._request("GET", url)
+            response.raise_for_status()
+            page=response.json()
+            for item in page.get("value",[]):
+                yield item
+            url=page.get("nextLink")
+    @staticmethod
+    def _error_payload (response):
+        """
+        Get the error returned by the management API (JSON body or status code and text).
+        """
+        try:
+            return response.json()
+        except ValueError:
+            return {"error":{"code":str(response.status_code),"message":response.text}}
+    def iter_alerts (self):
+        """
+        Iterate the analytic rules of the workspace (all pages).
+        """
+        print ("Invoking Alerts API - Get Alert Rule")
+        return self._iter_pages(self._get_rules_api_url())
+    def iter_alerttemplates (self):
+        """
+        Iterate the analytic rule templates of the workspace (all pages).
+        """
         print ("Invoking Alerts API - Get Alert Rule Template")
-        access_token=self._get_access_token()
-        url = self._get_ruletemplates_api_url()
-        headers = {
-           'authorization': 'Bearer ' + access_token
-        }
-        response = requests.request("GET", url, headers=headers)
-        return response.json()
+        return self._iter_pages(self._get_ruletemplates_api_url())
+    def get_alerts (self):
+        try:
+            return {"value":list(self.iter_alerts())}
+        except requests.HTTPError as err:
+            return self._error_payload(err.response)
+    def get_alerttemplates (self):
+        try:
+            return {"value":list(self.iter_alerttemplates())}
+        except requests.HTTPError as err:
+            return self._error_payload(err.response)
         
     def get_incident (self,incident_name):
         print ("Invoking Incidents API - Get Incident")
-        access_token=self._get_access_token()
         url = self._get_incident_api_url(incident_name)
-        headers = {
-           'authorization': 'Bearer ' + access_token
-        }
-        response = requests.request("GET", url, headers=headers)
+        response = self._request("GET", url)
         incident=response.json()
         return incident
     def update_incident (self,incident):
-        print ("Invoking Incidents API - Get Incident")
+        print ("Invoking Incidents API - Update Incident")
         incident_name=incident["name"]
-        access_token=self._get_access_token()
         url = self._get_incident_api_url(incident_name)
-        headers = {
-           'authorization': 'Bearer ' + access_token,
-           'Content-Type': 'application/json'
-        }
-        response = requests.request("PUT", url, headers=headers,data=json.dumps(incident))
-        return response.json()
\ No newline at end of file
+        response = self._request("PUT", url, data=json.dumps(incident))
+        return response.json()
+    def close (self):
+        self.http_session.close()
@@ -1,14 +1,27 @@
 from app.plugins.TeisecAgentPlugin import TeisecAgentPlugin  
-import requests  
-from requests.exceptions import MissingSchema,InvalidSchema
-from bs4 import BeautifulSoup  
+from app.BM25Index import BM25Index
+from app.HelperFunctions import count_tokens, print_plugin_debug
+from app.Telemetry import telemetry
+import os
+import re
  
 class FetchURLPlugin(TeisecAgentPlugin):  
     """  
     Plugin to fetch and process data from a URL.  
     """  
-  
-    def __init__(self, name, description, plugintype, azureOpenAIClient):  
+    plugin_name = "FetchURLPlugin"
+    plugin_description = "Plugin to fetch HTML sites"
+    plugin_type = "API"
+    required_clients = ["azure_openai_client", "http_fetch_client"]
+    capabilities={'fetchurl':"This capability retrieves data from external urls or site to be processed inside the session.It requires a valid URL in the prompt "}
+    help = "Use 'fetch', 'url', or 'download' in your prompt to retrieve data from a URL and process it."
+    routes = [
+        (r'^\s*https?://\S+\s*$', 0.95),
+        (r'https?://\S+', 0.6),
+        (r'\b(fetch|download|retrieve|get|read|open)\b.*\b(url|page|site|website|link)\b', 0.5)
+    ]
+  
+    def __init__(self, name, description, plugintype, azureOpenAIClient, httpFetchClient=None):  
         """  
         Initialize the FetchURLPlugin.  
   
@@ -16,26 +29,18 @@ class FetchURLPlugin(TeisecAgentPlugin):
         :param description: Description of the plugin  
         :param plugintype: Type of the plugin  
         :param azureOpenAIClient: Azure OpenAI Client instance  
+        :param httpFetchClient: HTTP Fetch Client instance (cached downloads). A client with the default settings is created if not provided  
         """  
         super().__init__(name, description, plugintype)  
         self.azureOpenAIClient = azureOpenAIClient  
+        if httpFetchClient is None:
+            from app.clients.HttpFetchClient import HttpFetchClient
+            httpFetchClient = HttpFetchClient()
+        self.httpFetchClient = httpFetchClient  
+        # Maximum tokens of fetched content sent to the session. Longer pages are chunked and only the most relevant chunks are kept (0 to disable)
+        self.token_budget = int(os.getenv('FETCHURL_TOKEN_BUDGET', 4000))
+        self.chunk_tokens = int(os.getenv('FETCHURL_CHUNK_TOKENS', 300))
   
-    def pluginhelp(self):  
-        """  
-        Provide help instructions for this plugin.  
-  
-        :return: Help instructions string  
-        """  
-        return "Use 'fetch', 'url', or 'download' in your prompt to retrieve data from a URL and process it."  
-  
-    def plugincapabilities(self):  
-        """  
-        Provide the plugin capabilities.  
-  
-        :return: plugin capabilities object  
-        """  
-        capabilities={'fetchurl':"This capability retrieves data from external urls or site to be processed inside the session.It requires a valid URL in the prompt "}
-        return  capabilities
     def clean_html(self, html_content):  
         """  
         Clean and extract text from HTML content.  
@@ -43,12 +48,23 @@ class FetchURLPlugin(TeisecAgentPlugin):
         :param html_content: Raw HTML content  
         :return: Cleaned text  
         """  
+        # Imported on first use to keep the startup fast  
+        from bs4 import BeautifulSoup  
         soup = BeautifulSoup(html_content, 'html.parser')  
   
         # Remove all script and style elements  
         for script_or_style in soup(['script', 'style']):  
             script_or_style.decompose()  
   
+        # Mark the headings (Markdown style) to keep the page structure  
+        for heading in soup(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):  
+            heading_text = heading.get_text(' ', strip=True)  
+            heading.replace_with(f"\n{'#' * int(heading.name[1])} {heading_text}\n" if heading_text else '')  
+  
+        # Keep paragraphs and list items in separate lines  
+        for block in soup(['p', 'li', 'tr', 'pre', 'blockquote']):  
+            block.append('\n')  
+  
         # Extract text  
         text = soup.get_text()  
   
@@ -63,25 +79,136 @@ class FetchURLPlugin(TeisecAgentPlugin):
   
         return cleaned_text  
   
-    def download_and_clean_url(self, url):  
+    @staticmethod
+    def truncate_text(text, max_tokens):  
+        """  
+        Get the longest beginning of a text within a token limit.  
+        """  
+        if count_tokens(text) <= max_tokens:
+            return text
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if count_tokens(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
+
+    def split_line(self, line):  
+        """  
+        Split a line longer than the chunk size (ie. minified text) in parts of the chunk size, at spaces when possible.  
+        """  
+        parts = []
+        while count_tokens(line) > self.chunk_tokens:
+            part = self.truncate_text(line, self.chunk_tokens)
+            space = part.rfind(' ')
+            if space > len(part) // 2:
+                part = part[:space + 1]
+            if not part:
+                break
+            parts.append(part)
+            line = line[len(part):]
+        parts.append(line)
+        return parts
+
+    def chunk_text(self, text):  
+        """  
+        Split a cleaned text in chunks by headings and paragraphs (lines).  
+        Sections longer than the chunk size are split by paragraphs and each part keeps the section heading.  
+        Lines longer than the chunk size are split in several parts.  
+  
+        :param text: Cleaned text  
+        :return: List of chunks in the original order  
+        """  
+        sections = []
+        for line in (part for line in text.splitlines() for part in self.split_line(line)):
+            if re.match(r'#{1,6} ', line) or not sections:
+                sections.append([line])
+            else:
+                sections[-1].append(line)
+        chunks = []
+        for section in sections:
+            heading = section[0] if re.match(r'#{1,6} ', section[0]) else ''
+            current = []
+            current_tokens = 0
+            for line in section:
+                line_tokens = count_tokens(line)
+                if current and current != [heading] and current_tokens + line_tokens > self.chunk_tokens:
+                    chunks.append('\n'.join(current))
+                    current = [heading] if heading else []
+                    current_tokens = count_tokens(heading) if heading else 0
+                current.append(line)
+                current_tokens += line_tokens
+            if current and current != [heading]:
+                chunks.append('\n'.join(current))
+        return chunks
+  
+    def select_relevant_chunks(self, text, query):  
+        """  
+        Keep the chunks of a text most relevant to a query (BM25) within the token budget.  
+  
+        :param text: Cleaned text  
+        :param query: Task prompt used to rank the chunks  
+        :return: Tuple with the reduced text (selected chunks in the original order) and the reduction stats  
+        """  
+        original_tokens = count_tokens(text)
+        if not self.token_budget or original_tokens <= self.token_budget:
+            return text, {"chunks": None, "original_tokens": original_tokens, "tokens": original_tokens, "reduction": 0}
+        chunks = self.chunk_text(text)
+        index = BM25Index(dict(enumerate(chunks)))
+        ranking = index.search(query)
+        if ranking[0][1] > 0:
+            # Chunks without any term of the query are not relevant
+            ranking = [(chunk_id, score) for chunk_id, score in ranking if score > 0]
+        separator = '\n...\n'
+        separator_tokens = count_tokens(separator)
+        selected = []
+        tokens = 0
+        for chunk_id, score in ranking:
+            chunk_tokens = count_tokens(chunks[chunk_id]) + (separator_tokens if selected else 0)
+            if tokens + chunk_tokens <= self.token_budget:
+                selected.append(chunk_id)
+                tokens += chunk_tokens
+        if not selected and ranking:
+            # No chunk fits the budget: the most relevant chunk is truncated
+            chunk_id = ranking[0][0]
+            chunks[chunk_id] = self.truncate_text(chunks[chunk_id], self.token_budget)
+            selected.append(chunk_id)
+            tokens = count_tokens(chunks[chunk_id])
+        reduced_text = separator.join(chunks[chunk_id] for chunk_id in sorted(selected))
+        stats = {"chunks": f"{len(selected)}/{len(chunks)}", "original_tokens": original_tokens, "tokens": tokens, "reduction": round(1 - tokens / original_tokens, 2)}
+        return reduced_text, stats
+  
+    def download_and_clean_url(self, url, channel=None):  
         """  
         Download content from a URL and clean it.  
   
         :param url: URL to fetch content from  
+        :param channel: Channel callback used to send the fetch and cleaning spans  
         :return: Cleaned text from the URL  
         """  
+        from requests.exceptions import MissingSchema,InvalidSchema,RequestException
+        def clean_html(html_content):
+            # Only called when the cleaned content is not cached
+            with telemetry.span('html_cleaning', channel, bytes=len(html_content)):
+                return self.clean_html(html_content)
         try:    
-            response = requests.get(url)  
+            with telemetry.span('url_fetch', channel) as span:
+                response = self.httpFetchClient.fetch(url, clean_html, 'clean_html-v2')  
+                span.set(bytes=len(response['content'] or ''), cache=response.get('cache'), status_code=response['status_code'])
 
-            if response.status_code == 200:  
-                cleaned_text = self.clean_html(response.content)  
+            if response['status_code'] == 200:  
+                cleaned_text = response['content']  
                 return cleaned_text  
             else:  
-                return f"Failed to retrieve content. Status code: {response.status_code}" 
+                return f"Failed to retrieve content. Status code: {response['status_code']}" 
         except MissingSchema as e:  
             return f"Failed to retrieve content. URL couldn't be extracted from the prompt."  
         except InvalidSchema as e:  
             return f"Failed to retrieve content. URL couldn't be extracted from the prompt."  
+        except RequestException as e:  
+            return f"Failed to retrieve content. {e}"  
     def runprompt(self, prompt, session,channel):  
         """  
         Extract the URL from the prompt and process it.  
@@ -97,12 +224,17 @@ class FetchURLPlugin(TeisecAgentPlugin):
         )  
   
         # Use the Azure OpenAI Client to extract the URL from the prompt  
-        result_object = self.azureOpenAIClient.runPrompt(extended_prompt, session)  
+        with telemetry.span('url_extraction', channel) as span:
+            result_object = self.azureOpenAIClient.runPrompt(extended_prompt, session, use_cache=True)  
+            span.set_usage(result_object)
         if result_object['status']=='success':
             # Download and clean the content from the extracted URL
             prompt_result=result_object['result']
             url=prompt_result.replace("```plaintext", "").replace("```", "").replace("\n", "").strip()   
-            result_object['result']=self.download_and_clean_url(url)
+            result_object['result'], reduction_stats=self.select_relevant_chunks(self.download_and_clean_url(url, channel), prompt)
+            channel('debugmessage',{"message":f"Fetch Cache ({url}): {self.httpFetchClient.get_stats(url)}"})
+            channel('debugmessage',{"message":f"Fetched content reduction ({url}): {reduction_stats}"})
+            print_plugin_debug(self.name, f"Fetched content reduction: {reduction_stats}")
             return result_object
         else:
             return result_object
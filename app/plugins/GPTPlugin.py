@@ -1,20 +1,24 @@
 from app.plugins.TeisecAgentPlugin import TeisecAgentPlugin
 class GPTPlugin(TeisecAgentPlugin):
+    plugin_name = "GPTPlugin"
+    plugin_description = "Plugin to run prompts in Azure OpenAI GPT models"
+    plugin_type = "GPT"
+    required_clients = ["azure_openai_client"]
+    capabilities={'runprompt':"This capability allows run a prompt without retrieving any additional external data. This plugin should be use if the user prompt doesn't require any additional or external data. THe main usage is to summarize current data or to generate new data based on the current context."}
+    help = "If your prompt doens't match any other plugin checks it will be submited to the GPT model"
+    routes = [
+        (r'^\s*(summari[sz]e|explain|describe|rewrite|translate|analy[sz]e)\b.*\b(above|previous|last|these|those|this)\b', 0.85),
+        (r'\b(executive summary|in plain (english|language))\b', 0.5)
+    ]
     def __init__(self, name, description,plugintype,azureOpenAIClient):
         super().__init__(name, description,plugintype)
         self.azureOpenAIClient=azureOpenAIClient
-    def runpromptonAzureAI(self,prompt,session):
-        result_object=self.azureOpenAIClient.runPrompt(prompt,session)
+    def runpromptonAzureAI(self,prompt,session,use_cache=False):
+        result_object=self.azureOpenAIClient.runPrompt(prompt,session,use_cache=use_cache)
         return result_object
-    def runprompt(self,prompt,session,channel):
-        return self.runpromptonAzureAI(prompt,session)
-    def pluginhelp(self):
-        return "If your prompt doens't match any other plugin checks it will be submited to the GPT model"
-    def plugincapabilities(self):  
-        """  
-        Provide the plugin capabilities.  
-  
-        :return: plugin capabilities object  
-        """  
-        capabilities={'runprompt':"This capability allows run a prompt without retrieving any additional external data. This plugin should be use if the user prompt doesn't require any additional or external data. THe main usage is to summarize current data or to generate new data based on the current context."}
-        return  capabilities
\ No newline at end of file
+    def runprompt(self,prompt,session,channel,use_cache=False):
+        #Creative prompts are not cached by default. Deterministic internal prompts (decomposition, formatting) can opt-in
+        return self.runpromptonAzureAI(prompt,session,use_cache)
+    def runpromptstream(self,prompt,session,channel,on_delta,use_cache=False):
+        #Same as runprompt but on_delta receives the response text as it is generated
+        return self.azureOpenAIClient.runPromptStream(prompt,session,on_delta,use_cache=use_cache)
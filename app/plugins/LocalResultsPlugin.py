@@ -0,0 +1,139 @@
+from app.plugins.TeisecAgentPlugin import TeisecAgentPlugin
+from app.HelperFunctions import print_plugin_debug
+from app.clients.LocalResultStore import RESULT_ID_PATTERN
+from app.Telemetry import telemetry
+import sqlite3
+import os
+import re
+
+class LocalResultsPlugin(TeisecAgentPlugin):
+    """
+    Plugin to filter, project, join and aggregate the results of previous prompts locally (SQL over the result store)
+    instead of querying the workspace again.
+    """
+    plugin_name = "LocalResultsPlugin"
+    plugin_description = "Plugin to query the results of previous prompts locally"
+    plugin_type = "API"
+    required_clients = ["azure_openai_client", "result_store"]
+    capabilities={'queryresults':"This capability filters, selects fields, joins, counts or aggregates the results of previous prompts stored in the session (referenced as res_xxxxxxxx) without retrieving new data. Use it when the user asks to refine, group, sort, count or combine results already retrieved. Do not use it to retrieve new incidents, alerts or logs"}
+    help = "Use 'previous results' or a result id (res_xxxxxxxx) in your prompt to filter or aggregate previous results locally."
+    routes = [
+        (r'^\s*(select|with)\b.*\bres_[0-9a-f]{8}\b', 0.95),
+        (r'\bres_[0-9a-f]{8}\b', 0.85),
+        (r'\b(filter|group|count|aggregate|sort|join|distinct|unique|top)\b.*\b(previous|above|prior|stored|those|these)\b.*\b(results?|rows|data)\b', 0.6)
+    ]
+
+    def __init__(self, name, description, plugintype, azureOpenAIClient, resultStore):
+        """
+        Initialize the LocalResultsPlugin.
+
+        :param name: Name of the plugin
+        :param description: Description of the plugin
+        :param plugintype: Type of the plugin
+        :param azureOpenAIClient: Azure OpenAI Client instance
+        :param resultStore: LocalResultStore instance
+        """
+        super().__init__(name, description, plugintype)
+        self.azureOpenAIClient = azureOpenAIClient
+        self.resultStore = resultStore
+        self.max_rows = int(os.getenv('LOCALRESULTS_MAX_ROWS', 1000))
+        self.sample_rows = int(os.getenv('LOCALRESULTS_SAMPLE_ROWS', 3))
+        self.repair_attempts = int(os.getenv('LOCALRESULTS_REPAIR_ATTEMPTS', 1))
+
+    @staticmethod
+    def getSessionResultIds(prompt, session):
+        """
+        Get the result ids referenced in the session and in the prompt (oldest first). Only the results stored by the
+        session are returned: ids of other sessions are ignored.
+        """
+        session_result_ids = getattr(session, 'result_ids', ())
+        texts = []
+        for message in session:
+            content = message.get('content', '')
+            if isinstance(content, list):
+                texts.extend(part.get('text', '') for part in content if isinstance(part, dict))
+            else:
+                texts.append(str(content))
+        texts.append(prompt)
+        return [result_id for result_id in dict.fromkeys(RESULT_ID_PATTERN.findall('\n'.join(texts))) if result_id in session_result_ids]
+
+    def describeResults(self, result_ids):
+        """
+        Describe the results (columns, types, rows and sample rows) for the SQL generation prompt.
+        """
+        descriptions = []
+        for result in self.resultStore.describe(result_ids):
+            columns = ', '.join(f'"{column}" {column_type}' for column, column_type in result['columns'])
+            sample = self.resultStore.query(f'SELECT * FROM {result["result_id"]} LIMIT {self.sample_rows}').to_records()
+            descriptions.append(f"Table {result['result_id']} ({result['rows']} rows, from the prompt: {result['description']})\nColumns: {columns}\nSample rows: {sample}")
+        return '\n\n'.join(descriptions)
+
+    def runSQL(self, sql, result_ids, channel):
+        with telemetry.span('local_query', channel) as span:
+            query_results = self.resultStore.query(sql, self.max_rows, result_ids)
+            span.set(rows=len(query_results))
+        return query_results
+
+    def runprompt(self, prompt, session, channel):
+        """
+        Run a SQL query over the previous results. Prompts that are already a SELECT statement are run directly,
+        otherwise the query is generated by the LLM from the columns of the results in the session.
+
+        :param prompt: Input prompt
+        :param session: Session context
+        :return: Result of the local query
+        """
+        result_ids = self.getSessionResultIds(prompt, session)
+        # The local queries can read all the results of the session (and only them)
+        allowed_result_ids = set(getattr(session, 'result_ids', ()))
+        if not result_ids:
+            return {"status": 'error', "result": "There are no previous results stored in the session", "session_tokens": 0}
+        result_object = {"status": 'success', "result": None, "session_tokens": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        if re.match(r'^\s*(select|with)\b', prompt, re.IGNORECASE):
+            sql = prompt
+        else:
+            sql_prompt = (
+                f"These tables contain the results of previous prompts:\n{self.describeResults(result_ids)}\n\n"
+                f"Write a single SQLite SELECT query over these tables to fulfill the prompt below:\n"
+                f"Prompt: {prompt}\n"
+                "- Dynamic (JSON) fields are stored as text. Use json_extract to access their properties.\n"
+                "- Your response must only contain the SQL code. No additional text must be added before or after the SQL code.\n"
+            )
+            sql = self.generateSQL(sql_prompt, session, channel, result_object)
+            if sql is None:
+                return result_object
+        attempt = 0
+        while True:
+            print_plugin_debug(self.name, f"Local Query:\n {sql}")
+            channel('debugmessage', {"message": f"Local SQL Query:\n {sql}"})
+            try:
+                result_object["result"] = self.runSQL(sql, allowed_result_ids, channel)
+                break
+            except sqlite3.Error as e:
+                if attempt >= self.repair_attempts or sql is prompt:
+                    result_object.update({"status": 'error', "result": f"Error running the local query: {e}"})
+                    return result_object
+                attempt += 1
+                sql = self.generateSQL(f"The following SQLite query failed with the error '{e}':\n{sql}\nFix the query. Your response must only contain the SQL code.\n", session, channel, result_object)
+                if sql is None:
+                    return result_object
+        channel('debugmessage', {"message": f"Local results: {len(result_object['result'])} rows from {', '.join(result_ids)}. Result store stats: {self.resultStore.get_stats()}"})
+        return result_object
+
+    def generateSQL(self, prompt, session, channel, result_object):
+        """
+        Generate a SQL query with the LLM and add its token usage to the result object.
+
+        :return: SQL query or None if the prompt failed (the result object contains the error)
+        """
+        with telemetry.span('sql_generation', channel) as span:
+            prompt_result_object = self.azureOpenAIClient.runPrompt(prompt, session)
+            span.set_usage(prompt_result_object)
+        result_object["prompt_tokens"] += prompt_result_object.get('prompt_tokens', 0)
+        result_object["completion_tokens"] += prompt_result_object.get('completion_tokens', 0)
+        result_object["session_tokens"] = prompt_result_object['session_tokens']
+        if prompt_result_object['status'] == 'error':
+            channel('systemmessage', {"message": f"Error (Generating SQL): {prompt_result_object['result']}"})
+            result_object.update({"status": 'error', "result": prompt_result_object['result']})
+            return None
+        return re.sub(r'```(sql|sqlite)?', '', prompt_result_object['result']).strip()
@@ -1,13 +1,52 @@
 from app.plugins.TeisecAgentPlugin import TeisecAgentPlugin  
 from colorama import Fore  
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import hashlib
+import shutil
+import math
+import time
 import json  
 import os  
-from app.HelperFunctions import print_plugin_debug  
+from app.HelperFunctions import print_plugin_debug, count_tokens  
+from app.BM25Index import BM25Index
+from app.KQLValidator import KQLValidator
+from app.KQLRewriter import KQLRewriter
+from app.clients.KQLSlicer import KQLSlicer
+from datetime import timedelta
+from app.clients.QueryResult import QueryResult
+from app.Telemetry import telemetry
+
+# Output format of the table enrichment prompts
+EXTENDED_SCHEMA_FORMAT = '{"tableDescription":"This is the description of the Table","schemaDetails":[{"fieldName":"FieldName1","fieldType":"string","description":"This is the description of FieldName1","sampleValue":"This is a sample Value for fieldName1"},{"fieldName":"FieldName2","fieldType":"dynamic","description":"This is the description of FieldName2","sampleValue":"This is a sample Value for fieldName2"}]}'
+# Tables whose extended schema includes all the fields
+FULL_SCHEMA_TABLES = ['SecurityAlert','SecurityIncident']
+# Fields of the extended schema of the other tables
+EXTENDED_SCHEMA_FIELDS = 12
+# Estimated completion tokens of each table (description) and field (name, type, description and sample value) of the extended schema
+OUTPUT_TOKENS_PER_TABLE = 60
+OUTPUT_TOKENS_PER_FIELD = 60
   
 class SentinelKQLPlugin(TeisecAgentPlugin):  
     """  
     Plugin to generate and run KQL queries adhering to the Sentinel schema.  
     """  
+    plugin_name = "SentinelKQLPlugin"
+    plugin_description = "Plugin to generate and run KQL queries in Sentinel"
+    plugin_type = "API"
+    required_clients = ["azure_openai_client", "sentinel_client"]
+    # Built at startup so the Sentinel Schema is loaded in the background
+    warmup = True
+    capabilities={'generateandrunkql':"This capability allows to generate and run KQL queries to retrieve logs and events from Microsoft Sentinel. This capability should be used when the user ask about retrieving new incidents or alerts. Other type of common data is Signin and Audit logs. Do not use this capabilitiy if the user ask for only KQL generation without runing it"}
+    help = "Use 'kql' in your prompt to generate and run KQL adhering to the Sentinel schema."
+    routes = [
+        (r'\b(run|execute)\b.*\b(kql|kusto)\b', 0.85),
+        (r'^\s*[A-Za-z_]+\s*\|\s*(where|summarize|project|extend|take|top|count)\b', 0.9),
+        (r'\|\s*(where|summarize|project|extend|take|top|join|count)\b', 0.6),
+        (r'\b(kql|kusto)\b', 0.4),
+        (r'\b(incidents?|alerts?|sign-?in ?logs|audit ?logs|security ?events)\b', 0.3),
+        (r'\b(show|list|get|find|retrieve|search)\b.*\b(in|from) (sentinel|log analytics)\b', 0.6)
+    ]
   
     def __init__(self, name, description, plugintype, azureOpenAIClient, sentinelClient, loadSchema=True):  
         """  
@@ -18,89 +57,596 @@ class SentinelKQLPlugin(TeisecAgentPlugin):
         :param plugintype: Type of the plugin  
         :param azureOpenAIClient: Azure OpenAI Client instance  
         :param sentinelClient: Sentinel Client instance  
-        :param loadSchema: Boolean to determine if the schema should be loaded  
+        :param loadSchema: Boolean to determine if the schema should be loaded (in a background thread)  
         """  
         super().__init__(name, description, plugintype)  
         self.azureOpenAIClient = azureOpenAIClient  
         self.sentinelClient = sentinelClient  
         self.loadSchema = loadSchema  
-        self.schema_file = 'SentinelSchema.json'  
-        self.extended_schema_file = 'extended_schema.json'
+        # Schema cache is stored per workspace so multiple workspaces don't overwrite each other
+        workspace_id = getattr(sentinelClient, 'workspace_id', None) or 'default'
+        self.schema_dir = os.path.join(os.getenv('SENTINELKQL_SCHEMA_DIR', 'schema_cache'), workspace_id)
+        self.schema_file = os.path.join(self.schema_dir, 'SentinelSchema.json')  
+        self.extended_schema_file = os.path.join(self.schema_dir, 'extended_schema.json')
+        self.fingerprints_file = os.path.join(self.schema_dir, 'schema_fingerprints.json')
+        self.checkpoint_file = os.path.join(self.schema_dir, 'extended_schema.checkpoint.json')
+        self.schema_refresh = (os.getenv('SENTINELKQL_SCHEMA_REFRESH', 'False') == 'True')
         self.sentinel_schema = None  
+        # Schema generation concurrency. Log Analytics and Azure OpenAI are throttled independently
+        self.schema_workers = int(os.getenv('SENTINELKQL_SCHEMA_WORKERS', 8))
+        self.loganalytics_semaphore = threading.Semaphore(int(os.getenv('SENTINELKQL_SCHEMA_LA_CONCURRENCY', 4)))
+        self.azureopenai_semaphore = threading.Semaphore(int(os.getenv('SENTINELKQL_SCHEMA_AOAI_CONCURRENCY', 4)))
+        # Batched enrichment: several tables per prompt (up to a token budget) and per union query
+        self.schema_batch = (os.getenv('SENTINELKQL_SCHEMA_BATCH', 'True') == 'True')
+        self.schema_batch_tokens = int(os.getenv('SENTINELKQL_SCHEMA_BATCH_TOKENS', 6000))
+        self.schema_batch_query_tables = int(os.getenv('SENTINELKQL_SCHEMA_BATCH_QUERY_TABLES', 20))
+        # The batched response must fit in the completion limit of the client (max_tokens): batches are also bounded by their estimated output
+        self.schema_batch_max_tables = int(os.getenv('SENTINELKQL_SCHEMA_BATCH_MAX_TABLES', 8))
+        self.schema_batch_output_tokens = int(os.getenv('SENTINELKQL_SCHEMA_BATCH_OUTPUT_TOKENS', 3000))
+        self.enrichment_lock = threading.Lock()
+        self.enrichment_stats = {}
+        # Local table index used to shortlist candidate tables before asking the LLM
+        self.table_index = None
+        self.table_volume_weights = {}
+        self.findtable_top_k = int(os.getenv('SENTINELKQL_FINDTABLE_TOPK', 8))
+        self.findtable_margin = float(os.getenv('SENTINELKQL_FINDTABLE_MARGIN', 2.0))
+        self.findtable_usage_weight = (os.getenv('SENTINELKQL_FINDTABLE_USAGE_WEIGHT', 'True') == 'True')
+        # Minimum score of the best table to select it without the LLM (a weak match on a single word is not enough)
+        self.findtable_min_score = float(os.getenv('SENTINELKQL_FINDTABLE_MIN_SCORE', 5.0))
+        self.findtable_stats = {"prompts": 0, "local_selections": 0, "llm_selections": 0, "shortlisted_llm_selections": 0, "shortlist_hits": 0}
+        self.findtable_lock = threading.Lock()
+        # Seconds a prompt waits for the schema warm-up before generating the KQL without schema
+        self.schema_wait = float(os.getenv('SENTINELKQL_SCHEMA_WAIT', 30))
+        self.schema_ready = threading.Event()
+        # Local validation of the generated KQL against the CSL schema with a bounded repair loop
+        self.kql_validation = (os.getenv('SENTINELKQL_KQL_VALIDATION', 'True') == 'True')
+        self.kql_repair_attempts = int(os.getenv('SENTINELKQL_KQL_REPAIR_ATTEMPTS', 2))
+        self.kql_validator = None
+        self.kql_validation_stats = {"queries": 0, "valid": 0, "repaired": 0, "failed": 0, "repair_calls": 0, "round_trips_avoided": 0}
+        self.kql_validation_lock = threading.Lock()
+        # Cost-aware rewrite (time filter, filter pushdown, row cap, timespan and server timeout) of the generated KQL
+        self.kql_rewrite = (os.getenv('SENTINELKQL_REWRITE', 'True') == 'True')
+        self.kql_rewriter = KQLRewriter(timedelta(days=float(os.getenv('SENTINELKQL_REWRITE_LOOKBACK_DAYS', 30))), int(os.getenv('SENTINELKQL_REWRITE_MAX_ROWS', 1000)))
+        # Also run the original query to compare the statistics of both queries (doubles the queries, for verification only)
+        self.kql_rewrite_compare = (os.getenv('SENTINELKQL_REWRITE_COMPARE', 'False') == 'True')
+        # Queries whose time window reaches the threshold are run in time slices (0 to disable)
+        self.slice_threshold = timedelta(days=float(os.getenv('SENTINELKQL_SLICE_THRESHOLD_DAYS', 14)))
+        self.slice_duration = timedelta(days=float(os.getenv('SENTINELKQL_SLICE_DAYS', 7)))
+        self.kql_rewrite_stats = {"queries": 0, "rewritten": 0, "compared": 0, "original_execution_ms": 0.0, "rewritten_execution_ms": 0.0, "original_scanned_rows": 0, "rewritten_scanned_rows": 0}
+        self.kql_rewrite_lock = threading.Lock()
   
         if loadSchema:  
+            threading.Thread(target=self.warmupSchema, name='schema-warmup', daemon=True).start()
+        else:
+            self.schema_ready.set()
+
+    @classmethod
+    def build(cls, agent):  
+        loadSchema=(os.getenv('SENTINELKQL_LOADSCHEMA', 'True')=='True' )
+        return cls(cls.plugin_name, cls.plugin_description, cls.plugin_type, agent.get_client("azure_openai_client"), agent.get_client("sentinel_client"), loadSchema)
+
+    def warmupSchema(self):  
+        """  
+        Load (or generate) the Sentinel Schema and build the table index. Runs in a background thread.  
+        """  
+        start_time = time.time()
+        try:
             self.sentinel_schema = self.loadSentinelSchema()  
+            self.buildTableIndex()
+            if self.kql_validation:
+                self.buildKQLValidator()
+            print_plugin_debug(self.name, f"Schema warm-up completed in {time.time() - start_time:.1f} seconds")  
+        except Exception as e:
+            self.sentinel_schema = None
+            print_plugin_debug(self.name, f"Schema warm-up failed: {e}. KQL will be generated without schema")  
+        finally:
+            self.schema_ready.set()
+
+    def buildKQLValidator(self):  
+        """  
+        Build the local KQL validator from the stored CSL schema of the workspace tables.  
+        """  
+        if not os.path.isfile(self.schema_file):
+            print_plugin_debug(self.name, "CSL schema not found. Generated KQL won't be validated locally")  
+            return
+        with open(self.schema_file, 'r', encoding='utf-8') as f:  
+            table_schemas = json.load(f)
+        self.kql_validator = KQLValidator(table_schemas)
+        print_plugin_debug(self.name, f"KQL validator built ({len(table_schemas)} tables)")  
+
+    def waitForSchema(self, channel):  
+        """  
+        Wait for the schema warm-up (up to schema_wait seconds).  
   
-    def pluginhelp(self):  
+        :return: True if the schema is available  
         """  
-        Provide help instructions for this plugin.  
+        if not self.schema_ready.is_set():
+            channel('debugmessage',{"message":"Waiting for the Sentinel Schema warm-up"})
+            self.schema_ready.wait(self.schema_wait)
+        if self.sentinel_schema is None:
+            channel('debugmessage',{"message":"Sentinel Schema not available. Generating KQL without schema"})
+            return False
+        return True
   
-        :return: Help instructions string  
+    def runSchemaQuery(self, query):  
         """  
-        return "Use 'kql' in your prompt to generate and run KQL adhering to the Sentinel schema."  
-    def plugincapabilities(self):  
+        Run a schema discovery query honouring the Log Analytics concurrency limit.  
+  
+        :param query: KQL query  
+        :return: Query results  
+        """  
+        with self.loganalytics_semaphore:
+            return self.sentinelClient.run_query(query, printresults=False)
+
+    def getWorkspaceTables(self):  
         """  
-        Provide the plugin capabilities.  
+        Retrieve the list of tables with data in the workspace.  
   
-        :return: plugin capabilities object  
+        :return: List of table names  
+        """  
+        query_results = self.sentinelClient.run_query("Usage | summarize by DataType", printresults=False)  
+        return [table['DataType'] for table in query_results]
+
+    def getTableSchema(self, table_name):  
         """  
-        capabilities={'generateandrunkql':"This capability allows to generate and run KQL queries to retrieve logs and events from Microsoft Sentinel. This capability should be used when the user ask about retrieving new incidents or alerts. Other type of common data is Signin and Audit logs. Do not use this capabilitiy if the user ask for only KQL generation without runing it"}
-        return  capabilities
+        Retrieve the CSL schema of a table.  
   
-    def generateSentinelSchema(self):  
+        :param table_name: Name of the Sentinel table  
+        :return: Table schema in CSL format  
+        """  
+        table_schema_results = self.runSchemaQuery(f"{table_name} | getschema kind=csl")
+        return table_schema_results[0]['Schema']  
+
+    def getTableSchemas(self, table_names):  
+        """  
+        Retrieve the CSL schema of multiple tables concurrently.  
+  
+        :param table_names: List of table names  
+        :return: Dictionary with the schema of each table. Tables that couldn't be retrieved are not included  
+        """  
+        table_schemas = {}
+        with ThreadPoolExecutor(max_workers=max(1, self.schema_workers)) as executor:
+            futures = {executor.submit(self.getTableSchema, table_name): table_name for table_name in table_names}
+            for future in as_completed(futures):
+                try:
+                    table_schemas[futures[future]] = future.result()
+                except Exception:
+                    print_plugin_debug(self.name, f"Error obtaining Schema for Table {futures[future]}. Table not supported")  
+        return table_schemas
+
+    @staticmethod
+    def schemaFingerprint(table_schema):  
+        """  
+        Compute the fingerprint of a table schema.  
+  
+        :param table_schema: Table schema in CSL format  
+        :return: SHA-256 hex digest of the schema  
+        """  
+        return hashlib.sha256(table_schema.encode('utf-8')).hexdigest()
+
+    def buildEnrichmentPrompt(self, table_name, table_schema, sample_rows):  
+        """  
+        Build the enrichment prompt of a single table.  
+  
+        :param table_name: Name of the Sentinel table  
+        :param table_schema: Table schema in CSL format  
+        :param sample_rows: Sample rows of the table  
+        :return: Prompt text  
+        """  
+        extended_prompt =f"Below you have the schema and some sample rows of the content of table {table_name} in Microsoft Sentinel.\n"
+        if table_name in FULL_SCHEMA_TABLES:
+            extended_prompt +="I need you to create an JSON object with all the fields and its description.\n"
+        else: 
+            extended_prompt +=f'I need you to create an JSON object with the most important fields and its description.Limit the number of fields to {EXTENDED_SCHEMA_FIELDS}\n'
+        extended_prompt +=f'Only Return a JSON object that follows this schema {EXTENDED_SCHEMA_FORMAT}\n'
+        extended_prompt +=f"This is the table Schema:\n {table_schema}\n" 
+        extended_prompt +=f"This is the sample data rows:\n {sample_rows}\n"  
+        return extended_prompt
+
+    def runEnrichmentPrompt(self, prompt):  
+        """  
+        Run an enrichment prompt and account its calls and tokens.  
+  
+        :param prompt: Enrichment prompt  
+        :return: Response text without JSON code tags  
         """  
-        Retrieve and store the schema of Azure Sentinel tables.  
+        with self.azureopenai_semaphore:
+            result_object = self.runpromptonAzureAI(prompt,[],use_cache=True)
+        with self.enrichment_lock:
+            self.enrichment_stats["calls"] += 1
+            self.enrichment_stats["prompt_tokens"] += count_tokens(prompt)
+            self.enrichment_stats["tokens"] += int(result_object.get('session_tokens') or 0)
+        return result_object['result'].replace("```json", "").replace("```", "").strip()
+
+    def generateTableSchema(self, table_name, table_schema=None, sample_rows=None):  
         """  
-        query = "Usage | summarize by DataType"  
-        query_results = self.sentinelClient.run_query(query, printresults=False)  
-        table_schemas = {}  
-        table_extended_schemas = {} 
-        print_plugin_debug(self.name, f"Retrieving Sentinel Schema for Workspace tables ({len(query_results)})")  
-        for table in query_results:  
-            table_name=table['DataType']
-            table_schema = f"{table_name} | getschema kind=csl"
+        Retrieve the schema and sample rows of a table and enrich them using Azure OpenAI.  
+  
+        :param table_name: Name of the Sentinel table  
+        :param table_schema: Table schema in CSL format. It is retrieved from the workspace if not provided  
+        :param sample_rows: Sample rows of the table. They are retrieved from the workspace if not provided  
+        :return: Tuple with the table schema and the extended schema object  
+        """  
+        if table_schema is None:
+            table_schema = self.getTableSchema(table_name)
+        if sample_rows is None:
+            sample_rows = self.runSchemaQuery(f"{table_name} | where TimeGenerated > ago(30d) |take 3")   
+        extended_schema = self.runEnrichmentPrompt(self.buildEnrichmentPrompt(table_name, table_schema, sample_rows))
+        return table_schema, json.loads(extended_schema)
+
+    def collectTableData(self, table_names, known_schemas=None):  
+        """  
+        Retrieve the CSL schema and sample rows of multiple tables using one union query per group of tables
+        (SENTINELKQL_SCHEMA_BATCH_QUERY_TABLES). Groups whose union query fails are retrieved table by table.  
+  
+        :param table_names: List of table names  
+        :param known_schemas: Dictionary with the already retrieved CSL schema of the tables (optional)  
+        :return: Dictionary with the schema and sample rows of each table. Tables that couldn't be retrieved are not included  
+        """  
+        known_schemas = known_schemas or {}
+        groups = [table_names[i:i + self.schema_batch_query_tables] for i in range(0, len(table_names), max(1, self.schema_batch_query_tables))]
+        table_data = {}
+        with ThreadPoolExecutor(max_workers=max(1, self.schema_workers)) as executor:
+            futures = [executor.submit(self.collectTableGroup, group, known_schemas) for group in groups]
+            for future in as_completed(futures):
+                table_data.update(future.result())
+        return table_data
+
+    def collectTableGroup(self, table_names, known_schemas):  
+        """  
+        Retrieve the CSL schema and sample rows of a group of tables with a union query or, if it fails, table by table.  
+        """  
+        try:
+            return self.collectTableGroupData(table_names, known_schemas)
+        except Exception as err:
+            print_plugin_debug(self.name, f"Error obtaining Schema for Tables {table_names} in a single query ({err}). Retrieving them one by one")  
+            return self.collectTableGroupData(table_names, known_schemas, union=False)
+
+    def collectTableGroupData(self, table_names, known_schemas, union=True):  
+        """  
+        Retrieve the CSL schema and sample rows of a group of tables.  
+  
+        :param table_names: List of table names  
+        :param known_schemas: Dictionary with the already retrieved CSL schema of the tables  
+        :param union: Retrieve all the tables in a single union query. Otherwise two queries per table are run  
+        :return: Dictionary with the schema and sample rows of each table  
+        """  
+        table_data = {}
+        if not union:
+            for table_name in table_names:
+                try:
+                    table_schema = known_schemas.get(table_name) or self.getTableSchema(table_name)
+                    sample_rows = self.runSchemaQuery(f"{table_name} | where TimeGenerated > ago(30d) |take 3")
+                    table_data[table_name] = {"schema": table_schema, "samples": sample_rows.to_records()}
+                except Exception:
+                    print_plugin_debug(self.name, f"Error obtaining Schema for Table {table_name}. Table not supported")  
+            return table_data
+        subqueries = []
+        for table_name in table_names:
+            if table_name not in known_schemas:
+                subqueries.append(f'({table_name} | getschema kind=csl | project _SchemaTable="{table_name}", Schema)')
+            subqueries.append(f'({table_name} | where TimeGenerated > ago(30d) | take 3 | project _SchemaTable="{table_name}", _SampleRow=pack_all(true))')
+        query_results = self.runSchemaQuery("union isfuzzy=true " + ", ".join(subqueries))
+        if not isinstance(query_results, QueryResult) or query_results.status != 'Success':
+            raise ValueError(f"union query failed: {query_results if not isinstance(query_results, QueryResult) else query_results.status}")
+        for table_name in table_names:
+            table_data[table_name] = {"schema": known_schemas.get(table_name), "samples": []}
+        for row in query_results:
+            entry = table_data.get(row.get('_SchemaTable'))
+            if entry is None:
+                continue
+            if row.get('Schema'):
+                entry["schema"] = row['Schema']
+            elif row.get('_SampleRow') is not None:
+                entry["samples"].append(row['_SampleRow'])
+        # Tables without schema don't exist in the workspace (isfuzzy skips them)
+        return {table_name: entry for table_name, entry in table_data.items() if entry["schema"]}
+
+    def planEnrichmentBatches(self, table_data):  
+        """  
+        Pack the tables in batches whose schema and sample rows fit in the batch token budget (SENTINELKQL_SCHEMA_BATCH_TOKENS)
+        and whose estimated response fits in the output budget (SENTINELKQL_SCHEMA_BATCH_OUTPUT_TOKENS), with up to
+        SENTINELKQL_SCHEMA_BATCH_MAX_TABLES tables. Tables larger than the budgets get a batch of their own.  
+  
+        :param table_data: Dictionary with the schema and sample rows of each table  
+        :return: List of batches (lists of table names)  
+        """  
+        batches = []
+        batch = []
+        batch_tokens = 0
+        batch_output_tokens = 0
+        for table_name, entry in table_data.items():
+            table_tokens = count_tokens(self.buildBatchTableSection(table_name, entry))
+            table_output_tokens = self.estimateEnrichmentOutputTokens(table_name, entry)
+            if batch and (batch_tokens + table_tokens > self.schema_batch_tokens or batch_output_tokens + table_output_tokens > self.schema_batch_output_tokens
+                          or len(batch) >= self.schema_batch_max_tables):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+                batch_output_tokens = 0
+            batch.append(table_name)
+            batch_tokens += table_tokens
+            batch_output_tokens += table_output_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @staticmethod
+    def estimateEnrichmentOutputTokens(table_name, entry):  
+        """  
+        Estimate the completion tokens of the extended schema of a table: all the fields for FULL_SCHEMA_TABLES, up to
+        EXTENDED_SCHEMA_FIELDS for the others.  
+        """  
+        fields = max(1, str(entry['schema'] or '').count(':'))
+        if table_name not in FULL_SCHEMA_TABLES:
+            fields = min(fields, EXTENDED_SCHEMA_FIELDS)
+        return OUTPUT_TOKENS_PER_TABLE + fields * OUTPUT_TOKENS_PER_FIELD
+
+    @staticmethod
+    def buildBatchTableSection(table_name, entry):  
+        return f"### Table: {table_name}\nSchema:\n {entry['schema']}\nSample data rows:\n {entry['samples']}\n"
+
+    def generateTableSchemasBatch(self, table_names, table_data):  
+        """  
+        Enrich several tables with a single Azure OpenAI prompt. The response is a JSON object keyed by table name.
+        Tables missing in the response or whose output is not valid are enriched with the per-table prompt.  
+  
+        :param table_names: List of table names of the batch  
+        :param table_data: Dictionary with the schema and sample rows of each table  
+        :return: Dictionary with the (table schema, extended schema) tuple of each enriched table  
+        """  
+        per_table_prompt_tokens = sum(count_tokens(self.buildEnrichmentPrompt(table_name, table_data[table_name]["schema"], table_data[table_name]["samples"])) for table_name in table_names)
+        with self.enrichment_lock:
+            self.enrichment_stats["per_table_prompt_tokens"] += per_table_prompt_tokens
+            self.enrichment_stats["batched_tables"] += len(table_names)
+        if len(table_names) == 1:
+            # A batch of a single table (ie. larger than the budgets) uses the per-table prompt
+            table_name = table_names[0]
+            return {table_name: self.generateTableSchema(table_name, table_data[table_name]["schema"], table_data[table_name]["samples"])}
+        full_schema_tables = [table_name for table_name in table_names if table_name in FULL_SCHEMA_TABLES]
+        extended_prompt = "Below you have the schema and some sample rows of the content of several tables in Microsoft Sentinel.\n"
+        extended_prompt += f"For each table I need you to create an JSON object with the most important fields and its description. Limit the number of fields to {EXTENDED_SCHEMA_FIELDS}"
+        extended_prompt += f" (except for tables {', '.join(full_schema_tables)}, which must include all the fields).\n" if full_schema_tables else ".\n"
+        extended_prompt += f'Only Return a JSON object whose keys are the table names and whose values follow this schema {EXTENDED_SCHEMA_FORMAT}\n'
+        for table_name in table_names:
+            extended_prompt += self.buildBatchTableSection(table_name, table_data[table_name])
+        try:
+            extended_schemas = json.loads(self.runEnrichmentPrompt(extended_prompt))
+        except Exception as err:
+            print_plugin_debug(self.name, f"Batched enrichment of {len(table_names)} tables failed ({err}). Falling back to per-table prompts")  
+            extended_schemas = {}
+        if not isinstance(extended_schemas, dict):
+            extended_schemas = {}
+        results = {}
+        for table_name in table_names:
+            extended_schema = extended_schemas.get(table_name)
+            if isinstance(extended_schema, dict) and isinstance(extended_schema.get('schemaDetails'), list):
+                results[table_name] = (table_data[table_name]["schema"], extended_schema)
+                continue
+            with self.enrichment_lock:
+                self.enrichment_stats["fallback_tables"] += 1
             try:
-                table_schema_results = self.sentinelClient.run_query(table_schema, printresults=False)
-                table_schemas[table_name] = table_schema_results[0]['Schema']  
-                table_rows_query = f"{table_name} | where TimeGenerated > ago(30d) |take 3"  
-                table_rows_query_results = self.sentinelClient.run_query(table_rows_query, printresults=False)   
-                extended_prompt =f"Below you have the schema and some sample rows of the content of table {table_name} in Microsoft Sentinel.\n"
-                if table_name in ['SecurityAlert','SecurityIncident']:
-                    extended_prompt +="I need you to create an JSON object with all the fields and its description.\n"
-                else: 
-                   extended_prompt +='I need you to create an JSON object with the most important fields and its description.Limit the number of fields to 12\n'
-                extended_prompt +='Only Return a JSON object that follows this schema {"tableDescription":"This is the description of the Table","schemaDetails":[{"fieldName":"FieldName1","fieldType":"string","description":"This is the description of FieldName1","sampleValue":"This is a sample Value for fieldName1"},{"fieldName":"FieldName2","fieldType":"dynamic","description":"This is the description of FieldName2","sampleValue":"This is a sample Value for fieldName2"}]}\n'
-                extended_prompt +=f"This is the table Schema:\n {table_schemas[table_name]}\n" 
-                extended_prompt +=f"This is the sample data rows:\n {table_rows_query_results}\n"  
-                extended_schema = self.runpromptonAzureAI(extended_prompt,[])['result'].replace("```json", "").replace("```", "").strip()    
-                obj = json.loads(extended_schema) 
-                table_extended_schemas[table_name]=obj
-            except Exception as err:
+                results[table_name] = self.generateTableSchema(table_name, table_data[table_name]["schema"], table_data[table_name]["samples"])
+            except Exception:
                 print_plugin_debug(self.name, f"Error obtaining Schema for Table {table_name}. Table not supported")  
+        return results
+
+    def loadSchemaCheckpoint(self):  
+        """  
+        Load the partial results of a previous (interrupted) schema generation.  
+  
+        :return: Checkpoint object with the table schemas and extended schemas already generated  
+        """  
+        checkpoint = {"schemas": {}, "extended_schemas": {}}
+        if os.path.isfile(self.checkpoint_file):
+            try:
+                with open(self.checkpoint_file, 'r', encoding='utf-8') as f:  
+                    checkpoint.update(json.load(f))
+                print_plugin_debug(self.name, f"Resuming Sentinel Schema generation from checkpoint ({len(checkpoint['extended_schemas'])} tables done)")  
+            except (OSError, ValueError):
+                print_plugin_debug(self.name, "Schema checkpoint is corrupted. Starting from scratch")  
+        return checkpoint
+
+    def saveSchemaCheckpoint(self, checkpoint):  
+        """  
+        Persist the schema generation progress. The file is replaced atomically so an interruption never corrupts it.  
+  
+        :param checkpoint: Checkpoint object  
+        """  
+        os.makedirs(self.schema_dir, exist_ok=True)
+        temp_file = self.checkpoint_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:  
+            json.dump(checkpoint, f, ensure_ascii=False) 
+        os.replace(temp_file, self.checkpoint_file)
+
+    def enrichTables(self, table_names, known_schemas=None):  
+        """  
+        Enrich a list of tables concurrently. The progress is checkpointed after each table so an interrupted run can be resumed.  
+  
+        :param table_names: List of table names to enrich  
+        :param known_schemas: Dictionary with the already retrieved CSL schema of the tables (optional)  
+        :return: Tuple with the table schemas and extended schemas of the enriched tables  
+        """  
+        known_schemas = known_schemas or {}
+        checkpoint = self.loadSchemaCheckpoint()
+        table_schemas = checkpoint['schemas']  
+        table_extended_schemas = checkpoint['extended_schemas'] 
+        pending_tables = []
+        for table_name in table_names:
+            # Checkpointed tables are reused unless their schema changed since the checkpoint was written
+            checkpointed_schema = table_schemas.get(table_name)
+            if table_name not in table_extended_schemas or (table_name in known_schemas and checkpointed_schema != known_schemas[table_name]):
+                pending_tables.append(table_name)
+        print_plugin_debug(self.name, f"Enriching Sentinel Schema for Workspace tables ({len(table_names)}). Pending: {len(pending_tables)}. Workers: {self.schema_workers}. Batch mode: {self.schema_batch}")  
+        start_time = time.time()
+        completed = 0
+        self.enrichment_stats = {"tables": len(pending_tables), "calls": 0, "prompt_tokens": 0, "tokens": 0, "per_table_prompt_tokens": 0, "batched_tables": 0, "fallback_tables": 0}
+        executor = ThreadPoolExecutor(max_workers=max(1, self.schema_workers))
+        try:
+            if self.schema_batch:
+                table_data = self.collectTableData(pending_tables, known_schemas)
+                futures = {executor.submit(self.generateTableSchemasBatch, batch, table_data): batch for batch in self.planEnrichmentBatches(table_data)}
+                completed += len(pending_tables) - len(table_data)
+            else:
+                futures = {executor.submit(lambda table_name: {table_name: self.generateTableSchema(table_name, known_schemas.get(table_name))}, table_name): [table_name] for table_name in pending_tables}
+            for future in as_completed(futures):
+                batch = futures[future]
+                completed += len(batch)
+                try:
+                    for table_name, (table_schema, table_extended_schema) in future.result().items():
+                        table_schemas[table_name], table_extended_schemas[table_name] = table_schema, table_extended_schema
+                    self.saveSchemaCheckpoint(checkpoint)
+                except Exception as err:
+                    print_plugin_debug(self.name, f"Error obtaining Schema for Tables {batch}. Table not supported")  
+                elapsed_time = time.time() - start_time
+                throughput = completed / elapsed_time * 60 if elapsed_time > 0 else 0
+                print_plugin_debug(self.name, f"Schema progress: {completed}/{len(pending_tables)} tables ({throughput:.1f} tables/min)")  
+        except KeyboardInterrupt:
+            print_plugin_debug(self.name, f"Schema generation interrupted. Progress saved in {self.checkpoint_file}")  
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+        print_plugin_debug(self.name, f"Sentinel Schema enrichment completed in {round(time.time() - start_time)} seconds")  
+        self.reportEnrichmentStats()
+        enriched_tables = [table_name for table_name in table_names if table_name in table_extended_schemas]
+        return ({table_name: table_schemas[table_name] for table_name in enriched_tables},
+                {table_name: table_extended_schemas[table_name] for table_name in enriched_tables})
+
+    def reportEnrichmentStats(self):  
+        """  
+        Print the number of Azure OpenAI calls and tokens used by the schema enrichment compared with the per-table mode
+        (one call and one full prompt per table).  
+        """  
+        stats = self.enrichment_stats
+        if not stats.get("calls"):
+            return
+        if self.schema_batch:
+            per_table_calls = stats["batched_tables"]
+            per_table_prompt_tokens = stats["per_table_prompt_tokens"]
+        else:
+            per_table_calls = stats["calls"]
+            per_table_prompt_tokens = stats["prompt_tokens"]
+        # Completion tokens are the same in both modes (the same extended schemas are returned)
+        completion_tokens = max(0, stats["tokens"] - stats["prompt_tokens"])
+        per_table_tokens = per_table_prompt_tokens + completion_tokens
+        token_reduction = 1 - stats["tokens"] / per_table_tokens if per_table_tokens else 0
+        print_plugin_debug(self.name, f"Schema enrichment: {stats['calls']} calls (per-table mode: {per_table_calls}), {stats['fallback_tables']} per-table fallbacks, "
+                                      f"{stats['prompt_tokens']} prompt tokens (per-table mode: {per_table_prompt_tokens}), "
+                                      f"{stats['tokens']} total tokens (per-table mode: ~{per_table_tokens}, {token_reduction:.0%} reduction)")  
+
+    def saveSentinelSchema(self, table_schemas, table_extended_schemas):  
+        """  
+        Store the schema, extended schema and schema fingerprints of the workspace and remove the generation checkpoint.  
+  
+        :param table_schemas: Dictionary with the CSL schema of each table  
+        :param table_extended_schemas: Dictionary with the extended schema of each table  
+        """  
+        os.makedirs(self.schema_dir, exist_ok=True)
+        fingerprints = {table_name: self.schemaFingerprint(table_schema) for table_name, table_schema in table_schemas.items()}
         with open(self.schema_file, 'w', encoding='utf-8') as f:  
             json.dump(table_schemas, f, ensure_ascii=False, indent=4) 
-        with open('extended_schema.json', 'w', encoding='utf-8') as f:  
+        with open(self.extended_schema_file, 'w', encoding='utf-8') as f:  
             json.dump(table_extended_schemas, f, ensure_ascii=False, indent=4) 
+        with open(self.fingerprints_file, 'w', encoding='utf-8') as f:  
+            json.dump(fingerprints, f, ensure_ascii=False, indent=4) 
+        if os.path.isfile(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+    def loadSchemaFiles(self):  
+        """  
+        Load the stored schema, extended schema and fingerprints of the workspace.  
   
-    def loadSentinelSchema(self):  
+        :return: Tuple with the table schemas, extended schemas and fingerprints  
+        """  
+        table_schemas = {}
+        fingerprints = {}
+        with open(self.extended_schema_file, 'r', encoding='utf-8') as f:  
+            table_extended_schemas = json.load(f)
+        if os.path.isfile(self.schema_file):
+            with open(self.schema_file, 'r', encoding='utf-8') as f:  
+                table_schemas = json.load(f)
+        if os.path.isfile(self.fingerprints_file):
+            with open(self.fingerprints_file, 'r', encoding='utf-8') as f:  
+                fingerprints = json.load(f)
+        # Caches created before fingerprints were stored can derive them from the CSL schema
+        for table_name, table_schema in table_schemas.items():
+            fingerprints.setdefault(table_name, self.schemaFingerprint(table_schema))
+        return table_schemas, table_extended_schemas, fingerprints
+
+    def generateSentinelSchema(self):  
+        """  
+        Retrieve and store the schema of all Azure Sentinel tables.  
+        """  
+        table_names = self.getWorkspaceTables()
+        table_schemas, table_extended_schemas = self.enrichTables(table_names)
+        self.saveSentinelSchema(table_schemas, table_extended_schemas)
+
+    def refreshSentinelSchema(self):  
+        """  
+        Incrementally refresh the stored schema. Only new tables or tables whose schema fingerprint changed are enriched again.  
+        Tables no longer present in the workspace are removed. Tables whose schema couldn't be retrieved (ie. throttling)
+        keep their stored schema until the next refresh.  
+        """  
+        table_schemas, table_extended_schemas, fingerprints = self.loadSchemaFiles()
+        workspace_tables = self.getWorkspaceTables()
+        current_schemas = self.getTableSchemas(workspace_tables)
+        changed_tables = [table_name for table_name, table_schema in current_schemas.items()
+                          if table_name not in table_extended_schemas or fingerprints.get(table_name) != self.schemaFingerprint(table_schema)]
+        removed_tables = [table_name for table_name in table_extended_schemas if table_name not in workspace_tables]
+        unavailable_tables = [table_name for table_name in workspace_tables if table_name not in current_schemas]
+        print_plugin_debug(self.name, f"Sentinel Schema refresh: {len(changed_tables)} new or changed tables, {len(removed_tables)} removed tables")  
+        if unavailable_tables:
+            print_plugin_debug(self.name, f"Sentinel Schema refresh: schema not retrieved for {len(unavailable_tables)} tables (stored schema kept): {', '.join(unavailable_tables)}")  
+        for table_name in removed_tables:
+            table_extended_schemas.pop(table_name, None)
+            table_schemas.pop(table_name, None)
+        if changed_tables:
+            enriched_schemas, enriched_extended_schemas = self.enrichTables(changed_tables, current_schemas)
+            table_schemas.update(enriched_schemas)
+            table_extended_schemas.update(enriched_extended_schemas)
+        if changed_tables or removed_tables:
+            self.saveSentinelSchema(table_schemas, table_extended_schemas)
+
+    def migrateLegacySchema(self):  
+        """  
+        Copy the schema files generated by previous versions (stored in the working directory) to the workspace schema folder.  
+        """  
+        legacy_extended_schema_file = 'extended_schema.json'
+        legacy_schema_file = 'SentinelSchema.json'
+        if os.path.isfile(self.extended_schema_file) or not os.path.isfile(legacy_extended_schema_file):
+            return
+        print_plugin_debug(self.name, f"Migrating Sentinel Schema files to {self.schema_dir}")  
+        os.makedirs(self.schema_dir, exist_ok=True)
+        shutil.copyfile(legacy_extended_schema_file, self.extended_schema_file)
+        if os.path.isfile(legacy_schema_file):
+            shutil.copyfile(legacy_schema_file, self.schema_file)
+
+    def loadSentinelSchema(self, refresh=None):  
         """  
         Load the Sentinel schema from a JSON file, generating it if it doesn't exist.  
   
+        :param refresh: Incrementally refresh an existing schema before loading it. Defaults to SENTINELKQL_SCHEMA_REFRESH  
         :return: Loaded Sentinel schema  
         """  
         print_plugin_debug(self.name, "Loading Sentinel Schema for Workspace")  
+        if refresh is None:
+            refresh = self.schema_refresh
+        self.migrateLegacySchema()
         if not os.path.isfile(self.extended_schema_file):  
             self.generateSentinelSchema()  
+        elif refresh:
+            self.refreshSentinelSchema()
           
         with open(self.extended_schema_file, 'r', encoding='utf-8') as f:  
             return json.load(f)  
   
-    def generateKQLandRun(self, prompt, session,channel):  
+    def generateKQLandRun(self, prompt, session,channel, user_prompt=None):  
         """  
         Generate a KQL query from a prompt and run it.  
   
         :param prompt: Input prompt  
         :param session: Session context  
+        :param user_prompt: Prompt of the user (without the schema). Used to get the time window of the query  
         :return: Result of the KQL query  
         """  
         extended_prompt = (  
@@ -111,19 +657,171 @@ class SentinelKQLPlugin(TeisecAgentPlugin):
             "- Your response must only contain the KQL code. No additional code must be added before or after the KQL code.\n "  
             "- Remember that this prompt is part of a session with previous prompts and responses; therefore, you can use information from previous responses in the session if the prompt makes reference to previous results or data above.\n"  
         )
-        prompt_result_object = self.runpromptonAzureAI(extended_prompt, session) 
+        with telemetry.span('kql_generation', channel) as span:
+            prompt_result_object = self.runpromptonAzureAI(extended_prompt, session) 
+            span.set_usage(prompt_result_object)
         if prompt_result_object['status']=='error':
             channel('systemmessage',{"message":f"Error (Generating KQL): {prompt_result_object['result'] }"})
             return prompt_result_object
         else:
         # Clean KQL tags from the result  
-            prompt_result_clean = prompt_result_object['result'].replace("```kql", "").replace("```kusto", "").replace("```", "").strip()  
+            prompt_result_clean = self.cleanKQL(prompt_result_object['result'])
             print_plugin_debug(self.name, f"Generated Query:\n {prompt_result_clean}")  
             channel('debugmessage',{"message":f"Generated KQL Query:\n {prompt_result_clean}"})
-            query_results=self.sentinelClient.run_query(prompt_result_clean, printresults=False)  
-            result_object={"status":prompt_result_object['status'],"result":query_results,"session_tokens":prompt_result_object['session_tokens']} 
+            if self.kql_validator is not None:
+                prompt_result_clean, errors, repair_object = self.validateAndRepairKQL(prompt_result_clean, session, channel)
+                prompt_result_object['prompt_tokens'] = prompt_result_object.get('prompt_tokens',0) + repair_object['prompt_tokens']
+                prompt_result_object['completion_tokens'] = prompt_result_object.get('completion_tokens',0) + repair_object['completion_tokens']
+                if repair_object['session_tokens']:
+                    prompt_result_object['session_tokens'] = repair_object['session_tokens']
+                if errors:
+                    # The query is not sent to the workspace until it passes the validation
+                    error_message = f"Generated KQL query is not valid: {'; '.join(errors)}"
+                    channel('systemmessage',{"message":f"Error (Validating KQL): {error_message}"})
+                    return {"status":'error',"result":error_message,"session_tokens":prompt_result_object['session_tokens'],
+                            "prompt_tokens":prompt_result_object['prompt_tokens'],"completion_tokens":prompt_result_object['completion_tokens']}
+            query_results = self.runKQL(prompt_result_clean, user_prompt or prompt, channel)
+            cache_stats = self.sentinelClient.get_query_cache_stats()
+            if cache_stats is not None:
+                channel('debugmessage',{"message":f"KQL Cache: {cache_stats}"})
+            result_object={"status":prompt_result_object['status'],"result":query_results,"session_tokens":prompt_result_object['session_tokens'],
+                           "prompt_tokens":prompt_result_object.get('prompt_tokens',0),"completion_tokens":prompt_result_object.get('completion_tokens',0)} 
             return  result_object
     
+    def runKQL(self, query, prompt, channel):  
+        """  
+        Rewrite a KQL query to reduce the scanned data (if enabled) and run it with an explicit timespan and server timeout.  
+        The statistics of the query are recorded and, in comparison mode, the original query is also run to measure the speedup.  
+  
+        :param query: KQL query  
+        :param prompt: Prompt the query was generated from  
+        :param channel: Channel callback  
+        :return: QueryResult or the HttpResponseError  
+        """  
+        rewrite = {"query": query, "timespan": None, "server_timeout": None, "changes": []}
+        if self.kql_rewrite:
+            table_columns = self.kql_validator.table_columns if self.kql_validator is not None else None
+            rewrite = self.kql_rewriter.rewrite(query, prompt, table_columns)
+            with self.kql_rewrite_lock:
+                self.kql_rewrite_stats["queries"] += 1
+                if rewrite["changes"]:
+                    self.kql_rewrite_stats["rewritten"] += 1
+            if rewrite["changes"]:
+                print_plugin_debug(self.name, f"Rewritten Query:\n {rewrite['query']}")  
+                channel('debugmessage',{"message":f"Rewritten KQL Query ({'; '.join(rewrite['changes'])}):\n {rewrite['query']}"})
+        sliced = self.useSlicing(rewrite["query"], rewrite["timespan"])
+        with telemetry.span('query_execution', channel, timespan=str(rewrite["timespan"]), server_timeout=rewrite["server_timeout"], rewrites=len(rewrite["changes"]), sliced=sliced) as span:
+            if sliced:
+                channel('debugmessage',{"message":f"Running the query in time slices of {self.slice_duration} ({rewrite['timespan']})"})
+                query_results=self.sentinelClient.run_query_sliced(rewrite["query"], rewrite["timespan"], self.slice_duration, printresults=False, server_timeout=rewrite["server_timeout"])
+            else:
+                query_results=self.sentinelClient.run_query(rewrite["query"], printresults=False, timespan=rewrite["timespan"], server_timeout=rewrite["server_timeout"], include_statistics=self.kql_rewrite)
+            if isinstance(query_results, QueryResult):
+                span.set(rows=len(query_results), query_status=query_results.status)
+                statistics = query_results.get_statistics_summary()
+                if statistics:
+                    span.set(execution_ms=statistics["execution_ms"], scanned_rows=statistics["scanned_rows"])
+            else:
+                span.status = 'error'
+        if self.kql_rewrite_compare and rewrite["changes"] and isinstance(query_results, QueryResult):
+            self.compareRewrite(query, query_results, channel)
+        return query_results
+
+    def useSlicing(self, query, timespan):  
+        """  
+        Check if a query should be run in time slices: aggregations over a time window above the threshold.  
+        Row queries are capped (take) so slicing them doesn't reduce the work.  
+        """  
+        if not self.slice_threshold or timespan is None or timespan < self.slice_threshold or not hasattr(self.sentinelClient, 'run_query_sliced'):
+            return False
+        plan = KQLSlicer.plan(query)
+        return plan is not None and plan["kind"] != "rows"
+
+    def compareRewrite(self, original_query, rewritten_results, channel):  
+        """  
+        Run the original query (not rewritten) and compare its statistics with the rewritten query.  
+        """  
+        original_results = self.sentinelClient.run_query(original_query, printresults=False, use_cache=False, include_statistics=True)
+        original_statistics = original_results.get_statistics_summary() if isinstance(original_results, QueryResult) else None
+        rewritten_statistics = rewritten_results.get_statistics_summary()
+        if not original_statistics or not rewritten_statistics:
+            return
+        with self.kql_rewrite_lock:
+            self.kql_rewrite_stats["compared"] += 1
+            self.kql_rewrite_stats["original_execution_ms"] += original_statistics["execution_ms"]
+            self.kql_rewrite_stats["rewritten_execution_ms"] += rewritten_statistics["execution_ms"]
+            self.kql_rewrite_stats["original_scanned_rows"] += original_statistics["scanned_rows"] or 0
+            self.kql_rewrite_stats["rewritten_scanned_rows"] += rewritten_statistics["scanned_rows"] or 0
+            kql_rewrite_stats = dict(self.kql_rewrite_stats)
+        speedup = original_statistics["execution_ms"] / rewritten_statistics["execution_ms"] if rewritten_statistics["execution_ms"] else 0
+        print_plugin_debug(self.name, f"KQL rewrite: {original_statistics['execution_ms']} ms -> {rewritten_statistics['execution_ms']} ms ({speedup:.1f}x)")  
+        channel('debugmessage',{"message":f"KQL rewrite statistics. Original: {original_statistics}. Rewritten: {rewritten_statistics}. Speedup: {speedup:.1f}x. Rewrite stats: {kql_rewrite_stats}"})
+
+    @staticmethod
+    def cleanKQL(response):  
+        """  
+        Remove the code block tags from a KQL query generated by the LLM.  
+        """  
+        return response.replace("```kql", "").replace("```kusto", "").replace("```", "").strip()
+
+    def validateAndRepairKQL(self, query, session, channel):  
+        """  
+        Validate a KQL query locally against the schema. When there are errors, the precise errors and the columns of the
+        table are sent back to the LLM to fix the query, up to SENTINELKQL_KQL_REPAIR_ATTEMPTS times.  
+  
+        :param query: Generated KQL query  
+        :param session: Session context  
+        :param channel: Channel callback  
+        :return: Tuple with the (repaired) query, the remaining errors and the token usage of the repair prompts  
+        """  
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "session_tokens": None}
+        with self.kql_validation_lock:
+            self.kql_validation_stats["queries"] += 1
+        warnings = []
+        errors = self.kql_validator.validate(query, warnings)
+        if warnings:
+            channel('debugmessage',{"message":f"KQL validation warnings: {warnings}"})
+        attempt = 0
+        while errors:
+            # Every invalid query caught locally is a failed query that is not sent to the workspace
+            with self.kql_validation_lock:
+                self.kql_validation_stats["round_trips_avoided"] += 1
+                if attempt < self.kql_repair_attempts:
+                    self.kql_validation_stats["repair_calls"] += 1
+            if attempt >= self.kql_repair_attempts:
+                break
+            attempt += 1
+            channel('debugmessage',{"message":f"KQL validation errors (repair attempt {attempt}): {errors}"})
+            table_name = query.strip().split('|')[0].strip()
+            columns = self.kql_validator.get_columns(table_name)
+            repair_prompt = (  
+                f"The following KQL query is not valid:\n{query}\n"
+                f"These are the errors found:\n" + '\n'.join(f"- {error}" for error in errors) + "\n"
+            )
+            if columns:
+                repair_prompt += f"These are the only columns of the {table_name} table: {columns}\n"
+            repair_prompt += (  
+                "Fix the query keeping its intent.\n"
+                "- Your response must only contain the KQL code. No additional code must be added before or after the KQL code.\n "
+            )
+            with telemetry.span('kql_repair', channel, attempt=attempt, errors=len(errors)) as span:
+                repair_object = self.runpromptonAzureAI(repair_prompt, session)
+                span.set_usage(repair_object)
+            usage["prompt_tokens"] += repair_object.get('prompt_tokens', 0)
+            usage["completion_tokens"] += repair_object.get('completion_tokens', 0)
+            if repair_object['status'] == 'error':
+                break
+            usage["session_tokens"] = repair_object['session_tokens']
+            query = self.cleanKQL(repair_object['result'])
+            print_plugin_debug(self.name, f"Repaired Query:\n {query}")  
+            channel('debugmessage',{"message":f"Repaired KQL Query:\n {query}"})
+            errors = self.kql_validator.validate(query)
+        with self.kql_validation_lock:
+            self.kql_validation_stats["failed" if errors else "repaired" if attempt else "valid"] += 1
+            kql_validation_stats = dict(self.kql_validation_stats)
+        channel('debugmessage',{"message":f"KQL validation stats: {kql_validation_stats}"})
+        return query, errors, usage
+
     def generateKQLandRunWithSchemaAndTable(self, prompt, table, session,channel):  
         """  
         Generate a KQL query using the schema for a specific table and run it.  
@@ -138,46 +836,124 @@ class SentinelKQLPlugin(TeisecAgentPlugin):
                 f"{prompt}\n"
                 "Always Follow this instructions to generate the requested KQL query:\n"
                 f"- Make sure you use the {table} table and use only fields defined the following schema (in JSON format): \n"  
-                f"{self.sentinel_schema[table]["schemaDetails"]} \n"
+                f"{self.sentinel_schema[table]['schemaDetails']} \n"
             )  
         except KeyError:  
             print_plugin_debug(self.name, f"Table '{table}' not found in schema. Generating Query without schema")  
             extended_prompt = prompt  
           
-        return self.generateKQLandRun(extended_prompt, session,channel)  
+        return self.generateKQLandRun(extended_prompt, session,channel, prompt)  
   
+    def buildTableIndex(self):  
+        """  
+        Build the local BM25 index over the table names, descriptions and fields of the extended schema.  
+        Optionally weight the tables by their ingestion volume in the last 30 days (Usage table).  
+        """  
+        documents = {}
+        for table_name, table_schema in self.sentinel_schema.items():
+            fields = ' '.join(f"{field.get('fieldName', '')} {field.get('description', '')}" for field in table_schema.get('schemaDetails', []))
+            # Table name is repeated to give it more weight than the field descriptions
+            documents[table_name] = f"{table_name} {table_name} {table_schema.get('tableDescription', '')} {fields}"
+        self.table_index = BM25Index(documents)
+        if self.findtable_usage_weight:
+            self.table_volume_weights = self.getTableVolumeWeights()
+        print_plugin_debug(self.name, f"Table index built ({len(documents)} tables)")  
+
+    def getTableVolumeWeights(self):  
+        """  
+        Compute a weight for each table based on its ingestion volume. Tables with more data get a small boost.  
+  
+        :return: Dictionary with the weight of each table (between 1.0 and 1.2)  
+        """  
+        try:
+            query_results = self.sentinelClient.run_query("Usage | where TimeGenerated > ago(30d) | summarize Volume=sum(Quantity) by DataType", printresults=False)
+            volumes = {row['DataType']: float(row['Volume'] or 0) for row in query_results}
+        except Exception:
+            print_plugin_debug(self.name, "Error retrieving table ingestion volumes. Tables won't be weighted")  
+            return {}
+        max_volume = max(volumes.values(), default=0)
+        if max_volume <= 0:
+            return {}
+        return {table_name: 1 + 0.2 * math.log1p(volume) / math.log1p(max_volume) for table_name, volume in volumes.items()}
+
+    def shortlistTables(self, prompt):  
+        """  
+        Rank the tables locally for a given prompt.  
+  
+        :param prompt: Input prompt  
+        :return: List of (table name, score) tuples with the top-k candidate tables  
+        """  
+        scores = self.table_index.score(prompt)
+        for table_name, weight in self.table_volume_weights.items():
+            if table_name in scores:
+                scores[table_name] *= weight
+        ranking = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [(table_name, score) for table_name, score in ranking[:self.findtable_top_k] if score > 0]
+
     def findTable(self, prompt, session,channel):  
         """  
         Identify the best table to use for a given prompt.  
+        Tables are shortlisted locally and the LLM is only used when there is no clear winner.  
   
         :param prompt: Input prompt  
         :param session: Session context  
         :return: Best table name  
         """  
-        table_list = ', '.join(self.sentinel_schema.keys())
-        tableList=''
-        for tableName in self.sentinel_schema.keys():
-            tableList=tableList+tableName+': '+ self.sentinel_schema[tableName]['tableDescription'] +'\n'
-        extended_prompt = (  
-            f"This is the list of available tables and their description in my Sentinel instance: \n" 
-            f"{tableList}\n" 
-            "I need you to select the best available table to fulfill the prompt below:\n"  
-            f"Prompt (Do not run): {prompt}\n"  
-            "Make sure you ONLY respond with the name of the table avoiding any other text or character.\n"  
-        ) 
-        table = self.runpromptonAzureAI(extended_prompt, session)['result']  
-        print_plugin_debug(self.name, f"Selected Table: {table}")  
-        return table  
-  
-    def runpromptonAzureAI(self, prompt, session):  
+        with telemetry.span('table_selection', channel) as span:
+            shortlist = self.shortlistTables(prompt) if self.table_index else []
+            if shortlist and shortlist[0][1] >= self.findtable_min_score and (len(shortlist) == 1 or shortlist[0][1] >= self.findtable_margin * shortlist[1][1]):
+                table = shortlist[0][0]
+                with self.findtable_lock:
+                    self.findtable_stats["prompts"] += 1
+                    self.findtable_stats["local_selections"] += 1
+                    findtable_stats = dict(self.findtable_stats)
+                span.set(method='local', table=table)
+                print_plugin_debug(self.name, f"Selected Table (local index): {table}")  
+                channel('debugmessage',{"message":f"Table selected locally: {table} (score {shortlist[0][1]:.2f}). Table selection stats: {findtable_stats}"})
+                return table
+            shortlisted_tables = [table_name for table_name, score in shortlist]
+            tableList=''
+            for tableName in (shortlisted_tables or self.sentinel_schema.keys()):
+                tableList=tableList+tableName+': '+ self.sentinel_schema[tableName]['tableDescription'] +'\n'
+            other_tables = ', '.join(table_name for table_name in self.sentinel_schema.keys() if shortlisted_tables and table_name not in shortlisted_tables)
+            extended_prompt = (  
+                f"This is the list of the most relevant tables and their description in my Sentinel instance: \n" 
+                f"{tableList}\n" 
+            )
+            if other_tables:
+                extended_prompt += f"These other tables are also available: {other_tables}\n"
+            extended_prompt += (  
+                "I need you to select the best available table to fulfill the prompt below:\n"  
+                f"Prompt (Do not run): {prompt}\n"  
+                "Make sure you ONLY respond with the name of the table avoiding any other text or character.\n"  
+            ) 
+            result_object = self.runpromptonAzureAI(extended_prompt, session, use_cache=True)
+            span.set_usage(result_object)
+            table = result_object['result'].strip()  
+            span.set(method='llm', table=table, shortlisted=len(shortlisted_tables))
+            with self.findtable_lock:
+                self.findtable_stats["prompts"] += 1
+                self.findtable_stats["llm_selections"] += 1
+                if shortlisted_tables:
+                    self.findtable_stats["shortlisted_llm_selections"] += 1
+                    if table in shortlisted_tables:
+                        self.findtable_stats["shortlist_hits"] += 1
+                findtable_stats = dict(self.findtable_stats)
+            print_plugin_debug(self.name, f"Selected Table: {table}")  
+            shortlist_hit_rate = findtable_stats["shortlist_hits"] / max(1, findtable_stats["shortlisted_llm_selections"])
+            channel('debugmessage',{"message":f"Table selected by LLM: {table}. Shortlist hit rate: {shortlist_hit_rate:.0%}. Table selection stats: {findtable_stats}"})
+            return table  
+  
+    def runpromptonAzureAI(self, prompt, session, use_cache=False):  
         """  
         Run a given prompt on the Azure OpenAI client.  
   
         :param prompt: Input prompt  
         :param session: Session context  
+        :param use_cache: Use the response cache (if configured). KQL generation and repair prompts are not cached so they can be regenerated  
         :return: Response from Azure OpenAI Client  
         """
-        result_object= self.azureOpenAIClient.runPrompt(prompt, session)
+        result_object= self.azureOpenAIClient.runPrompt(prompt, session, use_cache=use_cache)
         return result_object
   
     def runprompt(self, prompt, session,channel):  
@@ -188,7 +964,7 @@ class SentinelKQLPlugin(TeisecAgentPlugin):
         :return: Result of the KQL query  
         """ 
         result=''
-        if self.loadSchema:
+        if self.loadSchema and self.waitForSchema(channel):
             table = self.findTable(prompt, session,channel)  
             result= self.generateKQLandRunWithSchemaAndTable(prompt, table, session,channel)
         else: 
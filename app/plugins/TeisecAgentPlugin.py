@@ -1,10 +1,32 @@
 from app.HelperFunctions import * 
 class TeisecAgentPlugin:
+    # Registry metadata. Subclasses defining plugin_name inside app/plugins are discovered automatically (see PluginRegistry)
+    plugin_name = None
+    plugin_description = ''
+    plugin_type = 'API'
+    # Agent clients passed to the constructor (after name, description and type) when the plugin is built
+    required_clients = []
+    # Build the plugin in the background at startup (ie. to load data) instead of on first use
+    warmup = False
+    # Capabilities and help are declared at class level so they are available before the plugin is built
+    capabilities = {'plugincapabilitiy':"This capability allows for."}
+    help = "Use 'string' in your prompt to generate and run KQL adhering to the Sentinel schema"
+    # Local routing: list of (regular expression, weight) tuples. Prompts matching with enough confidence skip the LLM decomposition (see PromptRouter)
+    routes = []
     def __init__(self, name, description,plugintype):
         self.name = name
         self.description = name
         self.type = plugintype
         print_plugin_debug(self.name,f" Loading Copilot Plugin: {self.name}")
+    @classmethod
+    def build(cls, agent):
+        """
+        Build the plugin using the agent clients. Clients are created on first use.
+
+        :param agent: TeisecAgent instance
+        :return: Plugin instance
+        """
+        return cls(cls.plugin_name, cls.plugin_description, cls.plugin_type, *[agent.get_client(client_name) for client_name in cls.required_clients])
     def printname(self):
         print(self.name)
     def getname(self):
@@ -12,7 +34,6 @@ class TeisecAgentPlugin:
     def runprompt(self,prompt,session,channel):
         print(self.prompt)
     def pluginhelp(self):
-        return "Use 'string' in your prompt to generate and run KQL adhering to the Sentinel schema"
+        return self.help
     def plugincapabilities(self):  
-        capabilities={'plugincapabilitiy':"This capability allows for."}
-        return  capabilities
\ No newline at end of file
+        return  self.capabilities
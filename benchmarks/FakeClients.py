@@ -0,0 +1,279 @@
+import json
+import re
+import threading
+import time
+from app.HelperFunctions import count_tokens, count_message_tokens
+from app.clients.QueryResult import QueryResult, QueryResultTable
+from app.clients.KQLSlicer import KQLSlicer
+
+# Stages of the LLM calls, identified by the instructions of the prompts sent by the agent and the plugins
+LLM_STAGES = [
+    ("decomposition", re.compile(r'user prompt you need to decompose in tasks')),
+    ("table_selection", re.compile(r'select the best available table')),
+    ("kql_generation", re.compile(r'must only contain the KQL code')),
+    ("url_extraction", re.compile(r'extract the URL from the following prompt')),
+    ("formatting", re.compile(r'format the provided response')),
+    ("schema_enrichment", re.compile(r'schema and some sample rows of the content of')),
+    ("sql_generation", re.compile(r'single SQLite SELECT query')),
+]
+URL_PATTERN = re.compile(r'https?://[^\s\'"]+')
+
+class BenchmarkRecorder:
+    """
+    Thread-safe counters of the calls made to the stand-in clients (LLM calls and tokens per stage, Log Analytics queries and fetches).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def record(self, category, stage, **values):
+        with self.lock:
+            stage_counters = self.counters.setdefault(category, {}).setdefault(stage, {})
+            stage_counters["calls"] = stage_counters.get("calls", 0) + 1
+            for name, value in values.items():
+                stage_counters[name] = stage_counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.counters))
+
+    @staticmethod
+    def diff(after, before):
+        """
+        Counters recorded between two snapshots.
+        """
+        result = {}
+        for category, stages in after.items():
+            for stage, counters in stages.items():
+                previous = before.get(category, {}).get(stage, {})
+                delta = {name: value - previous.get(name, 0) for name, value in counters.items()}
+                if delta.get("calls"):
+                    result.setdefault(category, {})[stage] = delta
+        return result
+
+class FakeAzureOpenAIClient:
+    """
+    Stand-in for AzureOpenAIClient. Replies with scripted responses (per stage) after a simulated latency and reports
+    the token usage computed with the local tokenizer. Same contract as AzureOpenAIClient (runPrompt, streamPrompt, runPromptStream, runPromptBatch).
+    """
+
+    def __init__(self, recorder, scenarios=None, latency=0.8, token_latency=0.01, schemas=None):
+        """
+        :param recorder: BenchmarkRecorder instance
+        :param scenarios: Corpus scenarios. Prompts with scripted tasks, tables or KQL are answered with them
+        :param latency: Seconds of fixed latency per call (time to first token)
+        :param token_latency: Seconds per completion token
+        :param schemas: Dictionary with the CSL schema of the tables (used to answer the schema enrichment prompts)
+        """
+        self.recorder = recorder
+        self.latency = latency
+        self.token_latency = token_latency
+        self.schemas = schemas or {}
+        self.model_name = "benchmark"
+        self.scripted_prompts = {}
+        for scenario in scenarios or []:
+            for step in scenario["prompts"]:
+                self.scripted_prompts[step["prompt"]] = step
+                # Tasks of a scripted decomposition can script the table and KQL of their own prompts
+                for task in step.get("tasks", []):
+                    self.scripted_prompts[task["task"]] = task
+
+    def buildMessages(self, prompt, session):
+        if len(session) > 0 and session[0]['role'] == 'system':
+            message_object = list(session)
+        else:
+            message_object = [{"role": "system", "content": "As an AI specializing in security analytics, your task is to retrieve and analyze security data from various platforms."}]
+            message_object.extend(session)
+        message_object.append({"role": "user", "content": prompt})
+        return message_object
+
+    def getStage(self, prompt):
+        for stage, pattern in LLM_STAGES:
+            if pattern.search(prompt):
+                return stage
+        return "completion"
+
+    def getScriptedStep(self, prompt):
+        # Longest match first so prompts included in other prompts don't shadow them
+        for scripted_prompt in sorted(self.scripted_prompts, key=len, reverse=True):
+            if scripted_prompt in prompt:
+                return self.scripted_prompts[scripted_prompt]
+        return {}
+
+    def buildResponse(self, stage, prompt):
+        step = self.getScriptedStep(prompt)
+        if stage == "decomposition":
+            tasks = step.get("tasks") or [{"plugin_name": "GPTPlugin", "capability_name": "runprompt", "task": step.get("prompt", prompt)}]
+            return json.dumps([dict({"task_id": index + 1, "depends_on": list(range(1, index + 1))}, **task) for index, task in enumerate(tasks)])
+        if stage == "table_selection":
+            tables = re.findall(r'^(\w+): ', prompt, re.MULTILINE)
+            return step.get("table") or (tables[0] if tables else "SecurityIncident")
+        if stage == "kql_generation":
+            table = step.get("table") or next((table for table in self.schemas if table in prompt), "SecurityIncident")
+            return step.get("kql") or f"```kql\n{table}\n| where TimeGenerated > ago(30d)\n| take 100\n```"
+        if stage == "url_extraction":
+            url = URL_PATTERN.search(prompt)
+            return url.group(0) if url else "https://example.com"
+        if stage == "schema_enrichment":
+            tables = re.findall(r'### Table: (\w+)', prompt) or re.findall(r'content of table (\w+) in', prompt)
+            extended_schemas = {table: self.buildExtendedSchema(table) for table in tables}
+            if len(tables) == 1 and '### Table:' not in prompt:
+                return json.dumps(extended_schemas[tables[0]])
+            return "```json\n" + json.dumps(extended_schemas) + "\n```"
+        if stage == "sql_generation":
+            # Scripted SQL references the last result of the prompt as {result}
+            results = re.findall(r'^Table (res_[0-9a-f]{8})', prompt, re.MULTILINE)
+            return (step.get("sql") or "SELECT * FROM {result} LIMIT 10").replace("{result}", results[-1] if results else "results")
+        if stage == "formatting":
+            data = prompt.split('(this is the data you have to format): \n', 1)[-1]
+            return f"<div>{data[:2000]}</div>" if 'HTML' in prompt else data[:2000]
+        return step.get("response") or ("Summary of the analysis based on the previous results. " * 20).strip()
+
+    def buildExtendedSchema(self, table):
+        fields = [field.split(':') for field in self.schemas.get(table, 'TimeGenerated:datetime').split(', ')[:12]]
+        return {"tableDescription": f"Table {table} with security data",
+                "schemaDetails": [{"fieldName": name, "fieldType": field_type, "description": f"{name} of the {table} event", "sampleValue": ""} for name, field_type in fields]}
+
+    def complete(self, prompt, session):
+        message_object = self.buildMessages(prompt, session)
+        stage = self.getStage(prompt)
+        response = self.buildResponse(stage, prompt)
+        prompt_tokens = count_message_tokens(message_object)
+        completion_tokens = count_tokens(response)
+        return stage, response, prompt_tokens, completion_tokens
+
+    def runPrompt(self, prompt, session=[], use_cache=False):
+        stage, response, prompt_tokens, completion_tokens = self.complete(prompt, session)
+        time.sleep(self.latency + self.token_latency * completion_tokens)
+        self.recorder.record("llm", stage, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        return {"status": 'success', "result": response, "session_tokens": str(prompt_tokens + completion_tokens), "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+    def streamPrompt(self, prompt, session=[], use_cache=False):
+        stage, response, prompt_tokens, completion_tokens = self.complete(prompt, session)
+        time.sleep(self.latency)
+        deltas = re.findall(r'\S*\s*', response)
+        for delta in deltas:
+            if delta:
+                time.sleep(self.token_latency * completion_tokens / max(1, len(deltas)))
+                yield delta
+        self.recorder.record("llm", stage, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        return {"status": 'success', "result": response, "session_tokens": str(prompt_tokens + completion_tokens), "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+    def runPromptStream(self, prompt, session=[], on_delta=None, use_cache=False):
+        stream = self.streamPrompt(prompt, session, use_cache)
+        while True:
+            try:
+                delta = next(stream)
+            except StopIteration as stop:
+                return stop.value
+            if on_delta is not None:
+                on_delta(delta)
+
+    def runPromptBatch(self, prompts, use_cache=False):
+        return [self.runPrompt(prompt, [], use_cache) if isinstance(prompt, str) else self.runPrompt(prompt[0], list(prompt[1]), use_cache) for prompt in prompts]
+
+    def get_cache_stats(self):
+        return None
+
+class FakeSentinelClient:
+    """
+    Stand-in for SentinelClient. Answers the queries with synthetic rows built from the table schemas after a simulated latency.
+    The query statistics report the rows scanned in the time window of the query (TimeGenerated filter or timespan).
+    """
+
+    def __init__(self, recorder, schemas, latency=0.3, rows=50, rows_per_day=100000, retention_days=90):
+        """
+        :param recorder: BenchmarkRecorder instance
+        :param schemas: Dictionary with the CSL schema of the tables of the workspace
+        :param latency: Seconds per query
+        :param rows: Number of rows returned by the data queries
+        :param rows_per_day: Rows ingested per day in each table (query statistics)
+        :param retention_days: Days of data in each table (query statistics)
+        """
+        self.recorder = recorder
+        self.schemas = schemas
+        self.latency = latency
+        self.rows = rows
+        self.rows_per_day = rows_per_day
+        self.retention_days = retention_days
+        self.workspace_id = "benchmark"
+
+    def getColumns(self, table, limit=None):
+        return [field.split(':')[0] for field in self.schemas.get(table, 'TimeGenerated:datetime').split(', ')][:limit]
+
+    def buildRows(self, table, columns, count):
+        return [[f"2024-01-01T00:{index % 60:02d}:00Z" if column == 'TimeGenerated' else f"{column}-{index}" for column in columns] for index in range(count)]
+
+    def answer(self, query):
+        if query.startswith('Usage'):
+            if 'Volume' in query:
+                return "usage", QueryResultTable("PrimaryResult", ['DataType', 'Volume'], [[table, float(len(schema))] for table, schema in self.schemas.items()])
+            return "usage", QueryResultTable("PrimaryResult", ['DataType'], [[table] for table in self.schemas])
+        if query.startswith('union'):
+            rows = [[table, self.schemas[table], None] for table in re.findall(r'\((\w+) \| getschema', query) if table in self.schemas]
+            for table in re.findall(r'\((\w+) \| where', query):
+                if table in self.schemas:
+                    columns = self.getColumns(table)
+                    rows += [[table, None, dict(zip(columns, row))] for row in self.buildRows(table, columns, 3)]
+            return "schema", QueryResultTable("PrimaryResult", ['_SchemaTable', 'Schema', '_SampleRow'], rows)
+        table = re.match(r'\s*(\w+)', query).group(1)
+        if 'getschema' in query:
+            return "schema", QueryResultTable("PrimaryResult", ['Schema'], [[self.schemas.get(table, '')]])
+        project = re.search(r'\|\s*project\s+([^|]+)', query)
+        columns = [column.strip().split('=')[0].strip() for column in project.group(1).split(',')] if project else self.getColumns(table, 8)
+        take = re.search(r'\|\s*(?:take|limit)\s+(\d+)', query)
+        count = min(self.rows, int(take.group(1))) if take else self.rows
+        return "data", QueryResultTable("PrimaryResult", columns, self.buildRows(table, columns, count))
+
+    def buildStatistics(self, query, timespan, table):
+        days = [self.retention_days]
+        time_filter = re.search(r'TimeGenerated\s*>=?\s*ago\((\d+)(d|h)\)', query)
+        if time_filter:
+            days.append(int(time_filter.group(1)) / (1 if time_filter.group(2) == 'd' else 24))
+        if timespan is not None:
+            days.append(timespan.total_seconds() / 86400)
+        scanned_rows = int(self.rows_per_day * min(days))
+        return {"query": {"executionTime": self.latency * min(days) / self.retention_days,
+                          "inputDatasetStatistics": {"rows": {"scanned": scanned_rows, "total": self.rows_per_day * self.retention_days}},
+                          "datasetStatistics": [{"tableRowCount": len(table), "tableSize": len(json.dumps(table.rows))}]}}
+
+    def run_query(self, query, printresults=False, timespan=None, use_cache=True, server_timeout=None, include_statistics=False):
+        time.sleep(self.latency)
+        stage, table = self.answer(query.strip())
+        self.recorder.record("loganalytics", stage, rows=len(table))
+        return QueryResult([table], statistics=self.buildStatistics(query, timespan, table) if include_statistics else None)
+
+    def run_query_sliced(self, query, timespan, slice_duration, printresults=False, use_cache=True, server_timeout=None):
+        slicer = KQLSlicer(max_workers=4, retries=0)
+        return slicer.run(query, timespan, slice_duration, lambda slice_query, slice_timespan: self.run_query(slice_query, timespan=slice_timespan[1] - slice_timespan[0])) or self.run_query(query, timespan=timespan)
+
+    def get_query_cache_stats(self):
+        return None
+
+class FakeHttpFetchClient:
+    """
+    Stand-in for HttpFetchClient. Serves a synthetic HTML page for any URL after a simulated latency.
+    """
+
+    def __init__(self, recorder, latency=0.5, paragraphs=200):
+        self.recorder = recorder
+        self.latency = latency
+        self.paragraphs = paragraphs
+
+    def buildPage(self, url):
+        sections = []
+        for index in range(self.paragraphs):
+            if index % 10 == 0:
+                sections.append(f"<h2>Section {index // 10} of {url}</h2>")
+            sections.append(f"<p>Paragraph {index} about detection engineering, KQL query optimization, Active Directory object deletion and Sentinel analytic rules.</p>")
+        return "<html><body>" + "".join(sections) + "</body></html>"
+
+    def fetch(self, url, transform=None, transform_name='raw'):
+        time.sleep(self.latency)
+        content = self.buildPage(url)
+        self.recorder.record("fetch", "download", bytes=len(content))
+        return {"status_code": 200, "content": transform(content) if transform else content, "cache": "miss", "truncated": False}
+
+    def get_stats(self, url=None):
+        return {}
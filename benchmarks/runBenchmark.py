@@ -0,0 +1,208 @@
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import shutil
+import tempfile
+import subprocess
+import tracemalloc
+import contextlib
+from datetime import datetime, timezone
+from benchmarks.FakeClients import BenchmarkRecorder, FakeAzureOpenAIClient, FakeSentinelClient, FakeHttpFetchClient
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+# Summary metrics compared with a baseline (lower is better)
+COMPARED_METRICS = ["latency_ms.p50", "latency_ms.p95", "first_response_ms.p50", "llm_calls", "prompt_tokens", "completion_tokens", "loganalytics_queries", "peak_memory_bytes"]
+
+def percentile(values, percent):
+    """
+    Percentile with linear interpolation between the closest ranks.
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * percent / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def distribution(values):
+    return {"p50": round(percentile(values, 50), 1), "p90": round(percentile(values, 90), 1), "p95": round(percentile(values, 95), 1),
+            "p99": round(percentile(values, 99), 1), "max": round(max(values, default=0), 1), "mean": round(sum(values) / len(values), 1) if values else 0}
+
+def merge_counters(total, counters):
+    for category, stages in counters.items():
+        for stage, values in stages.items():
+            stage_total = total.setdefault(category, {}).setdefault(stage, {})
+            for name, value in values.items():
+                stage_total[name] = stage_total.get(name, 0) + value
+    return total
+
+def get_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=BENCHMARK_DIR, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def load_schemas(schema_file):
+    with open(schema_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def run_prompt(agent, output_type, prompt, session, recorder):
+    """
+    Run a prompt and measure it.
+
+    :return: Dictionary with the prompt measures (latency, time to the first response, LLM, Log Analytics and fetch counters)
+    """
+    messages = {}
+    first_response = []
+    start_time = time.perf_counter()
+    def channel(message_type, message_object):
+        messages[message_type] = messages.get(message_type, 0) + 1
+        if message_type == 'resultmessage' and not first_response:
+            first_response.append(time.perf_counter())
+    before = recorder.snapshot()
+    results = agent.run_prompt(output_type, prompt, channel, session)
+    end_time = time.perf_counter()
+    counters = BenchmarkRecorder.diff(recorder.snapshot(), before)
+    llm_counters = counters.get("llm", {})
+    return {
+        "latency_ms": round((end_time - start_time) * 1000, 1),
+        "first_response_ms": round(((first_response[0] if first_response else end_time) - start_time) * 1000, 1),
+        "results": len(results),
+        "llm_calls": sum(stage["calls"] for stage in llm_counters.values()),
+        "prompt_tokens": sum(stage["prompt_tokens"] for stage in llm_counters.values()),
+        "completion_tokens": sum(stage["completion_tokens"] for stage in llm_counters.values()),
+        "loganalytics_queries": sum(stage["calls"] for stage in counters.get("loganalytics", {}).values()),
+        "stages": counters,
+        "messages": messages
+    }
+
+def run_benchmark(args):
+    """
+    Create the agent with the stand-in clients, wait for the warm-up and run the corpus.
+
+    :return: Benchmark report (JSON serializable)
+    """
+    with open(args.corpus, 'r', encoding='utf-8') as f:
+        scenarios = json.load(f)
+    schemas = load_schemas(args.schema)
+    recorder = BenchmarkRecorder()
+    clients = {
+        "azure_openai_client": FakeAzureOpenAIClient(recorder, scenarios, args.llm_latency, args.llm_token_latency, schemas),
+        "sentinel_client": FakeSentinelClient(recorder, schemas, args.la_latency, args.rows),
+        "http_fetch_client": FakeHttpFetchClient(recorder, args.fetch_latency)
+    }
+    # Schema is generated with the stand-in clients in an empty folder unless a folder is provided
+    schema_dir = args.schema_dir or tempfile.mkdtemp(prefix='teisec-benchmark-')
+    os.environ['SENTINELKQL_SCHEMA_DIR'] = schema_dir
+    from app.TeisecAgent import TeisecAgent
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    agent = TeisecAgent("default", clients)
+    init_time = time.perf_counter() - start_time
+    if "SentinelKQLPlugin" in agent.plugin_classes and agent.plugin_classes["SentinelKQLPlugin"].warmup:
+        agent.get_plugin("SentinelKQLPlugin").schema_ready.wait()
+    warmup_time = time.perf_counter() - start_time
+    startup_peak_memory = tracemalloc.get_traced_memory()[1]
+    startup_counters = recorder.snapshot()
+    tracemalloc.reset_peak()
+
+    prompt_reports = []
+    for iteration in range(args.iterations):
+        for scenario in scenarios:
+            # Each scenario is an independent session (prompts of a scenario use the previous results)
+            session = agent.create_session()
+            for step in scenario["prompts"]:
+                prompt_report = run_prompt(agent, args.output_type, step["prompt"], session, recorder)
+                prompt_reports.append(dict({"iteration": iteration, "scenario": scenario["name"], "prompt": step["prompt"]}, **prompt_report))
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    if args.schema_dir is None:
+        shutil.rmtree(schema_dir, ignore_errors=True)
+
+    stage_totals = {}
+    for prompt_report in prompt_reports:
+        merge_counters(stage_totals, prompt_report["stages"])
+    return {
+        "version": get_version(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {name: value for name, value in vars(args).items() if name not in ('output', 'compare', 'verbose')},
+        "startup": {
+            "agent_init_ms": round(init_time * 1000, 1),
+            "schema_warmup_ms": round(warmup_time * 1000, 1),
+            "peak_memory_bytes": startup_peak_memory,
+            "stages": startup_counters
+        },
+        "summary": {
+            "prompts": len(prompt_reports),
+            "latency_ms": distribution([prompt_report["latency_ms"] for prompt_report in prompt_reports]),
+            "first_response_ms": distribution([prompt_report["first_response_ms"] for prompt_report in prompt_reports]),
+            "llm_calls": sum(prompt_report["llm_calls"] for prompt_report in prompt_reports),
+            "prompt_tokens": sum(prompt_report["prompt_tokens"] for prompt_report in prompt_reports),
+            "completion_tokens": sum(prompt_report["completion_tokens"] for prompt_report in prompt_reports),
+            "loganalytics_queries": sum(prompt_report["loganalytics_queries"] for prompt_report in prompt_reports),
+            "peak_memory_bytes": peak_memory,
+            "stages": stage_totals
+        },
+        "prompts": prompt_reports
+    }
+
+def get_metric(report, metric):
+    value = report["summary"]
+    for key in metric.split('.'):
+        value = value.get(key, {}) if isinstance(value, dict) else {}
+    return value if isinstance(value, (int, float)) else None
+
+def compare_reports(report, baseline):
+    """
+    Compare the summary metrics with a baseline report.
+
+    :return: Dictionary with the baseline value, current value and relative change of each metric
+    """
+    comparison = {}
+    for metric in COMPARED_METRICS:
+        current_value = get_metric(report, metric)
+        baseline_value = get_metric(baseline, metric)
+        if current_value is None or baseline_value is None:
+            continue
+        change = (current_value - baseline_value) / baseline_value if baseline_value else 0
+        comparison[metric] = {"baseline": baseline_value, "current": current_value, "change": round(change, 3)}
+    return comparison
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Teisec Agent benchmark with stand-in Azure OpenAI, Sentinel and HTTP clients")
+    parser.add_argument("--corpus", default=os.path.join(BENCHMARK_DIR, "corpus.json"), help="JSON file with the benchmark scenarios")
+    parser.add_argument("--schema", default=os.path.join(os.path.dirname(BENCHMARK_DIR), "SentinelSchema.json"), help="JSON file with the CSL schema of the stand-in workspace tables")
+    parser.add_argument("--schema-dir", default=None, help="Sentinel Schema cache folder. A new empty folder is used by default (schema generation is measured)")
+    parser.add_argument("--iterations", type=int, default=1, help="Number of times the corpus is run")
+    parser.add_argument("--output-type", default="terminal", choices=["terminal", "html", "other"])
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="Seconds of latency per LLM call")
+    parser.add_argument("--llm-token-latency", type=float, default=0.005, help="Seconds per completion token")
+    parser.add_argument("--la-latency", type=float, default=0.3, help="Seconds of latency per Log Analytics query")
+    parser.add_argument("--fetch-latency", type=float, default=0.5, help="Seconds of latency per URL fetch")
+    parser.add_argument("--rows", type=int, default=50, help="Maximum number of rows returned by the data queries")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file (stdout by default)")
+    parser.add_argument("--compare", default=None, help="Baseline JSON report to compare with")
+    parser.add_argument("--verbose", action="store_true", help="Show the agent output")
+    args = parser.parse_args()
+
+    agent_output = sys.stderr if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(agent_output):
+        report = run_benchmark(args)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            report["comparison"] = compare_reports(report, json.load(f))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        summary = {name: value for name, value in report["summary"].items() if name != "stages"}
+        print(json.dumps({"startup": {name: value for name, value in report["startup"].items() if name != "stages"}, "summary": summary, "comparison": report.get("comparison")}, indent=4))
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=4))
+
+if __name__ == "__main__":
+    main()
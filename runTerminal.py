@@ -1,4 +1,5 @@
 import os  
+import sys
 import argparse  
 from colorama import Fore  
 from dotenv import load_dotenv  
@@ -13,6 +14,28 @@ args = parser.parse_args()
 auth_type = args.auth  
 teisecAgent= TeisecAgent(auth_type)
     
+streamed_responses = set()
+def terminal_channel(message_type, message_object):
+    """
+    Print the messages sent by the agent. Streamed responses are printed as the chunks arrive.
+    """
+    if message_type == 'resultmessage':
+        if message_object.get('partial'):
+            if message_object['stream_id'] not in streamed_responses:
+                streamed_responses.add(message_object['stream_id'])
+                sys.stdout.write(f"{Fore.CYAN}[Response]{Fore.WHITE} ")
+            sys.stdout.write(message_object['message'])
+            sys.stdout.flush()
+        elif message_object.get('final') and message_object['stream_id'] in streamed_responses:
+            streamed_responses.discard(message_object['stream_id'])
+            print()
+        else:
+            print_response(str(message_object['message']))
+    elif message_type == 'systemmessage':
+        print_info(message_object['message'])
+    elif message_type == 'debugmessage':
+        print_debug(message_object['message'])
+
 # AI Assistant Start  
 def main():
     
@@ -35,9 +58,7 @@ def main():
                 for plugin_help in plugin_help_list:
                     print_help(plugin_help)
             else:  
-                # Run Prompt  
-                processed_responses=teisecAgent.run_prompt('terminal',user_input)
-                for response in processed_responses:
-                    print_response(str(response))  
+                # Run Prompt. Responses are printed by the channel as they are generated
+                teisecAgent.run_prompt('terminal',user_input,terminal_channel)
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+import httpx
+import openai
+import pytest
+from app.clients.AzureOpenAIClient import AzureOpenAIClient
+from app.clients.AsyncAzureOpenAIClient import AsyncAzureOpenAIClient
+
+def rate_limit_error():
+    request = httpx.Request('POST', 'https://example.openai.azure.com/openai/deployments/gpt/chat/completions')
+    return openai.RateLimitError("Rate limit reached", response=httpx.Response(429, request=request), body=None)
+
+def completion(prompt):
+    usage = SimpleNamespace(total_tokens=3, prompt_tokens=2, completion_tokens=1)
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"answer to {prompt}"))], usage=usage)
+
+def create(**parameters):
+    prompt = parameters["messages"][-1]["content"]
+    if prompt == 'throttled':
+        raise rate_limit_error()
+    return completion(prompt)
+
+async def acreate(**parameters):
+    return create(**parameters)
+
+def test_batch_returns_one_result_per_prompt():
+    client = AzureOpenAIClient('key', 'https://example.openai.azure.com', 'gpt')
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    results = client.runPromptBatch(['first', 'throttled', ('third', [])])
+    assert [result["status"] for result in results] == ['success', 'error', 'success']
+    assert results[0]["result"] == 'answer to first' and results[2]["result"] == 'answer to third'
+    assert results[1]["result"] == 'Rate limit reached'
+
+def test_async_batch_returns_one_result_per_prompt():
+    client = AsyncAzureOpenAIClient('key', 'https://example.openai.azure.com', 'gpt')
+    try:
+        client.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=acreate)))
+        results = client.runPromptBatch(['first', 'throttled', 'third'])
+        assert [result["status"] for result in results] == ['success', 'error', 'success']
+        assert results[1]["prompt_tokens"] == 0
+        with pytest.raises(openai.RateLimitError):
+            client.runPrompt('throttled')
+    finally:
+        client.close()
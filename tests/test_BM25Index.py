@@ -0,0 +1,28 @@
+from app.BM25Index import BM25Index, tokenize
+
+DOCUMENTS = {
+    "SigninLogs": "SigninLogs. Azure Active Directory sign-in logs with the user, the IP address and the location of each sign-in",
+    "SecurityIncident": "SecurityIncident. Microsoft Sentinel incidents with their severity, status and owner",
+    "EmailEvents": "EmailEvents. Email delivery events with the sender, the recipient and the subject of each email"
+}
+
+def test_tokenize_splits_camelcase_identifiers():
+    assert tokenize("SigninLogs") == ["signinlogs", "signin", "logs"]
+
+def test_tokenize_ignores_stopwords():
+    assert tokenize("What are the top 10 incidents for me") == ["top", "10", "incidents"]
+    assert tokenize("show me the data of this") == ["data"]
+
+def test_search_ranks_the_matching_document_first():
+    ranking = BM25Index(DOCUMENTS).search("failed sign-in logs by IP address", top_k=2)
+    assert ranking[0][0] == "SigninLogs"
+    assert len(ranking) == 2
+
+def test_stopword_only_queries_do_not_score():
+    scores = BM25Index(DOCUMENTS).score("what is the status of the data")
+    assert scores["SecurityIncident"] > 0
+    assert scores["SigninLogs"] == 0 and scores["EmailEvents"] == 0
+    assert all(score == 0 for score in BM25Index(DOCUMENTS).score("show me all of them").values())
+
+def test_empty_index():
+    assert BM25Index({}).search("incidents") == []
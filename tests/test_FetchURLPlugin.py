@@ -0,0 +1,31 @@
+import pytest
+from app.HelperFunctions import count_tokens
+from app.plugins.FetchURLPlugin import FetchURLPlugin
+
+@pytest.fixture
+def plugin(monkeypatch):
+    monkeypatch.setenv('FETCHURL_TOKEN_BUDGET', '200')
+    monkeypatch.setenv('FETCHURL_CHUNK_TOKENS', '50')
+    monkeypatch.setenv('FETCHURL_CACHE', 'False')
+    return FetchURLPlugin('FetchURLPlugin', 'Fetch URL', 'API', None)
+
+def test_long_lines_are_split_in_chunks(plugin):
+    text = ' '.join(f'word{index}' for index in range(1000))
+    chunks = plugin.chunk_text(text)
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 50 for chunk in chunks)
+    assert ''.join(chunks) == text
+
+def test_selected_chunks_fit_the_budget(plugin):
+    text = '\n'.join(f'# Section {index}\n' + ' '.join(['phishing email'] * 20) for index in range(40))
+    reduced_text, stats = plugin.select_relevant_chunks(text, 'phishing email')
+    assert reduced_text
+    assert count_tokens(reduced_text) <= stats["tokens"] <= 200
+
+def test_oversized_chunk_is_truncated(plugin):
+    plugin.chunk_tokens = 10000
+    text = 'x' * 20000
+    reduced_text, stats = plugin.select_relevant_chunks(text, 'anything')
+    assert reduced_text and text.startswith(reduced_text)
+    assert count_tokens(reduced_text) <= 200
+    assert stats["chunks"] == '1/1'
@@ -0,0 +1,86 @@
+import threading
+import time
+from datetime import datetime, timedelta
+import pytest
+from app.clients.KQLResultCache import KQLResultCache
+from app.clients.QueryResult import QueryResult, QueryResultTable
+
+def make_result(rows=1, status='Success'):
+    return QueryResult([QueryResultTable('PrimaryResult', ['Name', 'Count'], [['row', index] for index in range(rows)])], status=status)
+
+def test_normalize_query_keeps_string_literals():
+    query = "SigninLogs  // comment\n|   where   Name == 'a  b';"
+    assert KQLResultCache.normalize_query(query) == "SigninLogs | where Name == 'a  b'"
+    assert KQLResultCache.build_key(query, 'ws') == KQLResultCache.build_key("SigninLogs | where Name == 'a  b'", 'ws')
+    assert KQLResultCache.build_key(query, 'ws') != KQLResultCache.build_key(query, 'other')
+
+def test_ttl_depends_on_the_time_references():
+    cache = KQLResultCache(relative_ttl=10, absolute_ttl=100)
+    assert cache.get_ttl("SigninLogs | where TimeGenerated > ago(1d)") == 10
+    assert cache.get_ttl("SigninLogs | where TimeGenerated > datetime(2024-01-01)") == 100
+    assert cache.get_ttl("SigninLogs | where Name == 'ago('") == 10
+    assert cache.get_ttl("SigninLogs | where TimeGenerated > datetime(2024-01-01)", timedelta(days=1)) == 10
+    assert cache.get_ttl("SigninLogs", (datetime(2024, 1, 1), datetime(2024, 1, 2))) == 100
+    assert cache.get_ttl("SigninLogs") == 10
+
+def test_results_expire(monkeypatch):
+    cache = KQLResultCache(relative_ttl=10)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    calls = []
+    run = lambda: calls.append(1) or make_result()
+    first = cache.get_or_run("SigninLogs | take 1", 'ws', None, run)
+    assert cache.get_or_run("SigninLogs | take 1", 'ws', None, run) is first
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+    cache.get_or_run("SigninLogs | take 1", 'ws', None, run)
+    assert len(calls) == 2
+    assert cache.get_stats()["hits"] == 1
+
+def test_errors_and_partial_results_are_not_cached():
+    cache = KQLResultCache()
+    calls = []
+    cache.get_or_run("SigninLogs", 'ws', None, lambda: calls.append(1) or make_result(status='PartialError'))
+    cache.get_or_run("SigninLogs", 'ws', None, lambda: calls.append(1) or make_result(status='PartialError'))
+    with pytest.raises(ValueError):
+        cache.get_or_run("SecurityAlert", 'ws', None, lambda: (_ for _ in ()).throw(ValueError("failed")))
+    assert len(calls) == 2
+    assert cache.get_stats()["results"] == 0
+
+def test_concurrent_identical_queries_run_once():
+    cache = KQLResultCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def run():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return make_result()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_run("SigninLogs", 'ws', None, run))) for _ in range(3)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    while cache.get_stats()["deduplicated"] < 2:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert len(results) == 3 and all(result is results[0] for result in results)
+
+def test_least_recently_used_results_are_evicted():
+    cache = KQLResultCache(max_cells=8)
+    cache.get_or_run("A", 'ws', None, lambda: make_result(2))
+    cache.get_or_run("B", 'ws', None, lambda: make_result(2))
+    cache.get_or_run("A", 'ws', None, lambda: make_result(2))
+    cache.get_or_run("C", 'ws', None, lambda: make_result(2))
+    assert cache.get(cache.build_key("B", 'ws')) is None
+    assert cache.get(cache.build_key("A", 'ws')) is not None
+    # Results larger than the cap are not cached
+    cache.get_or_run("D", 'ws', None, lambda: make_result(5))
+    assert cache.get(cache.build_key("D", 'ws')) is None
+    assert cache.get_stats()["evictions"] == 1
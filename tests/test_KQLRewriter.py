@@ -0,0 +1,79 @@
+from datetime import timedelta
+import pytest
+from app.KQLRewriter import KQLRewriter
+
+TABLE_COLUMNS = {
+    "SigninLogs": {"TimeGenerated": "datetime", "UserPrincipalName": "string", "IPAddress": "string"},
+    "SecurityIncident": {"TimeGenerated": "datetime", "Title": "string"},
+    "SecurityAlert": {"TimeGenerated": "datetime", "AlertName": "string"},
+    "Watchlist": {"SearchKey": "string"}
+}
+
+@pytest.fixture
+def rewriter():
+    return KQLRewriter(default_lookback=timedelta(days=30), max_rows=1000)
+
+@pytest.mark.parametrize("prompt, lookback", [
+    ("sign-ins in the last 7 days", timedelta(days=7)),
+    ("failures in the past hour", timedelta(hours=1)),
+    ("alerts from yesterday", timedelta(days=2)),
+    ("all the incidents", None),
+])
+def test_prompt_lookback(prompt, lookback):
+    assert KQLRewriter.get_prompt_lookback(prompt) == lookback
+
+def test_adds_time_filter_and_row_cap(rewriter):
+    result = rewriter.rewrite("SigninLogs | project UserPrincipalName", "sign-ins in the last 7 days", TABLE_COLUMNS)
+    assert result["query"] == "SigninLogs | where TimeGenerated > ago(7d) | project UserPrincipalName | take 1000"
+    assert result["timespan"] == timedelta(days=7)
+
+def test_no_time_filter_for_tables_without_time_generated(rewriter):
+    result = rewriter.rewrite("Watchlist | project SearchKey", None, TABLE_COLUMNS)
+    assert "TimeGenerated" not in result["query"]
+
+def test_tightens_time_filter_to_the_prompt(rewriter):
+    result = rewriter.rewrite("SigninLogs | where TimeGenerated > ago(30d) | count", "last 2 days", TABLE_COLUMNS)
+    assert result["query"] == "SigninLogs | where TimeGenerated > ago(2d) | count"
+    assert result["timespan"] == timedelta(days=2)
+
+def test_moves_where_before_extend(rewriter):
+    result = rewriter.rewrite("SigninLogs | extend Domain = tostring(split(UserPrincipalName, '@')[1]) | where IPAddress == '1.2.3.4' | where Domain == 'contoso.com'", None, TABLE_COLUMNS)
+    segments = [segment.strip() for segment in result["query"].split('|')]
+    assert segments.index("where IPAddress == '1.2.3.4'") < segments.index("extend Domain = tostring(split(UserPrincipalName, '@')[1])")
+    # The filter on the extended column stays after the extend
+    assert segments.index("where Domain == 'contoso.com'") > segments.index("extend Domain = tostring(split(UserPrincipalName, '@')[1])")
+
+def test_caps_existing_take(rewriter):
+    result = rewriter.rewrite("SigninLogs | where TimeGenerated > ago(1d) | take 50000", None, TABLE_COLUMNS)
+    assert result["query"].endswith("take 1000")
+
+def test_strings_and_comments_are_not_parsed(rewriter):
+    result = rewriter.rewrite("SigninLogs | where UserPrincipalName == 'a | take 5' // TimeGenerated > ago(1d)", None, TABLE_COLUMNS)
+    assert "where TimeGenerated > ago(30d)" in result["query"]
+    assert "'a | take 5'" in result["query"]
+
+def test_let_and_absolute_time_are_only_capped(rewriter):
+    result = rewriter.rewrite("let users = SigninLogs | distinct UserPrincipalName; users", "last 7 days", TABLE_COLUMNS)
+    assert result["timespan"] is None
+    result = rewriter.rewrite("SigninLogs | where TimeGenerated between (datetime(2024-01-01) .. datetime(2024-01-02))", None, TABLE_COLUMNS)
+    assert result["timespan"] is None
+    assert result["query"].endswith("take 1000")
+
+def test_time_filter_in_join_subquery_is_not_the_query_filter(rewriter):
+    query = "SecurityIncident | join (SecurityAlert | where TimeGenerated > ago(90d)) on $left.Title == $right.AlertName"
+    result = rewriter.rewrite(query, "incidents in the last 7 days", TABLE_COLUMNS)
+    assert result["query"].startswith("SecurityIncident | where TimeGenerated > ago(7d) | join (SecurityAlert | where TimeGenerated > ago(90d))")
+    # The timespan covers the subquery filter so its rows are not cut
+    assert result["timespan"] == timedelta(days=90)
+
+def test_server_timeout_is_bounded():
+    assert KQLRewriter.get_server_timeout(timedelta(hours=1)) == 30
+    assert KQLRewriter.get_server_timeout(timedelta(days=365)) == 600
+
+def test_row_cap_is_added_before_render(rewriter):
+    result = rewriter.rewrite("SigninLogs | where TimeGenerated > ago(1d) | summarize count() by bin(TimeGenerated, 1h) | render timechart", "sign-ins today", TABLE_COLUMNS)
+    assert result["query"] == "SigninLogs | where TimeGenerated > ago(1d) | summarize count() by bin(TimeGenerated, 1h) | take 1000 | render timechart"
+    result = rewriter.rewrite("let start = ago(1d); SigninLogs | where TimeGenerated > start | render timechart")
+    assert result["query"].endswith("| take 1000 | render timechart")
+    result = rewriter.rewrite("SigninLogs | where TimeGenerated > ago(1d) | take 5000 | render columnchart", "sign-ins today", TABLE_COLUMNS)
+    assert result["query"].endswith("| take 1000 | render columnchart")
@@ -0,0 +1,130 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from azure.core.exceptions import HttpResponseError
+from app.clients.KQLSlicer import KQLSlicer
+from app.clients.QueryResult import QueryResult, QueryResultTable
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+TIMESPAN = (START, START + timedelta(days=30))
+
+def http_error(status_code, message):
+    error = HttpResponseError(message=message)
+    error.status_code = status_code
+    return error
+
+class Executor:
+    """
+    Slice executor returning the results of a function of the slice (counting the calls).
+    """
+    def __init__(self, function):
+        self.function = function
+        self.calls = 0
+
+    def __call__(self, query, slice_timespan):
+        self.calls += 1
+        return self.function(query, slice_timespan)
+
+def test_all_slices_failed_returns_first_error():
+    error = http_error(400, "Failed to resolve column 'Foo'")
+    executor = Executor(lambda query, slice_timespan: error)
+    result = KQLSlicer(retries=2, retry_delay=0).run("SigninLogs | where TimeGenerated > ago(30d) | count", TIMESPAN, timedelta(days=7), executor)
+    assert result is error
+    # Semantic errors are not retried: one call per slice
+    assert executor.calls == 5
+
+def test_all_slices_failed_distinct():
+    error = http_error(403, "Forbidden")
+    result = KQLSlicer(retries=1, retry_delay=0).run("SigninLogs | distinct UserPrincipalName", TIMESPAN, timedelta(days=7), Executor(lambda query, slice_timespan: error))
+    assert result is error
+
+def test_transient_errors_are_retried():
+    attempts = {}
+    def execute(query, slice_timespan):
+        attempts[slice_timespan] = attempts.get(slice_timespan, 0) + 1
+        if attempts[slice_timespan] == 1:
+            return http_error(429, "Too many requests")
+        return QueryResult([QueryResultTable('PrimaryResult', ['Count'], [[1]])])
+    executor = Executor(execute)
+    result = KQLSlicer(retries=2, retry_delay=0).run("SigninLogs | count", TIMESPAN, timedelta(days=7), executor)
+    assert result.status == 'Success'
+    assert result.primary_table.rows == [[5]]
+    assert executor.calls == 10
+
+def test_partial_failure_reports_slice_errors():
+    def execute(query, slice_timespan):
+        if slice_timespan[0] == START:
+            return http_error(500, "Internal server error")
+        return QueryResult([QueryResultTable('PrimaryResult', ['Count'], [[2]])])
+    result = KQLSlicer(retries=1, retry_delay=0).run("SigninLogs | count", TIMESPAN, timedelta(days=7), Executor(execute))
+    assert result.status == 'PartialError'
+    assert result.primary_table.rows == [[8]]
+    assert "1 of 5 time slices failed" in result.partial_error
+    assert "Internal server error" in result.partial_error
+
+def test_exceptions_are_returned_as_errors():
+    def execute(query, slice_timespan):
+        raise TimeoutError("slice timed out")
+    executor = Executor(execute)
+    result = KQLSlicer(retries=1, retry_delay=0).run("SigninLogs | count", TIMESPAN, timedelta(days=7), executor)
+    assert isinstance(result, TimeoutError)
+    assert executor.calls == 10
+
+def slice_executor(rows_by_slice, columns):
+    """
+    Executor returning the rows of the slice (by slice index) with the given columns.
+    """
+    slices = KQLSlicer.split_timespan(TIMESPAN, timedelta(days=7))
+    return Executor(lambda query, slice_timespan: QueryResult([QueryResultTable('PrimaryResult', columns, rows_by_slice[slices.index(slice_timespan)])]))
+
+def test_plan():
+    assert KQLSlicer.plan("SigninLogs | where ResultType != '0' | project UserPrincipalName | take 10")["kind"] == "rows"
+    plan = KQLSlicer.plan("SigninLogs | summarize Failures = countif(ResultType != '0'), max(TimeGenerated) by IPAddress | top 5 by Failures")
+    assert plan["aggregations"] == {"Failures": "sum", "max_TimeGenerated": "max"}
+    assert plan["slice_query"] == "SigninLogs | summarize Failures = countif(ResultType != '0'), max(TimeGenerated) by IPAddress"
+    assert KQLSlicer.plan("SigninLogs | summarize arg_max(TimeGenerated, *) by UserPrincipalName")["arg_column"] == "TimeGenerated"
+
+@pytest.mark.parametrize("query", [
+    "SigninLogs | summarize dcount(UserPrincipalName) by IPAddress",
+    "SigninLogs | summarize avg(Duration)",
+    "SigninLogs | summarize count() by IPAddress | where count_ > 5",
+    "SigninLogs | join (SecurityAlert) on UserPrincipalName",
+    "let threshold = 5; SigninLogs | take threshold",
+    "union SigninLogs, AuditLogs | count",
+])
+def test_queries_that_cant_be_sliced(query):
+    assert KQLSlicer.plan(query) is None
+    assert KQLSlicer(retry_delay=0).run(query, TIMESPAN, timedelta(days=7), Executor(lambda query, slice_timespan: None)) is None
+
+def test_merge_count():
+    executor = slice_executor([[[3]], [[4]], [[0]], [[1]], [[2]]], ['Count'])
+    assert KQLSlicer(retry_delay=0).run("SigninLogs | count", TIMESPAN, timedelta(days=7), executor).primary_table.rows == [[10]]
+
+def test_merge_summarize_recombines_groups_and_applies_tail():
+    rows_by_slice = [[['1.1.1.1', 2, 5], ['2.2.2.2', 1, 7]], [['1.1.1.1', 3, 9]], [], [['3.3.3.3', 4, None]], [['2.2.2.2', 1, 1]]]
+    executor = slice_executor(rows_by_slice, ['IPAddress', 'count_', 'max_Duration'])
+    result = KQLSlicer(retry_delay=0).run("SigninLogs | summarize count(), max(Duration) by IPAddress | top 2 by count_", TIMESPAN, timedelta(days=7), executor)
+    assert result.status == 'Success'
+    assert result.primary_table.rows == [['1.1.1.1', 5, 9], ['3.3.3.3', 4, None]]
+
+def test_merge_arg_max_keeps_the_latest_row_of_each_group():
+    rows_by_slice = [[['alice', 1, 'a1'], ['bob', 2, 'b1']], [['alice', 8, 'a2']], [['bob', None, 'b2']], [], []]
+    executor = slice_executor(rows_by_slice, ['UserPrincipalName', 'TimeGenerated', 'IPAddress'])
+    result = KQLSlicer(retry_delay=0).run("SigninLogs | summarize arg_max(TimeGenerated, *) by UserPrincipalName", TIMESPAN, timedelta(days=7), executor)
+    assert sorted(result.primary_table.rows) == [['alice', 8, 'a2'], ['bob', 2, 'b1']]
+
+def test_merge_distinct_and_rows():
+    rows_by_slice = [[['alice']], [['bob'], ['alice']], [], [['carol']], [['bob']]]
+    result = KQLSlicer(retry_delay=0).run("SigninLogs | distinct UserPrincipalName | sort by UserPrincipalName asc", TIMESPAN, timedelta(days=7), slice_executor(rows_by_slice, ['UserPrincipalName']))
+    assert result.primary_table.rows == [['alice'], ['bob'], ['carol']]
+    result = KQLSlicer(retry_delay=0).run("SigninLogs | project UserPrincipalName | take 3", TIMESPAN, timedelta(days=7), slice_executor(rows_by_slice, ['UserPrincipalName']))
+    # Rows are concatenated in time order
+    assert result.primary_table.rows == [['alice'], ['bob'], ['alice']]
+
+def test_unexpected_columns_fall_back_to_the_whole_query():
+    executor = slice_executor([[[1]]] * 5, ['Total'])
+    assert KQLSlicer(retry_delay=0).run("SigninLogs | summarize count()", TIMESPAN, timedelta(days=7), executor) is None
+
+def test_empty_slices_merge_to_an_empty_result():
+    executor = Executor(lambda query, slice_timespan: QueryResult([QueryResultTable('PrimaryResult', [], [])]))
+    result = KQLSlicer(retry_delay=0).run("SigninLogs | take 10", TIMESPAN, timedelta(days=7), executor)
+    assert result.status == 'Success' and len(result) == 0
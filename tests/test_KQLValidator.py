@@ -0,0 +1,56 @@
+import pytest
+from app.KQLValidator import KQLValidator
+
+SCHEMAS = {
+    "SigninLogs": "TimeGenerated:datetime, UserPrincipalName:string, ResultType:string, IPAddress:string, LocationDetails:dynamic, AppDisplayName:string",
+    "SecurityAlert": "TimeGenerated:datetime, AlertName:string, AlertSeverity:string, Entities:string"
+}
+
+@pytest.fixture(scope="module")
+def validator():
+    return KQLValidator(SCHEMAS)
+
+def test_parse_csl():
+    assert KQLValidator.parse_csl("TimeGenerated:datetime, ['Field Name']:string") == {"TimeGenerated": "datetime", "Field Name": "string"}
+
+@pytest.mark.parametrize("query", [
+    "SigninLogs | where TimeGenerated > ago(1d) | project UserPrincipalName, IPAddress",
+    "SigninLogs | extend City = tostring(LocationDetails.city) | where City == 'Madrid' | project City, UserPrincipalName",
+    "SigninLogs | summarize count() by UserPrincipalName | sort by count_ desc",
+    "SigninLogs | summarize Failures = countif(ResultType != '0') by IPAddress | where Failures > 5",
+    "SigninLogs | summarize arg_max(TimeGenerated, *) by UserPrincipalName | project IPAddress",
+    "SigninLogs | project-away Location*",
+    "SigninLogs | project User = strcat(UserPrincipalName, '*')",
+    "SigninLogs | where UserPrincipalName has 'admin' // IPAddresss",
+    'SigninLogs | where AppDisplayName == "Foo | Bar" | take 10',
+    "SigninLogs | join kind=inner (SecurityAlert) on $left.UserPrincipalName == $right.AlertName | project Anything",
+    "SigninLogs | top 10 by TimeGenerated desc",
+    "let threshold = 5; SigninLogs | take threshold",
+])
+def test_valid_queries_have_no_errors(validator, query):
+    assert validator.validate(query) == []
+
+def test_unknown_column_suggests_the_closest_one(validator):
+    errors = validator.validate("SigninLogs | where UserPrincipalNam == 'x'")
+    assert len(errors) == 1
+    assert "UserPrincipalNam" in errors[0] and "Did you mean 'UserPrincipalName'" in errors[0]
+
+def test_columns_removed_by_project_or_distinct(validator):
+    assert validator.validate("SigninLogs | project UserPrincipalName | where IPAddress == '1'") != []
+    assert validator.validate("SigninLogs | distinct UserPrincipalName | project IPAddress") != []
+
+def test_unknown_operator(validator):
+    assert validator.validate("SigninLogs | foo") == ["Unknown KQL operator 'foo'"]
+
+@pytest.mark.parametrize("query", [
+    "imAuthentication | where EventResult == 'Failure'",
+    "SiginLogs | take 10",
+])
+def test_unknown_sources_are_warnings(validator, query):
+    warnings = []
+    assert validator.validate(query, warnings) == []
+    assert len(warnings) == 1
+
+def test_get_columns(validator):
+    assert validator.get_columns("SecurityAlert") == "TimeGenerated:datetime, AlertName:string, AlertSeverity:string, Entities:string"
+    assert validator.get_columns("Unknown") == ""
@@ -0,0 +1,93 @@
+import sqlite3
+import pytest
+from app.TeisecSession import TeisecSession
+from app.clients.LocalResultStore import LocalResultStore
+from app.clients.QueryResult import QueryResult, QueryResultTable
+from app.plugins.LocalResultsPlugin import LocalResultsPlugin
+
+def query_result(rows):
+    return QueryResult([QueryResultTable('PrimaryResult', ['UserPrincipalName', 'Count'], rows, ['string', 'long'])])
+
+@pytest.fixture
+def store():
+    store = LocalResultStore()
+    yield store
+    store.close()
+
+def test_store_and_query(store):
+    result_id = store.store(query_result([['alice', 3], ['bob', 5]]), 'SentinelKQLPlugin', 'sign-ins')
+    result = store.query(f"SELECT UserPrincipalName FROM {result_id} WHERE Count > 4")
+    assert result.primary_table.rows == [['bob']]
+    assert store.describe([result_id])[0]["columns"] == [['UserPrincipalName', 'TEXT'], ['Count', 'INTEGER']]
+
+def test_query_is_read_only(store):
+    result_id = store.store(query_result([['alice', 3]]))
+    for sql in (f"DELETE FROM {result_id}", f"DROP TABLE {result_id}", f"UPDATE {result_id} SET Count = 0", "CREATE TABLE other (x TEXT)"):
+        with pytest.raises(sqlite3.Error):
+            store.query(sql)
+    assert store.query(f"SELECT COUNT(*) FROM {result_id}").primary_table.rows == [[1]]
+
+def test_query_only_reads_allowed_results(store):
+    allowed_id = store.store(query_result([['alice', 3]]))
+    other_id = store.store(query_result([['bob', 5]]))
+    assert store.query(f"SELECT * FROM {allowed_id}", result_ids={allowed_id}).primary_table.rows == [['alice', 3]]
+    with pytest.raises(sqlite3.Error):
+        store.query(f"SELECT * FROM {allowed_id} JOIN {other_id} USING (UserPrincipalName)", result_ids={allowed_id})
+    with pytest.raises(sqlite3.Error):
+        store.query("SELECT * FROM results", result_ids={allowed_id})
+
+def test_eviction(store):
+    store.max_results = 2
+    result_ids = [store.store(query_result([['alice', index]])) for index in range(3)]
+    assert [result["result_id"] for result in store.describe()] == result_ids[1:]
+    assert store.get_stats()["evictions"] == 1
+
+def test_sessions_only_see_their_results(store):
+    session = TeisecSession(result_store=store)
+    other_session = TeisecSession(result_store=store)
+    messages, metadata = session.build_entry("sign-ins", query_result([['alice', 3]]), 'SentinelKQLPlugin')
+    session.append_entry(messages, metadata)
+    result_id = metadata["result_id"]
+    assert LocalResultsPlugin.getSessionResultIds("count the previous results", session.task_context()) == [result_id]
+    # A result id typed in another session is not authorized
+    assert LocalResultsPlugin.getSessionResultIds(f"SELECT * FROM {result_id}", other_session.task_context()) == []
+
+def test_clear_removes_session_results(store):
+    session = TeisecSession(result_store=store)
+    messages, metadata = session.build_entry("sign-ins", query_result([['alice', 3]]), 'SentinelKQLPlugin')
+    session.append_entry(messages, metadata)
+    session.clear()
+    assert store.describe() == []
+    with pytest.raises(sqlite3.Error):
+        store.get_result(metadata["result_id"])
+
+def test_sessions_do_not_evict_other_session_results(store):
+    store.max_results = 2
+    session = TeisecSession(result_store=store)
+    other_session = TeisecSession(result_store=store)
+    messages, metadata = session.build_entry("sign-ins", query_result([['alice', 3]]), 'SentinelKQLPlugin')
+    session.append_entry(messages, metadata)
+    for index in range(3):
+        other_session.append_entry(*other_session.build_entry(f"prompt {index}", query_result([['bob', index]]), 'SentinelKQLPlugin'))
+    assert store.query(f"SELECT * FROM {metadata['result_id']}").primary_table.rows == [['alice', 3]]
+    assert len(store.describe()) == 3
+
+def test_budget_compaction_does_not_reload_results(store):
+    session = TeisecSession(token_budget=300, entry_token_limit=400, preview_rows=50, result_store=store)
+    rows = [[f'user{index}@contoso.com', index] for index in range(50)]
+    messages, metadata = session.build_entry("sign-ins", query_result(rows), 'SentinelKQLPlugin')
+    session.append_entry(messages, metadata)
+    # The stored result is removed (ie. evicted) before the session is compacted
+    store.delete(metadata["result_id"])
+    session.append_entry(*session.build_entry("next prompt", "short response"))
+    assert session.entries[0]["compacted"]
+    assert metadata["result_id"] in session[1]["content"][0]["text"]
+    assert session.token_count() <= 300
+
+def test_dropped_entries_release_their_results(store):
+    session = TeisecSession(context_window_size=1, result_store=store)
+    messages, metadata = session.build_entry("sign-ins", query_result([['alice', 3]]), 'SentinelKQLPlugin')
+    session.append_entry(messages, metadata)
+    session.append_entry(*session.build_entry("next prompt", "short response"))
+    assert session.result_ids == []
+    assert store.describe() == []
@@ -0,0 +1,53 @@
+import pytest
+from app.PromptRouter import PromptRouter
+from app.plugins.FetchURLPlugin import FetchURLPlugin
+from app.plugins.GPTPlugin import GPTPlugin
+from app.plugins.LocalResultsPlugin import LocalResultsPlugin
+from app.plugins.SentinelKQLPlugin import SentinelKQLPlugin
+
+@pytest.fixture
+def router():
+    return PromptRouter({"SentinelKQLPlugin": SentinelKQLPlugin, "FetchURLPlugin": FetchURLPlugin, "GPTPlugin": GPTPlugin,
+                         "LocalResultsPlugin": LocalResultsPlugin})
+
+@pytest.mark.parametrize("prompt, plugin_name", [
+    ("SecurityIncident | where Severity == 'High' | take 10", "SentinelKQLPlugin"),
+    ("https://learn.microsoft.com/en-us/azure/sentinel/overview", "FetchURLPlugin"),
+    ("select * from res_0123abcd where Count > 5", "LocalResultsPlugin"),
+    ("summarize the previous results", "GPTPlugin"),
+])
+def test_obvious_prompts_are_routed(router, prompt, plugin_name):
+    assert router.route(prompt)[0] == plugin_name
+
+@pytest.mark.parametrize("prompt", [
+    "Get the incidents of the last week and then summarize them",
+    "Run this KQL query; fetch https://example.com",
+    "What are the most common attack techniques?",
+    "SecurityIncident | take 10 " + "x" * 400,
+])
+def test_ambiguous_or_multi_task_prompts_are_decomposed(router, prompt):
+    assert router.route(prompt)[0] is None
+
+def test_confidence_combines_the_matching_routes():
+    class Plugin:
+        routes = [(r'\bkql\b', 0.5), (r'\bincidents\b', 0.4), (r'\bnever\b', 0.9)]
+    router = PromptRouter({"Plugin": Plugin})
+    assert router.score("kql query over the incidents") == {"Plugin": pytest.approx(1 - 0.5 * 0.6)}
+    assert router.score("unrelated prompt") == {}
+
+def test_close_candidates_are_not_routed():
+    class First:
+        routes = [(r'\bincidents\b', 0.9)]
+    class Second:
+        routes = [(r'\bincidents\b', 0.7)]
+    assert PromptRouter({"First": First, "Second": Second}).route("list incidents") == (None, pytest.approx(0.9))
+    assert PromptRouter({"First": First, "Second": Second}, margin=0.1).route("list incidents")[0] == "First"
+
+def test_stats(router):
+    router.route("SecurityIncident | take 10")
+    router.route("What are the most common attack techniques?")
+    router.record_decomposition(3.0)
+    stats = router.get_stats()
+    assert stats["prompts"] == 2 and stats["fast_path"] == 1 and stats["decomposed"] == 1
+    assert stats["fast_path_rate"] == 0.5
+    assert stats["latency_saved"] == 3.0
@@ -0,0 +1,48 @@
+import pytest
+from app.clients.QueryResult import QueryResult, QueryResultTable
+
+@pytest.fixture
+def result():
+    table = QueryResultTable('PrimaryResult', ['Name', 'Count'], [['alice', 1], ['bob, jr', 2]], ['string', 'long'])
+    return QueryResult([table, QueryResultTable('Extra', ['Value'], [[3]])])
+
+def test_behaves_as_the_primary_table(result):
+    assert len(result) == 2
+    assert result.columns == ['Name', 'Count']
+    assert result[0] == {'Name': 'alice', 'Count': 1}
+    assert result[0:1] == [{'Name': 'alice', 'Count': 1}]
+    assert list(result) == result.to_records()
+    assert result.to_records(1) == [{'Value': 3}]
+    assert result.tables[0].column('Count') == [1, 2]
+
+def test_to_csv_quotes_values(result, tmp_path):
+    assert result.to_csv().splitlines() == ['Name,Count', 'alice,1', '"bob, jr",2']
+    path = result.to_csv(str(tmp_path / 'result.csv'))
+    assert open(path, encoding='utf-8').read().splitlines()[2] == '"bob, jr",2'
+
+def test_empty_result():
+    result = QueryResult([])
+    assert len(result) == 0
+    assert result.columns == []
+    assert result.to_records() == []
+    assert result.to_csv() == ''
+    assert str(result) == '[]'
+
+def test_statistics_summary():
+    assert QueryResult([]).get_statistics_summary() is None
+    statistics = {"query": {
+        "executionTime": 0.25,
+        "inputDatasetStatistics": {"rows": {"scanned": 10, "total": 100}, "extents": {"scanned": 1, "total": 4}},
+        "resourceUsage": {"memory": {"peakPerNode": 2048}},
+        "datasetStatistics": [{"tableRowCount": 2, "tableSize": 64}, {"tableRowCount": 1, "tableSize": 16}]
+    }}
+    summary = QueryResult([], statistics=statistics).get_statistics_summary()
+    assert summary == {"execution_ms": 250.0, "scanned_rows": 10, "total_rows": 100, "scanned_extents": 1, "total_extents": 4,
+                       "peak_memory_bytes": 2048, "result_rows": 3, "result_bytes": 80}
+
+def test_to_arrow(result):
+    pyarrow = pytest.importorskip('pyarrow')
+    table = result.to_arrow()
+    assert isinstance(table, pyarrow.Table)
+    assert table.column_names == ['Name', 'Count']
+    assert table.num_rows == 2
@@ -0,0 +1,13 @@
+from app import ResultRenderer
+
+RECORDS = [{"Owner": "BlueVoyant SOC", "Tag": "BV-1", "Note": "bvx"}, {"Owner": None, "Tag": "bluevoyant", "Note": "ok"}]
+
+def test_terminal_output_replaces_blue_voyant_references():
+    output = ResultRenderer.render('terminal', RECORDS)
+    assert 'BlueVoyant' not in output and 'bluevoyant' not in output and 'BV' not in output
+    assert 'SEN SOC' in output and 'SEN-1' in output and 'bvx' in output
+    assert output.splitlines()[-1] == '2 rows'
+
+def test_other_outputs_are_not_redacted():
+    assert 'BlueVoyant SOC' in ResultRenderer.render('other', RECORDS)
+    assert 'BlueVoyant SOC' in ResultRenderer.render('html', RECORDS)
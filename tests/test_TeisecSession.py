@@ -0,0 +1,22 @@
+from app.TeisecSession import TeisecSession
+
+def test_compacted_text_has_no_unresolvable_pointer():
+    session = TeisecSession(token_budget=400, entry_token_limit=200)
+    session.add("fetch the page", "word " * 2000)
+    text = session[1]["content"][0]["text"]
+    assert "Response truncated" in text
+    assert "Full result stored" not in text
+    session.add("next prompt", "word " * 150)
+    assert session.entries[0]["compacted"]
+    assert "Full result stored" not in session[1]["content"][0]["text"]
+    assert session.token_count() <= 400
+
+def test_tabular_results_are_compacted_again_from_the_full_result():
+    session = TeisecSession(token_budget=300, entry_token_limit=600, preview_rows=50)
+    records = [{"UserPrincipalName": f"user{index}@contoso.com", "Count": index} for index in range(50)]
+    session.add("sign-ins", records)
+    session.add("next prompt", "short response")
+    text = session[1]["content"][0]["text"]
+    assert session.entries[0]["compacted"]
+    assert "of 50 rows" in text and "Full result stored" not in text
+    assert session.get_result(session.entries[0]["result_id"]) == records
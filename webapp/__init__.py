@@ -1,9 +1,13 @@
+import os
 from flask import Flask
 from flask_socketio import SocketIO
 from app.TeisecAgent  import TeisecAgent
+from app.PromptWorkerPool import PromptWorkerPool
   
 socketio = SocketIO()
 teisecAgent=TeisecAgent('interactive')
+# Each socket connection has its own session. Prompts run in a bounded pool of workers sharing the agent clients and schema
+promptWorkerPool=PromptWorkerPool(teisecAgent, int(os.getenv('WEBAPP_PROMPT_WORKERS', 4)))
 def create_app(debug=False):
     """Create an application."""
     app = Flask(__name__)
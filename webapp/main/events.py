@@ -1,16 +1,41 @@
 from time import time
-from flask import session
+from flask import session, request
 from flask_socketio import emit, join_room, leave_room,send
 from .. import socketio
 from .. import teisecAgent
+from .. import promptWorkerPool
 
+def session_channel(sid):
+    """
+    Channel of a socket connection. Messages are emitted from the worker threads to the connection room.
+    """
+    def channel(message_type, message_object):
+        socketio.emit(message_type, message_object, to=sid, namespace='/teisec')
+    return channel
+
+@socketio.on('connect', namespace='/teisec')  
+def connect():  
+    promptWorkerPool.open_session(request.sid)
+@socketio.on('disconnect', namespace='/teisec')  
+def disconnect(*args):  
+    promptWorkerPool.close_session(request.sid)
 @socketio.on('prompt', namespace='/teisec')  
 def run_prompt(user_prompt):  
     print('Received message: ' + user_prompt)  
-    processed_responses=teisecAgent.run_prompt('html',user_prompt,emit)
-    emit('completedmessage',{"message":'Processing Done'})
+    sid = request.sid
+    channel = session_channel(sid)
+    def prompt_completed(pending):
+        channel('completedmessage',{"message":'Processing Done',"pending":pending})
+    position = promptWorkerPool.submit(sid, 'html', user_prompt, channel, prompt_completed)
+    if position > 0:
+        emit('systemmessage',{"message":f'Prompt queued ({position} prompts ahead)'})
+@socketio.on('cancel_prompt', namespace='/teisec')  
+def cancel_prompt(cancel):  
+    print('Received message: Cancel Prompt' )  
+    dropped = promptWorkerPool.cancel(request.sid)
+    emit('debugmessage',{"message":f'Prompt cancelled ({dropped} queued prompts dropped)'})
 @socketio.on('clear_session', namespace='/teisec')  
 def clear_session(clear):  
     print('Received message: Clear Session' )  
-    processed_responses=teisecAgent.clear_session()
-    emit('debugmessage',{"message":'Session cleared'})
\ No newline at end of file
+    promptWorkerPool.clear_session(request.sid)
+    emit('debugmessage',{"message":'Session cleared'})
@@ -1,7 +1,13 @@
-from flask import session, redirect, url_for, render_template, request
+from flask import session, redirect, url_for, render_template, request, Response
+from app.Telemetry import telemetry
 from . import main
 
 
 @main.route('/', methods=['GET'])
 def index():
-    return render_template('homepage.html')
\ No newline at end of file
+    return render_template('homepage.html')
+
+@main.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus scrape endpoint with the duration histograms and counters of the prompt stages
+    return Response(telemetry.render_prometheus(), mimetype='text/plain; version=0.0.4')